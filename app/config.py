@@ -20,16 +20,49 @@ class AppConfig:
     RESULTS_DIR: str = _abs(os.getenv("RESULTS_DIR", "./results"))
     CLONED_VOICES_DIR: str = _abs(os.getenv("CLONED_VOICES_DIR", "./cloned_voices"))
     TTS_TMP_DIR: str = _abs(os.getenv("TTS_TMP_DIR", "./tmp/tts"))
+    # số request edge-tts chạy song song khi synth trước audio cho cả bài giảng
+    TTS_CONCURRENCY: int = int(os.getenv("TTS_CONCURRENCY", "4"))
+    # cache audio TTS theo (text, ngôn ngữ, voice, rate, engine); 0 = tắt
+    TTS_CACHE_DIR: str = _abs(os.getenv("TTS_CACHE_DIR", "./tmp/tts/cache"))
+    TTS_CACHE_MAX_MB: int = int(os.getenv("TTS_CACHE_MAX_MB", "512"))
 
     FFMPEG_PATH: str = os.getenv("FFMPEG_PATH", "ffmpeg")
     PIP_RATIO: float = float(os.getenv("PIP_RATIO", "0.10"))
     PIP_MARGIN: int = int(os.getenv("PIP_MARGIN", "50"))
     PIP_FPS: int = int(os.getenv("PIP_FPS", "25"))
+    # profile khung hình video bài giảng: 480p | 720p | 1080p (xem app/services/output_profiles.py)
+    OUTPUT_PROFILE: str = os.getenv("OUTPUT_PROFILE", "720p")
     FONT_PATH: str = os.getenv("FONT_PATH", "DejaVuSans.ttf")
+    # số slide được chuẩn bị / chờ overlay trước giữa các stage (TTS -> render -> overlay)
+    LECTURE_PIPELINE_QUEUE_SIZE: int = int(os.getenv("LECTURE_PIPELINE_QUEUE_SIZE", "1"))
 
     SADTALKER_CHECKPOINT_DIR: str = _abs(os.getenv("SADTALKER_CHECKPOINT_DIR", "./checkpoints"))
     SADTALKER_CONFIG_DIR: str = _abs(os.getenv("SADTALKER_CONFIG_DIR", "./src/config"))
     SADTALKER_RESULTS_DIR: str = _abs(os.getenv("SADTALKER_RESULTS_DIR", "./results"))
+    # RAM/VRAM budget cho các model SadTalker giữ warm trong process (0 = không giới hạn)
+    SADTALKER_MODEL_CACHE_MB: int = int(os.getenv("SADTALKER_MODEL_CACHE_MB", "4096"))
+    # cache crop + 3DMM của ảnh giáo viên theo hash nội dung (dùng lại giữa các slide / job)
+    SADTALKER_PREPROCESS_CACHE_DIR: str = _abs(os.getenv("SADTALKER_PREPROCESS_CACHE_DIR", "./tmp/sadtalker_preprocess"))
+
+    # Job queue: "rq" = đẩy vào Redis cho worker.py chạy, "thread" = chạy thread trong Flask (dev không có Redis)
+    JOB_RUNNER: str = os.getenv("JOB_RUNNER", "rq")
+    # "fakeredis://" = Redis giả trong process (test)
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # Flask (trước đây enqueue vào "default") và worker.py dùng chung 1 queue, mặc định "video_jobs"
+    # như worker cũ; job còn nằm trong "default" thì chạy: python worker.py -q default --burst
+    RQ_QUEUE_NAME: str = os.getenv("RQ_QUEUE_NAME", os.getenv("QUEUE_NAME", "video_jobs"))
+    RQ_JOB_TIMEOUT: int = int(os.getenv("RQ_JOB_TIMEOUT", os.getenv("RQ_DEFAULT_TIMEOUT", "3600")))
+    # worker.py: số process worker và số thread torch/BLAS mỗi process (0 = chia đều số core)
+    WORKER_COUNT: int = int(os.getenv("WORKER_COUNT", "1"))
+    WORKER_THREADS: int = int(os.getenv("WORKER_THREADS", "0"))
+    # chia bài giảng thành subtask từng slide cho nhiều worker: auto (khi >1 worker) | on | off
+    LECTURE_FANOUT: str = os.getenv("LECTURE_FANOUT", "auto")
+    # số lần RQ chạy lại subtask của một slide bị lỗi
+    SLIDE_TASK_RETRIES: int = int(os.getenv("SLIDE_TASK_RETRIES", "2"))
+
+    # SSE /api/jobs/<id>/events: chu kỳ stat progress.json (giây) và nhịp keep-alive
+    PROGRESS_WATCH_INTERVAL: float = float(os.getenv("PROGRESS_WATCH_INTERVAL", "0.5"))
+    SSE_KEEPALIVE: int = int(os.getenv("SSE_KEEPALIVE", "15"))
 
 def get_config() -> AppConfig:
     return AppConfig()
\ No newline at end of file
@@ -1,21 +1,41 @@
 # app/extensions.py
-import os
 from redis import Redis
 from rq import Queue
 
-# Redis URL: ví dụ "redis://localhost:6379/0"
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+from app.config import get_config
 
 redis_conn: Redis | None = None
 rq_queue: Queue | None = None
 
 
-def init_extensions(app=None):
+def _connect(url: str) -> Redis:
+    if url.startswith("fakeredis://"):
+        # Redis giả trong cùng process: chỉ dùng cho test (pip install fakeredis)
+        import fakeredis
+        return fakeredis.FakeRedis()
+    return Redis.from_url(url)
+
+
+def init_extensions(app=None, connection: Redis | None = None):
+    """ Tạo connection + queue dùng chung; connection truyền vào (vd FakeRedis) thay cho REDIS_URL. """
     global redis_conn, rq_queue
-    redis_conn = Redis.from_url(REDIS_URL)
+    cfg = get_config()
+    redis_conn = connection if connection is not None else _connect(cfg.REDIS_URL)
     rq_queue = Queue(
-        name=os.getenv("RQ_QUEUE_NAME", "default"),
+        name=cfg.RQ_QUEUE_NAME,
         connection=redis_conn,
-        default_timeout=int(os.getenv("RQ_DEFAULT_TIMEOUT", "3600")),  # 1h
+        default_timeout=cfg.RQ_JOB_TIMEOUT,
     )
     return rq_queue
+
+
+def get_redis() -> Redis:
+    if redis_conn is None:
+        init_extensions()
+    return redis_conn
+
+
+def get_queue() -> Queue:
+    if rq_queue is None:
+        init_extensions()
+    return rq_queue
@@ -1,37 +1,54 @@
 # app/jobs/lecture_job.py
 import os
 import time
+import threading
+import uuid
+from typing import Optional
 
 from app.services.storage_service import StorageService
-from app.services.lecture_service import LectureParams, build_lecture_from_inputs
+from app.services.lecture_service import (
+    LectureParams, LecturePlan, SlideRenderer,
+    build_lecture_from_inputs, resolve_slides, plan_lecture, finish_lecture, cleanup_cuda_memory,
+)
 from app.services.sadtalker_service import SadTalkerService
+from app.services.tts_service import TTSService
+from app.config import get_config
+from src.utils.cancellation import CancelToken, JobCancelled, use_token
+from src.utils.stage_progress import StageProgress, use_progress
 
 
-def run_lecture_job(job_id: str) -> dict:
-    store = StorageService()
+def rq_job_id(job_id: str) -> str:
+    # id của job trong RQ (chỉ chữ, số, -, _)
+    return f"lecture-{job_id}"
 
-    # ✅ đảm bảo thư mục results/<job_id> tồn tại (kể cả khi job_id không qua /jobs)
-    os.makedirs(store.job_result_dir(job_id), exist_ok=True)
 
-    cfg = store.load_job_config(job_id)
+def enqueue_lecture_job(job_id: str, queue=None):
+    """ Đẩy run_lecture_job(job_id) vào RQ; worker.py sẽ chạy. """
+    from app.extenstions import get_queue
+    queue = queue or get_queue()
+    return queue.enqueue(
+        run_lecture_job,
+        args=(job_id,),
+        job_id=rq_job_id(job_id),
+        job_timeout=get_config().RQ_JOB_TIMEOUT,
+        on_failure=on_lecture_job_failure,
+    )
 
-    source_image = store.get_uploaded(job_id, "source_image")
-    pptx = store.get_uploaded(job_id, "pptx")
-    slides_text = store.load_slides_text(job_id)
 
-    # progress callback -> ghi progress.json
-    def progress_cb(i: int, total: int, msg: str):
-        store.write_progress(job_id, {
-            "state": "running",
-            "current": i,
-            "total": total,
-            "message": msg,
-            "updated_at": int(time.time())
-        })
+def on_lecture_job_failure(job, connection, exc_type, exc_value, traceback):
+    """ RQ callback khi job chết ngoài try/except của run_lecture_job (worker bị kill, timeout...). """
+    job_id = job.args[0] if job.args else None
+    if not job_id:
+        return
+    StorageService().write_progress(job_id, {
+        "state": "failed",
+        "message": f"Job crashed: {exc_value}",
+        "updated_at": int(time.time())
+    })
 
-    store.write_progress(job_id, {"state": "running", "message": "Starting...", "updated_at": int(time.time())})
 
-    params = LectureParams(
+def _params_from_config(cfg: dict) -> LectureParams:
+    return LectureParams(
         language=cfg.get("language", "vi"),
         voice_mode=cfg.get("voice_mode", "builtin"),
         gender=cfg.get("gender", "Nữ"),
@@ -45,29 +62,18 @@ def run_lecture_job(job_id: str) -> dict:
         size_of_image=int(cfg.get("size_of_image", 256)),
         pose_style=int(cfg.get("pose_style", 0)),
         speech_rate=float(cfg.get("speech_rate", 1.0)),
+        single_pass=bool(cfg.get("single_pass", False)),
+        output_profile=cfg.get("output_profile"),
+        force_quality=bool(cfg.get("force_quality", False)),
     )
 
-    sad_service = SadTalkerService()
-    sad_talker_obj = sad_service._sad
-
-    try:
-        video_path, status = build_lecture_from_inputs(
-            sad_talker=sad_talker_obj,
-            pptx_path=pptx,
-            source_image_path=source_image,
-            params=params,
-            user_slides_text=slides_text,
-            job_id=job_id,
-            progress_cb=progress_cb
-        )
-    except Exception as e:
-        store.write_progress(job_id, {
-            "state": "failed",
-            "message": f"Exception: {e}",
-            "updated_at": int(time.time())
-        })
-        return {"ok": False, "status": str(e)}
 
+def _write_result(store: StorageService, job_id: str, video_path: Optional[str], status: str) -> dict:
+    """ Ghi progress done/failed cuối job từ kết quả (video_path, status) của pipeline. """
+    # slide hỏng được bỏ qua khi ghép; POST /jobs/<id>/retry render lại riêng các slide này
+    failed = [i + 1 for i in store.job_manifest(job_id).failed_slides()]
+    if failed and video_path:
+        status = f"{status} ⚠️ Bỏ qua slide lỗi: {', '.join(map(str, failed))}"
     if not video_path:
         store.write_progress(job_id, {"state": "failed", "message": status, "updated_at": int(time.time())})
         return {"ok": False, "status": status}
@@ -90,6 +96,404 @@ def run_lecture_job(job_id: str) -> dict:
         "state": "done",
         "message": status,
         "video_path": video_path,
+        "failed_slides": failed,
+        "updated_at": int(time.time())
+    })
+    return {"ok": True, "video_path": video_path, "status": status}
+
+
+class _ProgressWriter:
+    """
+    progress.json của job chạy trong 1 process: trạng thái chung (state/current/total/message) từ
+    progress_cb + "stages" đang chạy (tts / coeff / render % / composite) từ StageProgress.
+    """
+
+    def __init__(self, store: StorageService, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.stages = StageProgress(self._emit)
+        self._base: dict = {}
+        self._lock = threading.Lock()
+
+    def write(self, data: dict) -> None:
+        with self._lock:
+            self._base = data
+            self.store.write_progress(self.job_id, {**data, "stages": self.stages.snapshot()})
+
+    def _emit(self, active: list[dict]) -> None:
+        with self._lock:
+            # không đè "cancelling" của API
+            if self._base.get("state") != "running" or self.store.is_cancel_requested(self.job_id):
+                return
+            self.store.write_progress(self.job_id, {**self._base, "stages": active, "updated_at": int(time.time())})
+
+
+# ---------------- Cancel ----------------
+def _cancel_token(store: StorageService, job_id: str) -> CancelToken:
+    """ Token của job: tự cancel (và kill ffmpeg / LibreOffice đang chạy) khi API đặt cờ huỷ. """
+    return CancelToken(poll=lambda: store.is_cancel_requested(job_id)).watch()
+
+
+def _check_cancel(store: StorageService, job_id: str) -> None:
+    # gọi trước khi ghi progress để không đè trạng thái "cancelling" của API
+    if store.is_cancel_requested(job_id):
+        raise JobCancelled()
+
+
+def _write_cancelled(store: StorageService, job_id: str) -> dict:
+    """
+    Job đã dừng vì bị huỷ. Gọi sau khi ra khỏi except để traceback (các frame SadTalker giữ tensor)
+    đã được thả; model vẫn giữ warm trong registry. Checkpoint giữ nguyên nên /retry chạy tiếp được.
+    """
+    cleanup_cuda_memory()
+    store.write_progress(job_id, {"state": "cancelled", "message": "Cancelled", "updated_at": int(time.time())})
+    return {"ok": False, "cancelled": True, "status": "cancelled"}
+
+
+def cancel_lecture_job(job_id: str) -> bool:
+    """
+    Bỏ các job RQ chưa chạy của job_id (job chính, subtask từng slide, reduce).
+    Trả True nếu còn job đang chạy: job đó tự dừng khi thấy cờ huỷ (StorageService.request_cancel).
+    """
+    from app.extenstions import get_redis
+    return _cancel_rq_jobs([rq_job_id(job_id), *_fanout_job_ids(StorageService(), job_id)], get_redis())
+
+
+def _cancel_rq_jobs(rq_ids: list[str], conn) -> bool:
+    """ Cancel các job RQ còn chờ trong rq_ids; True nếu có job đang chạy. """
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError, InvalidJobOperation
+
+    running = False
+    for rid in rq_ids:
+        try:
+            job = Job.fetch(rid, connection=conn)
+        except NoSuchJobError:
+            continue
+        status = job.get_status()
+        if status == "started":
+            running = True
+        elif status in ("queued", "deferred", "scheduled"):
+            try:
+                job.cancel()
+            except InvalidJobOperation:
+                pass
+    return running
+
+
+def run_lecture_job(job_id: str) -> dict:
+    store = StorageService()
+
+    # ✅ đảm bảo thư mục results/<job_id> tồn tại (kể cả khi job_id không qua /jobs)
+    os.makedirs(store.job_result_dir(job_id), exist_ok=True)
+
+    token = _cancel_token(store, job_id)
+    try:
+        with use_token(token):
+            _check_cancel(store, job_id)
+            return _run_lecture_job(store, job_id)
+    except JobCancelled:
+        pass
+    finally:
+        token.close()
+    return _write_cancelled(store, job_id)
+
+
+def _run_lecture_job(store: StorageService, job_id: str) -> dict:
+    cfg = store.load_job_config(job_id)
+
+    source_image = store.get_uploaded(job_id, "source_image")
+    pptx = store.get_uploaded(job_id, "pptx")
+    slides_text = store.load_slides_text(job_id)
+
+    writer = _ProgressWriter(store, job_id)
+
+    # progress callback -> ghi progress.json
+    def progress_cb(i: int, total: int, msg: str):
+        _check_cancel(store, job_id)
+        writer.write({
+            "state": "running",
+            "current": i,
+            "total": total,
+            "message": msg,
+            "updated_at": int(time.time())
+        })
+
+    writer.write({"state": "running", "message": "Starting...", "updated_at": int(time.time())})
+
+    params = _params_from_config(cfg)
+
+    try:
+        if _should_fan_out(params):
+            fanned = _fan_out(store, job_id, pptx, source_image, params, slides_text)
+            if fanned is not None:
+                return fanned
+
+        sad_service = SadTalkerService()
+        with use_progress(writer.stages):
+            video_path, status = build_lecture_from_inputs(
+                sad_talker=sad_service._sad,
+                pptx_path=pptx,
+                source_image_path=source_image,
+                params=params,
+                user_slides_text=slides_text,
+                job_id=job_id,
+                progress_cb=progress_cb
+            )
+    except Exception as e:
+        store.write_progress(job_id, {
+            "state": "failed",
+            "message": f"Exception: {e}",
+            "updated_at": int(time.time())
+        })
+        return {"ok": False, "status": str(e)}
+
+    return _write_result(store, job_id, video_path, status)
+
+
+# ---------------- Fan-out: 1 subtask / slide trên các worker, rồi reduce ----------------
+def _should_fan_out(params: LectureParams) -> bool:
+    mode = (get_config().LECTURE_FANOUT or "auto").strip().lower()
+    if mode == "off" or params.single_pass:
+        return False
+    from rq import get_current_job, Worker
+    job = get_current_job()
+    if job is None:
+        # JOB_RUNNER=thread: không có queue để chia
+        return False
+    if mode == "on":
+        return True
+    queue = _job_queue(job)
+    return Worker.count(queue=queue) > 1
+
+
+def _job_queue(job):
+    from rq import Queue
+    return Queue(job.origin, connection=job.connection)
+
+
+def _slide_job_id(job_id: str, run_id: str, index: int) -> str:
+    # run_id trong id: lần fan-out sau không đụng job RQ (còn trong registry) của lần trước
+    return f"{rq_job_id(job_id)}-{run_id}-slide-{index+1:03d}"
+
+
+def _reduce_job_id(job_id: str, run_id: str) -> str:
+    return f"{rq_job_id(job_id)}-{run_id}-reduce"
+
+
+def _fanout_job_ids(store: StorageService, job_id: str) -> list[str]:
+    """ id RQ của subtask + reduce thuộc lần fan-out mới nhất của job (rỗng nếu chưa fan-out). """
+    fanout = store.load_fanout(job_id)
+    if fanout is None:
+        return []
+    run_id, plan = fanout["run_id"], fanout["plan"]
+    return [*(_slide_job_id(job_id, run_id, i) for i in range(plan.total)), _reduce_job_id(job_id, run_id)]
+
+
+def _load_run(store: StorageService, job_id: str, run_id: str) -> Optional[dict]:
+    """ Plan của run_id; None nếu job đã fan-out lại sau đó (subtask cũ thì bỏ qua). """
+    fanout = store.load_fanout(job_id)
+    if fanout is None or fanout["run_id"] != run_id:
+        print(f"[fan-out] {job_id}: run {run_id} superseded, skipping")
+        return None
+    return fanout
+
+
+def _fan_out(store: StorageService, job_id: str, pptx: Optional[str], source_image: str,
+             params: LectureParams, slides_text: str) -> Optional[dict]:
+    """
+    Map: enqueue run_slide_task cho từng slide chưa có segment dùng lại được (worker nào rảnh thì lấy),
+    reduce finish_lecture_task chạy khi mọi subtask xong (kể cả hỏng hẳn sau khi hết retry).
+    Trả None nếu không có gì để chia (lỗi input / 1 slide) -> chạy pipeline thường.
+    """
+    from rq import Retry, get_current_job
+    from rq.job import Dependency
+
+    slides_data, err = resolve_slides(pptx, params, slides_text)
+    if not slides_data or not source_image or len(slides_data) < 2:
+        return None
+    plan, err = plan_lecture(slides_data, source_image, params, job_id)
+    if plan is None:
+        return None
+
+    cfg = get_config()
+    queue = _job_queue(get_current_job())
+    manifest = store.job_manifest(job_id)
+    # job chạy lại (retry / regenerate): subtask chưa chạy của lần fan-out trước bị cancel, cái đang chạy
+    # dở vẫn chạy hết nhưng id mới có run_id riêng nên không đè lên nhau
+    _cancel_rq_jobs(_fanout_job_ids(store, job_id), queue.connection)
+    run_id = uuid.uuid4().hex[:8]
+    store.save_fanout(job_id, run_id, plan, slides_data)
+
+    # slide đã xong (segment dùng lại / checkpoint composite) không cần subtask;
+    # slide dở dang thì subtask tự tiếp tục từ stage chưa xong
+    subtasks = []
+    for i in range(plan.total):
+        if i in plan.reused:
+            continue
+        manifest.set_state(i, plan.keys[i], "queued")
+        subtasks.append(queue.enqueue(
+            run_slide_task,
+            args=(job_id, run_id, i),
+            job_id=_slide_job_id(job_id, run_id, i),
+            job_timeout=cfg.RQ_JOB_TIMEOUT,
+            retry=Retry(max=cfg.SLIDE_TASK_RETRIES) if cfg.SLIDE_TASK_RETRIES > 0 else None,
+        ))
+
+    queue.enqueue(
+        finish_lecture_task,
+        args=(job_id, run_id),
+        job_id=_reduce_job_id(job_id, run_id),
+        job_timeout=cfg.RQ_JOB_TIMEOUT,
+        on_failure=on_lecture_job_failure,
+        depends_on=Dependency(jobs=subtasks, allow_failure=True) if subtasks else None,
+    )
+    _report_fanout_progress(store, job_id, plan)
+    return {"ok": True, "status": f"fan-out {len(subtasks)}/{plan.total} slides"}
+
+
+def _report_fanout_progress(store: StorageService, job_id: str, plan: LecturePlan, msg: Optional[str] = None):
+    """
+    progress.json tổng hợp từ trạng thái từng slide (mỗi subtask ghi file riêng).
+    Best-effort: lỗi ghi progress chỉ log, không được làm hỏng (và tốn retry) slide đã render.
+    """
+    try:
+        _write_fanout_progress(store, job_id, plan, msg)
+    except Exception as e:
+        print(f"[fan-out] {job_id}: progress write failed: {e}")
+
+
+def _write_fanout_progress(store: StorageService, job_id: str, plan: LecturePlan, msg: Optional[str]):
+    statuses = {i: rec for i, rec in store.job_manifest(job_id).load_all().items()
+                if i < plan.total and rec.get("key") == plan.keys[i]}
+    done = len(plan.reused) + sum(1 for i, s in statuses.items() if s.get("state") == "done" and i not in plan.reused)
+    failed = sum(1 for s in statuses.values() if s.get("state") == "failed")
+    # stage đang chạy của các slide, mỗi subtask ghi vào record của slide mình
+    active = [e for s in statuses.values() if s.get("state") not in ("done", "failed", "cancelled")
+              for e in s.get("active") or []]
+    store.write_progress(job_id, {
+        "state": "cancelling" if store.is_cancel_requested(job_id) else "running",
+        "current": done,
+        "total": plan.total,
+        "failed": failed,
+        "message": msg or f"Rendered {done}/{plan.total} slides",
+        "slides": {str(i + 1): s.get("state") for i, s in sorted(statuses.items())},
+        "stages": sorted(active, key=lambda e: (e.get("slide") or 0, e.get("started_at") or 0)),
         "updated_at": int(time.time())
     })
-    return {"ok": True, "video_path": video_path, "status": status}
\ No newline at end of file
+
+
+def run_slide_task(job_id: str, run_id: str, index: int) -> dict:
+    """ Subtask của 1 slide: TTS -> SadTalker -> overlay, ra results/<job_id>/slide_NNN.mp4. """
+    store = StorageService()
+    fanout = _load_run(store, job_id, run_id)
+    if fanout is None:
+        return {"ok": False, "status": "superseded"}
+    plan, slide_data = fanout["plan"], fanout["slides"][index]
+    manifest = store.job_manifest(job_id)
+    key = plan.keys[index]
+
+    def progress_cb(i: int, total: int, msg: str):
+        _check_cancel(store, job_id)
+        manifest.set_state(index, key, "rendering")
+        _report_fanout_progress(store, job_id, plan, f"Processing slide {i}/{total}")
+
+    def on_stages(active: list[dict]):
+        if store.is_cancel_requested(job_id):
+            return
+        manifest.set_active(index, key, active)
+        _report_fanout_progress(store, job_id, plan)
+
+    sad_service = SadTalkerService()
+    renderer = SlideRenderer(plan, sad_service, TTSService(), progress_cb=progress_cb)
+    token = _cancel_token(store, job_id)
+    try:
+        with use_token(token), use_progress(StageProgress(on_stages)):
+            _check_cancel(store, job_id)
+            item = renderer.run_one(index, slide_data)
+        if item is None:
+            raise RuntimeError(f"slide {index+1}/{plan.total} failed")
+        _report_fanout_progress(store, job_id, plan)
+        return {"slide_mp4": item["slide_mp4"], "audio_duration": item["audio_duration"], "vcodec": item.get("vcodec")}
+    except JobCancelled:
+        # không raise lại: job bị huỷ thì không retry
+        pass
+    except Exception as e:
+        # raise lại để RQ retry (tiếp tục từ checkpoint); hết retry thì reduce bỏ qua slide này
+        if manifest.load(index).get("state") != "failed":
+            manifest.fail(index, key, "task", str(e))
+        _report_fanout_progress(store, job_id, plan)
+        raise
+    finally:
+        token.close()
+
+    manifest.set_state(index, key, "cancelled")
+    return _write_cancelled(store, job_id)
+
+
+def finish_lecture_task(job_id: str, run_id: str) -> dict:
+    """ Reduce: gom segment của mọi slide (theo đúng thứ tự) rồi ghép lecture_final.mp4. """
+    store = StorageService()
+    fanout = _load_run(store, job_id, run_id)
+    if fanout is None:
+        return {"ok": False, "status": "superseded"}
+    plan = fanout["plan"]
+    manifest = store.job_manifest(job_id)
+    if store.is_cancel_requested(job_id):
+        return _write_cancelled(store, job_id)
+
+    results = []
+    for i in range(plan.total):
+        if i in plan.reused:
+            results.append({
+                "reused": True,
+                "slide_mp4": plan.segment_path(i),
+                "audio_duration": float(plan.reused[i].get("duration", 0.0)),
+                "vcodec": plan.reused[i].get("vcodec"),
+            })
+            continue
+        stage, out = manifest.resume(i, plan.keys[i])
+        results.append({
+            "slide_mp4": out["slide_mp4"],
+            "audio_duration": float(out.get("audio_duration", 0.0)),
+            "vcodec": out.get("vcodec"),
+            "teacher_video_path": out.get("teacher_video_path"),
+        } if stage == "composite" else None)
+
+    _report_fanout_progress(store, job_id, plan, "Concatenating slides...")
+    token = _cancel_token(store, job_id)
+    try:
+        with use_token(token):
+            video_path, status = finish_lecture(plan, results)
+        return _write_result(store, job_id, video_path, status)
+    except JobCancelled:
+        pass
+    except Exception as e:
+        store.write_progress(job_id, {
+            "state": "failed",
+            "message": f"Exception: {e}",
+            "updated_at": int(time.time())
+        })
+        return {"ok": False, "status": str(e)}
+    finally:
+        token.close()
+    return _write_cancelled(store, job_id)
+
+
+def lecture_job_active(job_id: str) -> bool:
+    """ Job (hoặc bước reduce của nó) còn đang queued/chạy trong RQ không; False = có thể chạy lại. """
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError
+    from app.extenstions import get_redis
+
+    conn = get_redis()
+    fanout = StorageService().load_fanout(job_id)
+    reduce_ids = [_reduce_job_id(job_id, fanout["run_id"])] if fanout is not None else []
+    for rid in (rq_job_id(job_id), *reduce_ids):
+        try:
+            status = Job.fetch(rid, connection=conn).get_status()
+        except NoSuchJobError:
+            continue
+        if status in ("queued", "started", "deferred", "scheduled"):
+            return True
+    return False
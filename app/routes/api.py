@@ -1,11 +1,15 @@
 # app/routes/api.py
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file
 import os
+import json
+import queue
 import threading
 from app.services.storage_service import StorageService
 from app.services.pptx_service import extract_slides_from_pptx, format_slides_as_text
 from app.services.tts_service import TTSService
-from app.config import get_config
+from app.services.output_profiles import get_output_profile
+from app.services.progress_events import TERMINAL_STATES, get_progress_hub
+from app.config import get_config as get_app_config  # get_config là tên route bên dưới
 
 api = Blueprint("api", __name__, url_prefix="/api")
 
@@ -110,7 +114,8 @@ def extract(job_id: str):
     if not pptx:
         return jsonify({"ok": False, "error": "Missing PPTX. Upload first."}), 400
 
-    slides = extract_slides_from_pptx(pptx)
+    job_cfg = store.load_job_config(job_id) or {}
+    slides = extract_slides_from_pptx(pptx, max_width=get_output_profile(job_cfg.get("output_profile")).width)
     slides_text = format_slides_as_text(slides)
 
     store.save_slides_data(job_id, slides)
@@ -134,6 +139,38 @@ def status(job_id: str):
     return jsonify(store.read_progress(job_id))
 
 
+@api.get("/jobs/<job_id>/events")
+def events(job_id: str):
+    """
+    SSE: đẩy progress.json mỗi khi job ghi lại (kèm "stages": tts / coeff / render % / composite đang chạy).
+    Stream đóng sau trạng thái cuối (done / failed / cancelled); /status vẫn giữ cho client polling.
+    """
+    hub = get_progress_hub()
+    keepalive = get_app_config().SSE_KEEPALIVE
+    q = hub.subscribe(job_id)
+
+    def _stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    prog = q.get(timeout=keepalive)
+                except queue.Empty:
+                    # comment SSE: giữ kết nối qua proxy + phát hiện client đã đóng tab
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(prog, ensure_ascii=False)}\n\n"
+                if prog.get("state") in TERMINAL_STATES:
+                    return
+        finally:
+            hub.unsubscribe(job_id, q)
+
+    return Response(_stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",   # nginx: không buffer stream
+    })
+
+
 @api.get("/jobs/<job_id>/result")
 def result(job_id: str):
     store = StorageService()
@@ -158,7 +195,21 @@ def result(job_id: str):
     return send_file(video_path, as_attachment=True)
 
 
-from app.jobs.lecture_job import run_lecture_job
+from app.jobs.lecture_job import run_lecture_job, enqueue_lecture_job, lecture_job_active, cancel_lecture_job
+from app.services.lecture_service import load_segment_manifest, save_segment_manifest
+
+
+def _job_in_progress(job_id: str, prog: dict) -> bool:
+    if prog.get("state") not in ("running", "queued", "cancelling"):
+        return False
+    if get_app_config().JOB_RUNNER == "thread":
+        return True
+    # progress kẹt ở running nhưng job RQ đã chết (worker bị kill/restart) -> cho chạy lại, job tự resume
+    try:
+        return lecture_job_active(job_id)
+    except Exception:
+        return True
+
 
 @api.post("/jobs/<job_id>/generate")
 def generate(job_id: str):
@@ -166,8 +217,9 @@ def generate(job_id: str):
 
     # (tuỳ chọn) chặn chạy lại nếu job đang running
     prog = store.read_progress(job_id) or {}
-    if prog.get("state") in ("running", "queued"):
+    if _job_in_progress(job_id, prog):
         return jsonify({"ok": True, "status": prog}), 200
+    store.clear_cancel(job_id)
 
     # ghi trạng thái queued trước khi chạy
     store.write_progress(job_id, {
@@ -176,6 +228,25 @@ def generate(job_id: str):
         "updated_at": int(__import__("time").time())
     })
 
+    if get_app_config().JOB_RUNNER == "thread":
+        _start_thread_job(store, job_id)
+        return jsonify({"ok": True, "job_id": job_id})
+
+    try:
+        enqueue_lecture_job(job_id)
+    except Exception as e:
+        store.write_progress(job_id, {
+            "state": "failed",
+            "message": f"Cannot enqueue job: {e}",
+            "updated_at": int(__import__("time").time())
+        })
+        return jsonify({"ok": False, "error": f"Cannot enqueue job: {e}"}), 503
+
+    return jsonify({"ok": True, "job_id": job_id})
+
+
+def _start_thread_job(store: StorageService, job_id: str):
+    """ JOB_RUNNER=thread: chạy job ngay trong process Flask (dev, không có Redis/worker). """
     def _runner():
         try:
             run_lecture_job(job_id)
@@ -192,4 +263,58 @@ def generate(job_id: str):
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true" or os.environ.get("FLASK_ENV") != "development":
         threading.Thread(target=_runner, daemon=True).start()
 
-    return jsonify({"ok": True, "job_id": job_id})
\ No newline at end of file
+
+@api.post("/jobs/<job_id>/cancel")
+def cancel(job_id: str):
+    """
+    Huỷ job: job còn trong queue bị bỏ luôn; job đang chạy dừng ở chunk render / frame enhancer / slide
+    kế tiếp, ffmpeg / LibreOffice đang chạy bị kill. Checkpoint giữ nguyên nên /retry chạy tiếp được.
+    """
+    store = StorageService()
+    prog = store.read_progress(job_id) or {}
+    if not _job_in_progress(job_id, prog):
+        return jsonify({"ok": False, "error": "Job is not running", "status": prog}), 409
+
+    # ghi "cancelling" trước khi đặt cờ: job chỉ ghi "cancelled" sau khi thấy cờ nên không bị đè ngược
+    now = int(__import__("time").time())
+    store.write_progress(job_id, {**prog, "state": "cancelling", "message": "Cancelling...", "updated_at": now})
+    store.request_cancel(job_id)
+
+    running = True
+    if get_app_config().JOB_RUNNER != "thread":
+        try:
+            running = cancel_lecture_job(job_id)
+        except Exception as e:
+            print(f"cancel RQ jobs failed: {e}")
+    if not running:
+        # không còn gì đang chạy để tự ghi trạng thái cuối
+        store.write_progress(job_id, {"state": "cancelled", "message": "Cancelled", "updated_at": now})
+
+    return jsonify({"ok": True, "status": store.read_progress(job_id)})
+
+
+@api.post("/jobs/<job_id>/retry")
+def retry(job_id: str):
+    """
+    Chạy lại job: slide đã xong được giữ nguyên (checkpoint), slide lỗi / dở dang render tiếp.
+    Body (tuỳ chọn): {"slides": [3, 5]} -> bỏ checkpoint các slide này (đánh số từ 1) để render lại từ đầu.
+    """
+    store = StorageService()
+    prog = store.read_progress(job_id) or {}
+    if _job_in_progress(job_id, prog):
+        return jsonify({"ok": False, "error": "Job is still running", "status": prog}), 409
+
+    payload = request.get_json(silent=True) or {}
+    manifest = store.job_manifest(job_id)
+    segments = load_segment_manifest(store.job_result_dir(job_id))
+    for n in payload.get("slides") or []:
+        try:
+            n = int(n)
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": f"Invalid slide number: {n}"}), 400
+        manifest.reset(n - 1)
+        segments.pop(f"slide_{n:03d}.mp4", None)
+    if payload.get("slides"):
+        save_segment_manifest(store.job_result_dir(job_id), segments)
+
+    return generate(job_id)
@@ -0,0 +1,142 @@
+# app/services/job_manifest.py
+import hashlib
+import json
+import os
+import time
+from contextlib import suppress
+from typing import Optional
+
+MANIFEST_VERSION = 1
+# thứ tự stage của một slide; stage sau đã bao hàm output của stage trước
+SLIDE_STAGES = ("prepare", "render", "composite")
+
+
+def file_sha256(path: Optional[str]) -> str:
+    if not path or not os.path.isfile(path):
+        return ""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class JobManifest:
+    """
+    Checkpoint từng slide của một job, mỗi slide một file results/<job_id>/slides/slide_NNN.json:
+
+        {"version", "index", "key", "state", "error", "updated_at",
+         "stages": {"prepare": {"outputs": {...}, "sha256": {"audio_path": "...", ...}}, ...}}
+
+    key là segment_key của slide: slide bị sửa thì record cũ tự mất hiệu lực.
+    Một slide chỉ có một writer tại một thời điểm (pipeline hoặc subtask RQ của nó),
+    nên các worker ghi song song các slide khác nhau không cần lock.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.dir = os.path.join(output_dir, "slides")
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.dir, f"slide_{index+1:03d}.json")
+
+    # ---- đọc / ghi ----
+    def load(self, index: int) -> dict:
+        try:
+            with open(self.path(index), "r", encoding="utf-8") as f:
+                rec = json.load(f)
+            return rec if isinstance(rec, dict) and rec.get("version") == MANIFEST_VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def load_all(self) -> dict[int, dict]:
+        out = {}
+        if not os.path.isdir(self.dir):
+            return out
+        for fn in os.listdir(self.dir):
+            if fn.startswith("slide_") and fn.endswith(".json"):
+                with suppress(ValueError):
+                    i = int(fn[6:-5]) - 1
+                    rec = self.load(i)
+                    if rec:
+                        out[i] = rec
+        return out
+
+    def _save(self, index: int, rec: dict):
+        os.makedirs(self.dir, exist_ok=True)
+        rec.update(version=MANIFEST_VERSION, index=index, updated_at=int(time.time()))
+        path = self.path(index)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rec, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def _record(self, index: int, key: str) -> dict:
+        rec = self.load(index)
+        if rec.get("key") != key:
+            # slide đổi nội dung / params: bỏ hết checkpoint cũ
+            rec = {"key": key, "stages": {}}
+        return rec
+
+    # ---- trạng thái ----
+    def set_state(self, index: int, key: str, state: str, **extra):
+        """ queued | running | rendering | done | failed | cancelled (+ error, ...) """
+        rec = self._record(index, key)
+        rec.update(state=state, **extra)
+        if state != "failed":
+            rec.pop("error", None)
+        self._save(index, rec)
+
+    def checkpoint(self, index: int, key: str, stage: str, outputs: dict, files: tuple[str, ...] = ()):
+        """ Ghi output của stage (path trong outputs[f] cho f in files được hash để verify lúc resume). """
+        rec = self._record(index, key)
+        stages = rec.setdefault("stages", {})
+        # stage sau của lần chạy trước không còn khớp với output mới
+        for later in SLIDE_STAGES[SLIDE_STAGES.index(stage) + 1:]:
+            stages.pop(later, None)
+        stages[stage] = {
+            "outputs": outputs,
+            "sha256": {f: file_sha256(outputs.get(f)) for f in files},
+        }
+        rec["state"] = "done" if stage == SLIDE_STAGES[-1] else "running"
+        rec.pop("error", None)
+        self._save(index, rec)
+
+    def set_active(self, index: int, key: str, active: list[dict]):
+        """ Stage đang chạy của slide (StageProgress.snapshot()), gom vào progress.json của job fan-out. """
+        rec = self._record(index, key)
+        rec["active"] = active
+        self._save(index, rec)
+
+    def fail(self, index: int, key: str, stage: str, error: str):
+        self.set_state(index, key, "failed", error=f"{stage}: {error}")
+
+    def reset(self, index: int):
+        """ Bỏ checkpoint của slide để lần chạy sau render lại từ đầu. """
+        with suppress(OSError):
+            os.remove(self.path(index))
+
+    def resume(self, index: int, key: str) -> tuple[Optional[str], dict]:
+        """
+        Stage mới nhất của slide còn dùng được (file output còn đó, hash khớp) + outputs gộp của
+        các stage tới đó. (None, {}) = chạy lại từ đầu.
+        """
+        rec = self.load(index)
+        if rec.get("key") != key:
+            return None, {}
+        stages = rec.get("stages") or {}
+        for stage in reversed(SLIDE_STAGES):
+            st = stages.get(stage)
+            if not st:
+                continue
+            outputs = st.get("outputs") or {}
+            if all(sha and file_sha256(outputs.get(f)) == sha for f, sha in (st.get("sha256") or {}).items()):
+                merged = {}
+                for s in SLIDE_STAGES[:SLIDE_STAGES.index(stage) + 1]:
+                    merged.update((stages.get(s) or {}).get("outputs") or {})
+                return stage, merged
+        return None, {}
+
+    def failed_slides(self) -> list[int]:
+        """ index (0-based) các slide đang ở trạng thái failed """
+        return sorted(i for i, rec in self.load_all().items() if rec.get("state") == "failed")
@@ -2,21 +2,31 @@
 import os
 import re
 import gc
+import math
 import time
 import json
 import shutil
+import hashlib
+import functools
 import subprocess
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict, replace
 from datetime import datetime
 from typing import Optional, Any
 from app.services.sadtalker_service import SadTalkerService, SadTalkerParams
 import torch
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import VideoFileClip, concatenate_videoclips, AudioFileClip
+from moviepy.editor import AudioFileClip
 
 from app.config import get_config
 from app.services.pptx_service import extract_slides_from_pptx
 from app.services.tts_service import TTSService, TTSRequest
+from app.services.staged_pipeline import StagedPipeline
+from app.services.output_profiles import OutputProfile, get_output_profile
+from app.services.job_manifest import JobManifest, file_sha256
+from src.utils.encoding import THREAD_BUDGET, cpu_fallback, get_encoding_profile
+from src.utils.audio_stage import normalize_audio
+from src.utils.cancellation import check_cancelled, run as cancellable_run
+from src.utils.stage_progress import track_stage
 
 
 # ---------------- Utilities ----------------
@@ -153,53 +163,152 @@ def _ensure_even_image(path: str) -> None:
         bg.save(path)
 
 
+# mọi segment slide_NNN.mp4 trong 1 bài giảng dùng chung các thông số này,
+# nên concat demuxer -c copy luôn ghép được (không rơi vào nhánh re-encode)
+SEGMENT_AUDIO_RATE = 48000
+SEGMENT_AUDIO_CHANNELS = 2
+
+
+def lecture_canvas_size(slides_data: list[dict], profile: OutputProfile) -> tuple[int, int]:
+    """ Khung hình chung của cả bài: tỉ lệ ảnh slide đầu tiên (ảnh export từ PPT) fit vào profile, kích thước chẵn. """
+    for slide in slides_data:
+        path = slide.get("image_path")
+        if path and os.path.exists(path):
+            try:
+                with Image.open(path) as im:
+                    return profile.fit(*im.size)
+            except Exception:
+                continue
+    return profile.fit(16, 9)
+
+
+def fit_slide_image(path: str, canvas: tuple[int, int]) -> None:
+    """ Scale slide 1 lần (lanczos) vào đúng canvas, viền trắng nếu khác tỉ lệ; ffmpeg không phải scale từng frame. """
+    with Image.open(path) as im:
+        if im.size == tuple(canvas):
+            return
+        im = im.convert("RGB")
+        scale = min(canvas[0] / im.width, canvas[1] / im.height)
+        resized = im.resize((max(1, round(im.width * scale)), max(1, round(im.height * scale))), Image.LANCZOS)
+    bg = Image.new("RGB", tuple(canvas), (255, 255, 255))
+    bg.paste(resized, ((canvas[0] - resized.width) // 2, (canvas[1] - resized.height) // 2))
+    bg.save(path)
+
+
 def pip_composite_ffmpeg(slide_png: str, teacher_mp4: str, out_mp4: str,
                          pip_ratio: float, margin: int, fps: int,
-                         prefer_nvenc: bool = True) -> None:
+                         prefer_nvenc: bool = True,
+                         canvas: Optional[tuple[int, int]] = None,
+                         profile: Optional[OutputProfile] = None) -> str:
+    """
+    Overlay teacher lên slide, encode 1 lần ra segment slide_NNN.mp4.
+    canvas: (w, h) chung của cả bài, slide được scale + pad vào khung này.
+    profile: CRF / bitrate của output profile.
+    Trả về vcodec đã dùng (h264_nvenc hoặc libx264).
+    """
     cfg = get_config()
     ffmpeg = cfg.FFMPEG_PATH
 
     if shutil.which(ffmpeg) is None:
         raise RuntimeError(f"ffmpeg không có trong PATH hoặc FFMPEG_PATH sai: {ffmpeg}")
 
-    _ensure_even_image(slide_png)
-
-    with Image.open(slide_png) as im:
-        slide_w, _ = im.size
-    teacher_target_w = max(1, int(slide_w * pip_ratio))
+    if canvas is None:
+        _ensure_even_image(slide_png)
+        with Image.open(slide_png) as im:
+            canvas = im.size
+    canvas_w, canvas_h = canvas
+    teacher_target_w = max(2, int(canvas_w * pip_ratio) // 2 * 2)
 
-    vcodec = "h264_nvenc" if prefer_nvenc else "libx264"
-    preset = "p5" if vcodec == "h264_nvenc" else "ultrafast"
+    # encoder chọn theo kết quả probe 1 lần / process: máy không có GPU không spawn nvenc thất bại mỗi slide
+    enc = get_encoding_profile("slide", ffmpeg=ffmpeg, crf=profile.crf if profile else None,
+                               fps=fps, prefer_gpu=prefer_nvenc)
+    rate_args: list[str] = []
+    if profile is not None and profile.video_bitrate:
+        rate_args = ["-maxrate", profile.video_bitrate, "-bufsize", profile.video_bitrate]
 
     filter_complex = (
-        "[0:v]pad=ceil(iw/2)*2:ceil(ih/2)*2[bg];"
+        f"[0:v]scale={canvas_w}:{canvas_h}:force_original_aspect_ratio=decrease,"
+        f"pad={canvas_w}:{canvas_h}:(ow-iw)/2:(oh-ih)/2:white,setsar=1[bg];"
         f"[1:v]scale={teacher_target_w}:-2:flags=lanczos[face];"
         f"[bg][face]overlay=W-w-{margin}:{margin},format=yuv420p[vout]"
     )
 
-    cmd = [
-        ffmpeg, "-y",
-        "-loop", "1", "-i", slide_png,
-        "-i", teacher_mp4,
-        "-filter_complex", filter_complex,
-        "-map", "[vout]",
-        "-map", "1:a?",
-        "-c:v", vcodec,
-        "-preset", preset,
-        "-pix_fmt", "yuv420p",
-        "-r", str(fps),
-        "-shortest",
-        "-c:a", "copy",
-        out_mp4
-    ]
-
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def _encode(enc):
+        with THREAD_BUDGET.slot() as threads:
+            cmd = [
+                ffmpeg, "-y",
+                "-loop", "1", "-i", slide_png,
+                "-i", teacher_mp4,
+                "-filter_complex", filter_complex,
+                "-map", "[vout]",
+                "-map", "1:a?",
+                *enc.video_args(threads=threads),
+                *rate_args,
+                "-r", str(fps),
+                "-shortest",
+                "-c:a", "aac",
+                "-ar", str(SEGMENT_AUDIO_RATE),
+                "-ac", str(SEGMENT_AUDIO_CHANNELS),
+                out_mp4
+            ]
+            return cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    p = _encode(enc)
+    if p.returncode != 0 and enc.vcodec == "h264_nvenc":
+        # nvenc lỗi giữa chừng (hết session, driver...): encode lại bằng libx264, giữ CRF / GOP
+        enc = cpu_fallback(enc)
+        p = _encode(enc)
     if p.returncode != 0:
-        if vcodec == "h264_nvenc":
-            # fallback libx264
-            return pip_composite_ffmpeg(slide_png, teacher_mp4, out_mp4, pip_ratio, margin, fps, prefer_nvenc=False)
         err = p.stderr.decode("utf-8", errors="ignore")
         raise RuntimeError(f"ffmpeg overlay failed: {err}")
+    return enc.vcodec
+
+
+def concat_segments_ffmpeg(pieces: list[str], out_mp4: str, fps: int, reencode: bool = False) -> None:
+    """
+    Ghép các segment.
+    - reencode=False: concat demuxer -c copy (segment cùng thông số, không encode lại)
+    - reencode=True: 1 lần ffmpeg với concat filter, encode đúng 1 lần cho cả bài
+    """
+    cfg = get_config()
+    ffmpeg = cfg.FFMPEG_PATH
+
+    if not reencode:
+        concat_list = out_mp4 + ".concat.txt"
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for p in pieces:
+                ap = os.path.abspath(p).replace("'", r"'\''")
+                f.write(f"file '{ap}'\n")
+        cmd = [ffmpeg, "-y", "-f", "concat", "-safe", "0", "-i", concat_list, "-c", "copy",
+               "-movflags", "+faststart", out_mp4]
+        try:
+            p = cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+            try:
+                os.remove(concat_list)
+            except Exception:
+                pass
+    else:
+        cmd = [ffmpeg, "-y"]
+        for p in pieces:
+            cmd += ["-i", p]
+        streams = "".join(f"[{k}:v][{k}:a]" for k in range(len(pieces)))
+        enc = get_encoding_profile("concat", ffmpeg=ffmpeg, fps=fps)
+        with THREAD_BUDGET.slot() as threads:
+            cmd += [
+                "-filter_complex", f"{streams}concat=n={len(pieces)}:v=1:a=1[v][a]",
+                "-map", "[v]", "-map", "[a]",
+                *enc.video_args(threads=threads),
+                "-r", str(fps),
+                "-c:a", "aac", "-ar", str(SEGMENT_AUDIO_RATE), "-ac", str(SEGMENT_AUDIO_CHANNELS),
+                "-movflags", "+faststart",
+                out_mp4
+            ]
+            p = cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    if p.returncode != 0:
+        err = p.stderr.decode("utf-8", errors="ignore")
+        raise RuntimeError(f"ffmpeg concat failed: {err[-2000:]}")
 
 
 def adjust_audio_speed(in_path: str, rate: float) -> str:
@@ -228,7 +337,7 @@ def adjust_audio_speed(in_path: str, rate: float) -> str:
         atempo_chain = ",".join(filters)
 
         cmd = [ffmpeg, "-y", "-i", in_path, "-filter:a", atempo_chain, out_path]
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p = cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if p.returncode != 0:
             err = p.stderr.decode("utf-8", errors="ignore")
             raise RuntimeError(f"ffmpeg atempo failed: {err}")
@@ -255,13 +364,49 @@ class LectureParams:
     preprocess_type: str = "crop"
     is_still_mode: bool = False
     enhancer: bool = False
-    batch_size: int = 2
+    batch_size: int = 2                         # hint cho renderer, kích thước batch thật chọn theo RAM/VRAM
     size_of_image: int = 256
     pose_style: int = 0
 
     # speed
     speech_rate: float = 1.0
 
+    # render cả bài trong 1 lần SadTalker rồi cắt theo ranh giới slide
+    single_pass: bool = False
+
+    # output: "480p" | "720p" | "1080p", None = OUTPUT_PROFILE trong config
+    output_profile: Optional[str] = None
+
+    # True = giữ nguyên size/enhancer/preprocess user chọn, không tự hạ theo kích thước PiP
+    force_quality: bool = False
+
+
+def plan_teacher_render(params: LectureParams, canvas_w: int, pip_ratio: float) -> LectureParams:
+    """
+    Chọn cấu hình render rẻ nhất mà vẫn đủ nét cho khung PiP thật trên video:
+    - teacher hiển thị rộng ~canvas_w * pip_ratio px (720p, PIP_RATIO=0.10 -> 128px)
+    - model 512 chỉ khi PiP rộng hơn 256px, GFPGAN chỉ khi PiP không nhỏ hơn nhiều so với frame render
+    - full/extfull (paste-back vào cả ảnh) -> crop khi PiP nhỏ hơn frame 256
+    """
+    if params.force_quality:
+        return params
+
+    pip_w = max(1, int(canvas_w * pip_ratio))
+    changes = {}
+
+    size = params.size_of_image
+    if size > 256 and pip_w <= 256:
+        changes["size_of_image"] = size = 256
+    if params.enhancer and pip_w < int(size * 0.75):
+        changes["enhancer"] = False
+    if params.preprocess_type in ("full", "extfull") and pip_w < 256:
+        changes["preprocess_type"] = "crop"
+
+    if changes:
+        print(f"🎯 Teacher PiP ~{pip_w}px wide, render plan: {changes} (set force_quality to keep the original)")
+        return replace(params, **changes)
+    return params
+
 
 def generate_teacher_video(
     sad_service: SadTalkerService,   # ✅ dùng service wrapper
@@ -270,10 +415,13 @@ def generate_teacher_video(
     params: LectureParams,
     tts_service: TTSService,
     job_id: Optional[str] = None,    # ✅ thêm job_id
-    pre_synth_audio_path: Optional[str] = None
+    pre_synth_audio_path: Optional[str] = None,
+    apply_speech_rate: bool = True,
+    pre_synth_wav=None
 ) -> Optional[str]:
     """
     Sinh video teacher từ audio đã có hoặc synth bằng TTSService.
+    pre_synth_wav: mẫu 16 kHz mono float32 của pre_synth_audio_path (từ normalize_audio), SadTalker khỏi đọc lại file.
     """
     max_retries = 3
     retry_count = 0
@@ -301,12 +449,14 @@ def generate_teacher_video(
             if not audio_path:
                 return None
 
-            audio_path = adjust_audio_speed(audio_path, params.speech_rate)
+            if apply_speech_rate:
+                audio_path = adjust_audio_speed(audio_path, params.speech_rate)
 
             video_path = sad_service.generate(
                 job_id=job_id or "nojob",
                 source_image_path=source_image_path,
                 audio_path=audio_path,
+                audio_wav=pre_synth_wav if audio_path == pre_synth_audio_path else None,
                 params=SadTalkerParams(
                     preprocess_type=params.preprocess_type,
                     is_still_mode=params.is_still_mode,
@@ -346,20 +496,215 @@ def generate_teacher_video(
     return None
 
 
-def create_lecture_video(
-    sad_talker,
-    slides_data: list[dict],
-    source_image_path: str,
-    params: LectureParams,
-    job_id: Optional[str] = None,
-    progress_cb=None,  # callable(slide_index:int, total:int, message:str)
-) -> tuple[Optional[str], str]:
+# ---------------- Single-pass teacher track ----------------
+SADTALKER_FPS = 25
+# audio slide đã được normalize về 16 kHz; 640 sample / frame nên ranh giới slide luôn rơi đúng mép frame
+TRACK_SAMPLE_RATE = 16000
+
+
+def concat_slide_audio(audio_paths: list[str], out_wav: str, fps: int = SADTALKER_FPS) -> list[tuple[int, int]]:
     """
-    Core: tạo lecture_final.mp4
+    Nối audio các slide thành 1 track. Mỗi slide được pad im lặng tới bội số của 1 frame video,
+    trả về ranh giới [start_frame, end_frame) của từng slide trên track.
+    """
+    from pydub import AudioSegment
+
+    samples_per_frame = TRACK_SAMPLE_RATE // fps
+    track = AudioSegment.empty()
+    bounds: list[tuple[int, int]] = []
+    cursor = 0
+    for p in audio_paths:
+        seg = AudioSegment.from_file(p).set_frame_rate(TRACK_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+        n_samples = int(seg.frame_count())
+        n_frames = max(1, math.ceil(n_samples / samples_per_frame))
+        pad = n_frames * samples_per_frame - n_samples
+        if pad > 0:
+            seg = seg + AudioSegment.silent(duration=pad * 1000.0 / TRACK_SAMPLE_RATE, frame_rate=TRACK_SAMPLE_RATE)
+        track = track + seg
+        bounds.append((cursor, cursor + n_frames))
+        cursor += n_frames
+
+    track.export(out_wav, format="wav")
+    return bounds
+
+
+def _count_video_frames(path: str) -> int:
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+
+
+def cut_teacher_video(teacher_mp4: str, bounds: list[tuple[int, int]], output_dir: str,
+                      fps: int = SADTALKER_FPS) -> list[Optional[str]]:
+    """
+    Cắt video teacher theo ranh giới frame (trim/atrim, encode lại nên cắt đúng frame, không phụ thuộc keyframe)
+    và kiểm tra A/V sync tại mỗi điểm cắt. Đoạn cắt lỗi hoặc lệch số frame so với audio của slide trả về None
+    để slide đó render lại riêng.
     """
     cfg = get_config()
-    tts_service = TTSService()
-    sad_service = SadTalkerService()    
+    ffmpeg = cfg.FFMPEG_PATH
+
+    rendered = _count_video_frames(teacher_mp4)
+    expected = bounds[-1][1] if bounds else 0
+    if rendered and abs(rendered - expected) > 1:
+        print(f"⚠️ teacher track has {rendered} frames, expected {expected}: slide cuts may drift")
+
+    enc = get_encoding_profile("face", ffmpeg=ffmpeg)
+    pieces: list[Optional[str]] = []
+    for k, (a, b) in enumerate(bounds):
+        out_mp4 = os.path.join(output_dir, f"teacher_part_{k+1:03d}.mp4")
+        with THREAD_BUDGET.slot() as threads:
+            cmd = [
+                ffmpeg, "-y", "-i", teacher_mp4,
+                "-vf", f"trim=start_frame={a}:end_frame={b},setpts=PTS-STARTPTS",
+                "-af", f"atrim=start={a / fps:.6f}:end={b / fps:.6f},asetpts=PTS-STARTPTS",
+                *enc.video_args(threads=threads),
+                "-c:a", "aac",
+                out_mp4
+            ]
+            p = cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0 or not os.path.exists(out_mp4):
+            err = p.stderr.decode("utf-8", errors="ignore")
+            print(f"cut teacher part {k+1} failed: {err[-500:]}")
+            pieces.append(None)
+            continue
+
+        # A/V sync: đoạn cắt phải đúng số frame của audio slide (lệch tối đa 1 frame)
+        got = _count_video_frames(out_mp4)
+        if got and abs(got - (b - a)) > 1:
+            print(f"⚠️ teacher part {k+1}: {got} frames, expected {b - a} (A/V drift at cut), rendering slide alone")
+            try:
+                os.remove(out_mp4)
+            except Exception:
+                pass
+            pieces.append(None)
+            continue
+        pieces.append(out_mp4)
+    return pieces
+
+
+def render_teacher_track(sad_service: SadTalkerService, source_image_path: str, audio_paths: list[str],
+                         params: "LectureParams", job_id: Optional[str], output_dir: str) -> list[Optional[str]]:
+    """
+    Chạy SadTalker 1 lần trên audio đã nối của nhiều slide, trả về video teacher đã cắt cho từng slide.
+    """
+    track_wav = os.path.join(output_dir, "lecture_track.wav")
+    bounds = concat_slide_audio(audio_paths, track_wav)
+
+    # audio từng slide đã được chỉnh speech_rate rồi, không chỉnh lại trên track
+    teacher_full = generate_teacher_video(
+        sad_service=sad_service,
+        source_image_path=source_image_path,
+        text="",
+        params=params,
+        tts_service=None,
+        job_id=job_id,
+        pre_synth_audio_path=track_wav,
+        apply_speech_rate=False,
+    )
+    try:
+        if not teacher_full:
+            return [None] * len(audio_paths)
+        return cut_teacher_video(teacher_full, bounds, output_dir)
+    finally:
+        for p in (track_wav, teacher_full):
+            try:
+                if p and os.path.exists(p):
+                    os.remove(p)
+            except Exception:
+                pass
+
+
+# ---------------- Segment cache ----------------
+# tăng khi đổi cách render / overlay một slide để các segment cũ tự mất hiệu lực
+SEGMENT_FORMAT_VERSION = 1
+SEGMENT_MANIFEST_NAME = "segments.json"
+
+
+_file_sha256 = file_sha256
+
+
+def segment_key(slide_data: dict, source_image_hash: str, params: "LectureParams",
+                canvas: tuple[int, int] = (0, 0)) -> str:
+    """
+    Key của một segment slide_NNN.mp4: text, ảnh slide, ảnh giáo viên, voice/LectureParams,
+    phiên bản model + thông số overlay. Khớp key thì dùng lại segment, không render lại.
+    """
+    cfg = get_config()
+    payload = {
+        "text": (slide_data.get("text") or "").strip(),
+        "slide_image": _file_sha256(slide_data.get("image_path")),
+        "source_image": source_image_hash,
+        "params": asdict(params),
+        "model": [SEGMENT_FORMAT_VERSION, os.path.basename(cfg.SADTALKER_CHECKPOINT_DIR)],
+        "pip": [cfg.PIP_RATIO, cfg.PIP_MARGIN, cfg.PIP_FPS],
+        "segment": [list(canvas), SEGMENT_AUDIO_RATE, SEGMENT_AUDIO_CHANNELS],
+        "profile": asdict(get_output_profile(params.output_profile)),
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def load_segment_manifest(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, SEGMENT_MANIFEST_NAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def save_segment_manifest(output_dir: str, manifest: dict) -> None:
+    path = os.path.join(output_dir, SEGMENT_MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _tts_request(params: LectureParams, text: str) -> TTSRequest:
+    return TTSRequest(
+        text=text,
+        language=params.language,
+        gender=params.gender,
+        preferred_voice=params.builtin_voice,
+        voice_mode=params.voice_mode,
+        cloned_voice_name=params.cloned_voice_name,
+        cloned_lang=params.cloned_lang,
+    )
+
+
+@dataclass
+class LecturePlan:
+    """
+    Những gì mọi slide của một bài giảng dùng chung: thư mục output, ảnh giáo viên, LectureParams
+    đã chọn cấu hình render, canvas, key segment của từng slide và các segment còn dùng lại được.
+    Picklable: _fan_out lưu 1 bản qua StorageService.save_fanout cho các subtask RQ.
+    """
+    job_id: Optional[str]
+    output_dir: str
+    source_image: str                   # bản copy trong output_dir
+    params: LectureParams
+    canvas: tuple[int, int]
+    keys: list[str]
+    reused: dict[int, dict]
+    old_manifest: dict
+
+    @property
+    def total(self) -> int:
+        return len(self.keys)
+
+    def segment_path(self, i: int) -> str:
+        return os.path.abspath(os.path.join(self.output_dir, f"slide_{i+1:03d}.mp4"))
+
+
+def plan_lecture(slides_data: list[dict], source_image_path: str, params: LectureParams,
+                 job_id: Optional[str] = None) -> tuple[Optional[LecturePlan], str]:
+    """ Chuẩn bị output dir + canvas + key segment; trả (None, lỗi) nếu thiếu input. """
+    cfg = get_config()
     if not slides_data:
         return None, "❌ Không có slide nào để xử lý!"
 
@@ -374,15 +719,113 @@ def create_lecture_video(
     safe_image_path = os.path.join(output_dir, "source_image.png")
     if not source_image_path or not os.path.exists(source_image_path):
         return None, "❌ Không tìm thấy ảnh nguồn!"
-    shutil.copy2(source_image_path, safe_image_path)
+    if os.path.abspath(source_image_path) != os.path.abspath(safe_image_path):
+        shutil.copy2(source_image_path, safe_image_path)
+
+    # segment nào còn khớp key (slide không đổi) thì dùng lại, chỉ render các slide bị sửa
+    profile = get_output_profile(params.output_profile)
+    canvas = lecture_canvas_size(slides_data, profile)
+    params = plan_teacher_render(params, canvas[0], cfg.PIP_RATIO)
+    source_hash = _file_sha256(safe_image_path)
+    keys = [segment_key(slide_data, source_hash, params, canvas) for slide_data in slides_data]
+    old_manifest = load_segment_manifest(output_dir)
+    reused: dict[int, dict] = {}
+    for i, key in enumerate(keys):
+        name = f"slide_{i+1:03d}.mp4"
+        entry = old_manifest.get(name)
+        if entry and entry.get("key") == key and os.path.isfile(os.path.join(output_dir, name)):
+            reused[i] = entry
+            continue
+        # job bị ngắt giữa chừng: slide đã composite xong (checkpoint còn khớp hash) thì không render lại
+        stage, outputs = JobManifest(output_dir).resume(i, key)
+        if stage == "composite":
+            reused[i] = {"key": key, "duration": outputs.get("audio_duration", 0.0), "vcodec": outputs.get("vcodec")}
+    if reused:
+        print(f"♻️ Reusing {len(reused)}/{len(keys)} slide segments")
+
+    return LecturePlan(
+        job_id=job_id,
+        output_dir=output_dir,
+        source_image=safe_image_path,
+        params=params,
+        canvas=canvas,
+        keys=keys,
+        reused=reused,
+        old_manifest=old_manifest,
+    ), ""
+
+
+def _slide_stage(name: str):
+    """ Báo stage `name` của slide i đang chạy (progress chi tiết: tts / render % / composite). """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(self, i: int, *args, **kwargs):
+            with track_stage(name, slide=i + 1):
+                return fn(self, i, *args, **kwargs)
+        return wrapper
+    return deco
+
+
+class SlideRenderer:
+    """
+    3 bước của một slide: prepare (slide png + audio) -> render (SadTalker) -> composite (PiP ffmpeg).
+    Dùng chung cho pipeline trong process (create_lecture_video) và subtask từng slide trên worker RQ.
+    Mỗi bước trả None nếu slide hỏng. Output mỗi bước được checkpoint vào JobManifest nên job chạy lại
+    tiếp tục từ stage chưa xong đầu tiên của từng slide.
+    """
 
-    total_duration = 0.0
-    temp_teacher_videos: list[str] = []
-    final_piece_files: list[str] = []
+    def __init__(self, plan: LecturePlan, sad_service: SadTalkerService, tts_service: TTSService,
+                 audio_futures: Optional[dict] = None, progress_cb=None):
+        self.plan = plan
+        self.cfg = get_config()
+        self.profile = get_output_profile(plan.params.output_profile)
+        self.sad_service = sad_service
+        self.tts_service = tts_service
+        # index slide -> Future[audio path] đã synth trước; slide không có thì synth lúc prepare
+        self.audio_futures = audio_futures or {}
+        self.progress_cb = progress_cb
+        self.manifest = JobManifest(plan.output_dir)
+
+    def _fail(self, i: int, stage: str, error: str) -> None:
+        self.manifest.fail(i, self.plan.keys[i], stage, error)
+        return None
 
-    for i, slide_data in enumerate(slides_data):
-        if progress_cb:
-            progress_cb(i + 1, len(slides_data), f"Processing slide {i+1}/{len(slides_data)}")
+    # ---- stage 1: slide png + chờ audio + atempo (chạy trước slide đang render) ----
+    @_slide_stage("tts")
+    def prepare(self, i: int, slide_data: dict) -> Optional[dict]:
+        check_cancelled()
+        plan, cfg, params = self.plan, self.cfg, self.plan.params
+        output_dir = plan.output_dir
+        if i in plan.reused:
+            return {
+                "reused": True,
+                "slide_mp4": plan.segment_path(i),
+                "audio_duration": float(plan.reused[i].get("duration", 0.0)),
+                "vcodec": plan.reused[i].get("vcodec"),
+            }
+
+        key = plan.keys[i]
+        stage, done = self.manifest.resume(i, key)
+        if stage == "composite":
+            return {
+                "reused": True,
+                "slide_mp4": done["slide_mp4"],
+                "audio_duration": float(done.get("audio_duration", 0.0)),
+                "vcodec": done.get("vcodec"),
+            }
+        self.manifest.set_state(i, key, "running")
+        if stage in ("prepare", "render") and os.path.isfile(done.get("slide_png") or ""):
+            # chạy lại sau khi bị ngắt: dùng lại slide png + audio (+ teacher video) đã có
+            print(f"⏩ Slide {i+1}: resuming after '{stage}'")
+            item = {
+                "text": slide_data.get("text", ""),
+                "slide_png": done["slide_png"],
+                "audio_path": done["audio_path"],
+                "audio_duration": float(done.get("audio_duration", 3.0)),
+            }
+            if stage == "render":
+                item["teacher_video_path"] = done["teacher_video_path"]
+            return item
 
         slide_png = os.path.join(output_dir, f"slide_{i+1:02d}.png")
         original_image = slide_data.get("image_path")
@@ -392,21 +835,18 @@ def create_lecture_video(
                 shutil.copy2(original_image, slide_png)
             except Exception:
                 if not create_slide_image_with_text(slide_data.get("text", ""), slide_png):
-                    continue
+                    return self._fail(i, "prepare", "cannot create slide image")
         else:
             if not create_slide_image_with_text(slide_data.get("text", ""), slide_png):
-                continue
+                return self._fail(i, "prepare", "cannot create slide image")
+        fit_slide_image(slide_png, plan.canvas)
 
-        # 1) synth audio 1 lần cho slide
-        audio_path = tts_service.synthesize(TTSRequest(
-            text=slide_data.get("text", ""),
-            language=params.language,
-            gender=params.gender,
-            preferred_voice=params.builtin_voice,
-            voice_mode=params.voice_mode,
-            cloned_voice_name=params.cloned_voice_name,
-            cloned_lang=params.cloned_lang,
-        ))
+        # audio của slide đã được synth trước (song song) bởi synthesize_many
+        future = self.audio_futures.get(i)
+        if future is not None:
+            audio_path = future.result()
+        else:
+            audio_path = self.tts_service.synthesize(_tts_request(params, slide_data.get("text", "")))
         if not audio_path:
             # silent fallback
             try:
@@ -415,109 +855,182 @@ def create_lecture_video(
                 AudioSegment.silent(duration=3000).export(silent_wav, format="wav")
                 audio_path = silent_wav
             except Exception:
-                continue
+                return self._fail(i, "prepare", "TTS failed")
 
-        audio_path = adjust_audio_speed(audio_path, params.speech_rate)
-        audio_duration = get_audio_duration(audio_path)
+        # decode + atempo + 16 kHz mono đúng 1 lần; SadTalker dùng lại wav + mảng trong RAM
+        norm_path = os.path.join(output_dir, f"audio_{i+1:03d}.wav")
+        try:
+            norm = normalize_audio(audio_path, norm_path, rate=params.speech_rate, ffmpeg=cfg.FFMPEG_PATH)
+        except Exception as e:
+            print("audio normalization failed:", e)
+            return self._fail(i, "prepare", f"audio normalization failed: {e}")
+        finally:
+            try:
+                if os.path.exists(audio_path) and os.path.abspath(audio_path) != os.path.abspath(norm_path):
+                    os.remove(audio_path)
+            except Exception:
+                pass
+
+        audio_duration = norm.duration
         if audio_duration <= 0.1:
             audio_duration = 3.0
 
-        # 2) generate teacher video using pre_synth_audio
+        self.manifest.checkpoint(i, key, "prepare",
+                                 {"slide_png": slide_png, "audio_path": norm.path, "audio_duration": audio_duration},
+                                 files=("slide_png", "audio_path"))
+        return {
+            "text": slide_data.get("text", ""),
+            "slide_png": slide_png,
+            "audio_path": norm.path,
+            "audio_wav": norm.wav,
+            "audio_duration": audio_duration,
+        }
+
+    # ---- stage 2: SadTalker (GPU), từng slide một theo thứ tự ----
+    @_slide_stage("render")
+    def render(self, i: int, item: dict) -> Optional[dict]:
+        check_cancelled()
+        total = self.plan.total
+        if self.progress_cb:
+            self.progress_cb(i + 1, total, f"Processing slide {i+1}/{total}")
+        if item.get("reused") or item.get("teacher_video_path"):
+            return item
+
         teacher_video_path = generate_teacher_video(
-            sad_service=sad_service,
-            source_image_path=safe_image_path,
-            text=slide_data.get("text", ""),
-            params=params,
-            tts_service=tts_service,
-            job_id=job_id,
-            pre_synth_audio_path=audio_path
+            sad_service=self.sad_service,
+            source_image_path=self.plan.source_image,
+            text=item["text"],
+            params=self.plan.params,
+            tts_service=self.tts_service,
+            job_id=self.plan.job_id,
+            pre_synth_audio_path=item["audio_path"],
+            pre_synth_wav=item.pop("audio_wav", None),
+            apply_speech_rate=False,
         )
         cleanup_cuda_memory()
 
         if not teacher_video_path or not os.path.exists(teacher_video_path):
             try:
-                if os.path.exists(audio_path):
-                    os.remove(audio_path)
+                if os.path.exists(item["audio_path"]):
+                    os.remove(item["audio_path"])
             except Exception:
                 pass
-            continue
-
-        # 3) overlay PIP
-        slide_mp4 = os.path.abspath(os.path.join(output_dir, f"slide_{i+1:03d}.mp4"))
+            return self._fail(i, "render", "SadTalker produced no video")
+
+        return self.rendered(i, item, teacher_video_path)
+
+    def rendered(self, i: int, item: dict, teacher_video_path: str) -> dict:
+        """ Ghi nhận teacher video của slide (từ render() hoặc track single-pass). """
+        item["teacher_video_path"] = teacher_video_path
+        self.manifest.checkpoint(i, self.plan.keys[i], "render",
+                                 {"teacher_video_path": teacher_video_path}, files=("teacher_video_path",))
+        return item
+
+    # ---- stage 3: overlay PIP (ffmpeg, CPU) trong lúc slide sau đang render ----
+    @_slide_stage("composite")
+    def composite(self, i: int, item: dict) -> Optional[dict]:
+        check_cancelled()
+        if item.get("reused"):
+            return item
+        cfg = self.cfg
+        slide_mp4 = self.plan.segment_path(i)
         try:
-            pip_composite_ffmpeg(
-                slide_png=slide_png,
-                teacher_mp4=teacher_video_path,
+            item["vcodec"] = pip_composite_ffmpeg(
+                slide_png=item["slide_png"],
+                teacher_mp4=item["teacher_video_path"],
                 out_mp4=slide_mp4,
                 pip_ratio=cfg.PIP_RATIO,
                 margin=cfg.PIP_MARGIN,
                 fps=cfg.PIP_FPS,
-                prefer_nvenc=True
+                prefer_nvenc=True,
+                canvas=self.plan.canvas,
+                profile=self.profile,
             )
         except Exception as e:
             print("overlay failed:", e)
-            continue
+            return self._fail(i, "composite", f"overlay failed: {e}")
 
-        final_piece_files.append(slide_mp4)
-        temp_teacher_videos.append(teacher_video_path)
-        total_duration += audio_duration
+        self.manifest.checkpoint(i, self.plan.keys[i], "composite",
+                                 {"slide_mp4": slide_mp4, "vcodec": item["vcodec"],
+                                  "audio_duration": item["audio_duration"]},
+                                 files=("slide_mp4",))
 
         # cleanup temp
         time.sleep(0.2)
-        try:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-        except Exception:
-            pass
-        try:
-            if os.path.exists(slide_png):
-                os.remove(slide_png)
-        except Exception:
-            pass
+        for p in (item["audio_path"], item["slide_png"]):
+            try:
+                if os.path.exists(p):
+                    os.remove(p)
+            except Exception:
+                pass
+
+        item["slide_mp4"] = slide_mp4
+        return item
+
+    def run_one(self, i: int, slide_data: dict) -> Optional[dict]:
+        """ Cả 3 bước cho một slide (subtask RQ). """
+        item = self.prepare(i, slide_data)
+        if item is not None:
+            item = self.render(i, item)
+        if item is not None:
+            item = self.composite(i, item)
+        return item
+
+
+def finish_lecture(plan: LecturePlan, results: list[Optional[dict]]) -> tuple[Optional[str], str]:
+    """
+    Reduce: ghi manifest segment, ghép các slide_NNN.mp4 thành lecture_final.mp4 rồi dọn file tạm.
+    results[i] là kết quả SlideRenderer của slide i (None = slide hỏng, bị bỏ qua).
+    """
+    cfg = get_config()
+    output_dir = plan.output_dir
+    done = [r for r in results if r is not None]
+
+    final_piece_files: list[str] = [r["slide_mp4"] for r in done]
+    temp_teacher_videos: list[str] = [r["teacher_video_path"] for r in done if r.get("teacher_video_path")]
+    total_duration = sum(r["audio_duration"] for r in done)
+
+    # ghi lại manifest; segment của slide đã bị xoá khỏi deck thì dọn luôn
+    manifest = {}
+    for i, r in enumerate(results):
+        if r is not None:
+            manifest[os.path.basename(r["slide_mp4"])] = {
+                "key": plan.keys[i], "duration": r["audio_duration"], "vcodec": r.get("vcodec"),
+            }
+    for name in plan.old_manifest:
+        if name not in manifest:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError:
+                pass
+    save_segment_manifest(output_dir, manifest)
+    # checkpoint của slide đã bị xoá khỏi deck
+    job_manifest = JobManifest(output_dir)
+    for i in job_manifest.load_all():
+        if i >= plan.total:
+            job_manifest.reset(i)
 
     if not final_piece_files:
         return None, "❌ Không thể tạo video cho bất kỳ slide nào!"
 
+    check_cancelled()
     final_video_path = os.path.join(output_dir, "lecture_final.mp4")
 
-    # concat fast
-    concat_list = os.path.join(output_dir, "concat_list.txt")
-    with open(concat_list, "w", encoding="utf-8") as f:
-        for p in final_piece_files:
-            ap = os.path.abspath(p).replace("'", r"'\''")
-            f.write(f"file '{ap}'\n")
-
-    ffmpeg = cfg.FFMPEG_PATH
-    cmd = [ffmpeg, "-y", "-f", "concat", "-safe", "0", "-i", concat_list, "-c", "copy", final_video_path]
-    try:
-        subprocess.run(cmd, check=True)
-    except Exception as e:
-        print("ffmpeg concat failed, fallback moviepy:", e)
+    # segment cùng canvas/fps/audio nên -c copy ghép được; chỉ khi encoder khác nhau
+    # (nvenc lỗi giữa chừng -> libx264) mới encode lại cả bài trong 1 lần ffmpeg
+    codecs = {r.get("vcodec") for r in done}
+    reencode = len(codecs) > 1 or None in codecs
+    with track_stage("concat"):
         try:
-            reopened = [VideoFileClip(p) for p in final_piece_files]
-            final_clip = concatenate_videoclips(reopened, method="chain")
-            final_clip.write_videofile(
-                final_video_path,
-                codec="libx264",
-                audio_codec="aac",
-                verbose=False,
-                logger=None,
-                preset="ultrafast",
-                ffmpeg_params=["-crf", "23"]
-            )
-            for rc in reopened:
-                try:
-                    rc.close()
-                except Exception:
-                    pass
-        except Exception as concat_fallback_error:
-            return None, f"❌ Failed to concatenate video clips: {concat_fallback_error}"
-
-    # cleanup concat list
-    try:
-        os.remove(concat_list)
-    except Exception:
-        pass
+            concat_segments_ffmpeg(final_piece_files, final_video_path, fps=cfg.PIP_FPS, reencode=reencode)
+        except Exception as e:
+            if reencode:
+                return None, f"❌ Failed to concatenate video clips: {e}"
+            print("ffmpeg concat copy failed, re-encoding in one pass:", e)
+            try:
+                concat_segments_ffmpeg(final_piece_files, final_video_path, fps=cfg.PIP_FPS, reencode=True)
+            except Exception as concat_fallback_error:
+                return None, f"❌ Failed to concatenate video clips: {concat_fallback_error}"
 
     # cleanup teacher videos
     for v in temp_teacher_videos:
@@ -529,7 +1042,7 @@ def create_lecture_video(
 
     # cleanup ONLY SadTalker subfolders inside this job
     try:
-        sadtalker_root = os.path.join(cfg.RESULTS_DIR, job_id or "", "sadtalker")
+        sadtalker_root = os.path.join(cfg.RESULTS_DIR, plan.job_id or "", "sadtalker")
         if os.path.isdir(sadtalker_root):
             for item in os.listdir(sadtalker_root):
                 p = os.path.join(sadtalker_root, item)
@@ -543,39 +1056,128 @@ def create_lecture_video(
         pass
 
     cleanup_cuda_memory()
-    status_text = f"✅ Hoàn thành! {len(slides_data)} slide, tổng thời gian ước tính: {total_duration:.1f}s"
+    status_text = f"✅ Hoàn thành! {plan.total} slide, tổng thời gian ước tính: {total_duration:.1f}s"
     return final_video_path, status_text
 
 
-def build_lecture_from_inputs(
+def create_lecture_video(
     sad_talker,
-    pptx_path: Optional[str],
+    slides_data: list[dict],
     source_image_path: str,
     params: LectureParams,
-    user_slides_text: Optional[str] = None,
     job_id: Optional[str] = None,
-    progress_cb=None,
+    progress_cb=None,  # callable(slide_index:int, total:int, message:str)
 ) -> tuple[Optional[str], str]:
     """
-    Thay cho generate_lecture_video_handler (Gradio).
+    Core: tạo lecture_final.mp4
     """
+    cfg = get_config()
+    plan, err = plan_lecture(slides_data, source_image_path, params, job_id)
+    if plan is None:
+        return None, err
+
+    tts_service = TTSService()
+    sad_service = SadTalkerService()
+    params = plan.params
+    total = plan.total
+
+    # bắn hết request TTS ngay từ đầu, slide 1 render được ngay khi audio của nó xong
+    render_idx = [i for i in range(total) if i not in plan.reused]
+    futures = tts_service.synthesize_many(
+        [_tts_request(params, slides_data[i].get("text", "")) for i in render_idx],
+        concurrency=cfg.TTS_CONCURRENCY,
+    )
+    renderer = SlideRenderer(plan, sad_service, tts_service,
+                             audio_futures=dict(zip(render_idx, futures)), progress_cb=progress_cb)
+
+    try:
+        if params.single_pass:
+            # audio vẫn prefetch song song; SadTalker chạy 1 lần trên cả track rồi cắt theo ranh giới slide
+            prepared = [renderer.prepare(i, slide_data) for i, slide_data in enumerate(slides_data)]
+            to_render = [i for i, item in enumerate(prepared)
+                         if item is not None and not item.get("reused") and not item.get("teacher_video_path")]
+            for i in to_render:
+                # track được ghép từ file wav, không cần giữ mảng trong RAM
+                prepared[i].pop("audio_wav", None)
+            if to_render:
+                if progress_cb:
+                    progress_cb(0, total, f"Rendering teacher track for {len(to_render)} slides")
+                with track_stage("render"):
+                    pieces = render_teacher_track(
+                        sad_service, plan.source_image, [prepared[i]["audio_path"] for i in to_render],
+                        params, job_id, plan.output_dir
+                    )
+                cleanup_cuda_memory()
+                for i, piece in zip(to_render, pieces):
+                    if piece:
+                        renderer.rendered(i, prepared[i], piece)
+                        continue
+                    # đoạn cắt lỗi / lệch A/V: render riêng slide này từ audio của nó (render() tự ghi lỗi nếu hỏng)
+                    prepared[i] = renderer.render(i, prepared[i])
+
+            results = []
+            for i, item in enumerate(prepared):
+                if progress_cb:
+                    progress_cb(i + 1, total, f"Processing slide {i+1}/{total}")
+                results.append(renderer.composite(i, item) if item is not None else None)
+        else:
+            def on_skip(stage: str, i: int):
+                # slide hỏng ở prepare không tới render(): vẫn báo progress để current/total đếm đủ
+                if stage == "render" and progress_cb:
+                    progress_cb(i + 1, total, f"Skipped slide {i+1}/{total} (failed)")
+
+            pipeline = StagedPipeline(
+                [("prepare", renderer.prepare), ("render", renderer.render), ("composite", renderer.composite)],
+                maxsize=cfg.LECTURE_PIPELINE_QUEUE_SIZE,
+                on_skip=on_skip,
+            )
+            results = pipeline.run(slides_data)
+    finally:
+        # pipeline dừng giữa chừng (lỗi / huỷ): request TTS đã bắn trước không chạy tiếp, xoá mp3 tạm
+        tts_service.discard(futures)
+
+    return finish_lecture(plan, results)
+
+
+def resolve_slides(pptx_path: Optional[str], params: LectureParams,
+                   user_slides_text: Optional[str] = None) -> tuple[list[dict], str]:
+    """ Ghép text user nhập với ảnh slide từ PPTX; trả ([], lỗi) nếu không có slide nào. """
     user_slides = parse_user_slides_text(user_slides_text or "")
 
     ppt_slides = []
     if pptx_path:
-        ppt_slides = extract_slides_from_pptx(pptx_path)
+        # rasterize thẳng ở chiều rộng của output profile
+        ppt_slides = extract_slides_from_pptx(pptx_path, max_width=get_output_profile(params.output_profile).width)
 
     if user_slides:
         slides_data = merge_user_text_with_ppt_images(user_slides, ppt_slides)
     else:
         if not ppt_slides:
-            return None, "❌ Vui lòng chọn PowerPoint hoặc nhập nội dung slide!"
+            return [], "❌ Vui lòng chọn PowerPoint hoặc nhập nội dung slide!"
         slides_data = ppt_slides
 
+    if not slides_data:
+        return [], "❌ Không có slide nào để xử lý!"
+    return slides_data, ""
+
+
+def build_lecture_from_inputs(
+    sad_talker,
+    pptx_path: Optional[str],
+    source_image_path: str,
+    params: LectureParams,
+    user_slides_text: Optional[str] = None,
+    job_id: Optional[str] = None,
+    progress_cb=None,
+) -> tuple[Optional[str], str]:
+    """
+    Thay cho generate_lecture_video_handler (Gradio).
+    """
+    slides_data, err = resolve_slides(pptx_path, params, user_slides_text)
+    if not slides_data:
+        return None, err
     if not source_image_path:
         return None, "❌ Vui lòng chọn ảnh giáo viên!"
-    if not slides_data:
-        return None, "❌ Không có slide nào để xử lý!"
 
     return create_lecture_video(
         sad_talker=sad_talker,
@@ -0,0 +1,43 @@
+# app/services/output_profiles.py
+from dataclasses import dataclass
+from typing import Optional
+
+from app.config import get_config
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """
+    Khung hình + chất lượng encode của video bài giảng.
+    width/height là hộp giới hạn: slide được fit vào hộp này (giữ tỉ lệ), PiP tính theo width thật.
+    """
+    name: str
+    width: int
+    height: int
+    crf: int                              # libx264 -crf / nvenc -cq
+    video_bitrate: Optional[str] = None   # vd "2M": giới hạn bitrate (VBV) thay vì CRF thuần
+
+    def fit(self, src_w: int, src_h: int) -> tuple[int, int]:
+        """ Kích thước (chẵn) khi fit ảnh src_w x src_h vào profile, giữ tỉ lệ. """
+        if src_w <= 0 or src_h <= 0:
+            return self.width, self.height
+        scale = min(self.width / src_w, self.height / src_h)
+        w = max(2, int(round(src_w * scale / 2)) * 2)
+        h = max(2, int(round(src_h * scale / 2)) * 2)
+        return w, h
+
+
+OUTPUT_PROFILES: dict[str, OutputProfile] = {
+    "480p": OutputProfile("480p", 854, 480, crf=26),
+    "720p": OutputProfile("720p", 1280, 720, crf=23),
+    "1080p": OutputProfile("1080p", 1920, 1080, crf=21),
+}
+
+
+def get_output_profile(name: Optional[str] = None) -> OutputProfile:
+    """ Lấy profile theo tên; tên rỗng / không hợp lệ thì dùng OUTPUT_PROFILE trong config. """
+    key = (name or "").strip().lower()
+    if key in OUTPUT_PROFILES:
+        return OUTPUT_PROFILES[key]
+    default = (get_config().OUTPUT_PROFILE or "").strip().lower()
+    return OUTPUT_PROFILES.get(default, OUTPUT_PROFILES["720p"])
@@ -4,7 +4,7 @@ import time
 import tempfile
 import subprocess
 from shutil import which
-from typing import Any
+from typing import Any, Optional
 
 from pdf2image import convert_from_path
 from pptx import Presentation
@@ -16,6 +16,7 @@ except Exception:
     pytesseract = None
 
 from src.utils.math_formula_processor import MathFormulaProcessor, process_math_text
+from src.utils.cancellation import run as cancellable_run
 from app.config import get_config
 
 
@@ -32,9 +33,11 @@ def _as_path(p: Any) -> str | None:
     return getattr(p, "name", None)
 
 
-def convert_pptx_to_images(pptx_path: str, dpi: int = 220) -> list[str]:
+def convert_pptx_to_images(pptx_path: str, dpi: int = 220, max_width: Optional[int] = None) -> list[str]:
     """
     PPTX -> PDF bằng LibreOffice -> PNG bằng pdf2image.
+    max_width: rasterize thẳng ở chiều rộng này (giữ tỉ lệ) thay vì theo dpi,
+    để không phải encode ảnh ~2900px cho video 720p.
     Trả về list đường dẫn ảnh slide PNG.
     """
     cfg = get_config()
@@ -48,7 +51,7 @@ def convert_pptx_to_images(pptx_path: str, dpi: int = 220) -> list[str]:
 
     tmpdir = tempfile.mkdtemp(prefix="pptx2img_", dir=cfg.TMP_DIR if os.path.isdir(cfg.TMP_DIR) else None)
 
-    subprocess.run(
+    cancellable_run(
         [lo, "--headless", "--convert-to", "pdf", "--outdir", tmpdir, pptx_path],
         check=True,
         stdout=subprocess.DEVNULL,
@@ -65,6 +68,8 @@ def convert_pptx_to_images(pptx_path: str, dpi: int = 220) -> list[str]:
 
     poppler_path = cfg.POPPLER_PATH
     kwargs = dict(dpi=dpi, output_folder=tmpdir, fmt="png")
+    if max_width:
+        kwargs["size"] = (int(max_width), None)
     if poppler_path:
         kwargs["poppler_path"] = poppler_path
 
@@ -78,7 +83,7 @@ def convert_pptx_to_images(pptx_path: str, dpi: int = 220) -> list[str]:
     return out
 
 
-def extract_slides_from_pptx(pptx_file_or_path: Any, dpi: int = 220) -> list[dict]:
+def extract_slides_from_pptx(pptx_file_or_path: Any, dpi: int = 220, max_width: Optional[int] = None) -> list[dict]:
     """
     Output chuẩn hoá:
     [
@@ -94,7 +99,7 @@ def extract_slides_from_pptx(pptx_file_or_path: Any, dpi: int = 220) -> list[dic
     if not pptx_path or not os.path.exists(pptx_path):
         raise RuntimeError("Không tìm thấy file PowerPoint hợp lệ.")
 
-    imgs = convert_pptx_to_images(pptx_path, dpi=dpi)
+    imgs = convert_pptx_to_images(pptx_path, dpi=dpi, max_width=max_width)
     slides: list[dict] = []
 
     # Ưu tiên MathFormulaProcessor
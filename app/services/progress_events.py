@@ -0,0 +1,104 @@
+# app/services/progress_events.py
+import queue
+import threading
+import time
+from contextlib import suppress
+from typing import Optional
+
+from app.config import get_config
+from app.services.storage_service import StorageService
+
+# trạng thái cuối: gửi xong thì đóng stream
+TERMINAL_STATES = ("done", "failed", "cancelled")
+
+
+def _offer(q: queue.Queue, item: dict) -> None:
+    # client chậm chỉ cần bản mới nhất: đầy thì bỏ bản cũ nhất
+    try:
+        q.put_nowait(item)
+    except queue.Full:
+        with suppress(queue.Empty):
+            q.get_nowait()
+        with suppress(queue.Full):
+            q.put_nowait(item)
+
+
+class ProgressHub:
+    """
+    Đẩy progress.json của job tới các client SSE.
+
+    Một thread cho cả process stat progress.json của những job đang có client nghe; file đổi thì đọc lại
+    đúng 1 lần và phát cho mọi client của job đó. Bao nhiêu tab mở cũng chỉ tốn 1 stat / job / chu kỳ,
+    thay vì mỗi tab một request + StorageService + đọc file mỗi 1.5 s. Không còn ai nghe thì thread dừng.
+    """
+
+    def __init__(self, store: Optional[StorageService] = None, interval: Optional[float] = None):
+        self.store = store or StorageService()
+        self.interval = interval if interval is not None else get_config().PROGRESS_WATCH_INTERVAL
+        self._lock = threading.Lock()
+        self._subs: dict[str, list[queue.Queue]] = {}
+        self._versions: dict[str, tuple] = {}
+        self._last: dict[str, dict] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, job_id: str) -> queue.Queue:
+        q: queue.Queue = queue.Queue(maxsize=8)
+        with self._lock:
+            self._subs.setdefault(job_id, []).append(q)
+            if job_id in self._last:
+                # client mới nhận ngay trạng thái hiện tại
+                _offer(q, self._last[job_id])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-hub", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, job_id: str, q: queue.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(job_id, [])
+            with suppress(ValueError):
+                subs.remove(q)
+            if not subs:
+                self._subs.pop(job_id, None)
+                self._versions.pop(job_id, None)
+                self._last.pop(job_id, None)
+
+    def _poll(self, job_id: str) -> None:
+        version = self.store.progress_version(job_id)
+        if job_id in self._versions and version == self._versions[job_id]:
+            return
+        prog = self.store.read_progress(job_id)
+        with self._lock:
+            if job_id not in self._subs:
+                return
+            self._versions[job_id] = version
+            self._last[job_id] = prog
+            for q in self._subs[job_id]:
+                _offer(q, prog)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                jobs = list(self._subs)
+                if not jobs:
+                    self._thread = None
+                    return
+            for job_id in jobs:
+                try:
+                    self._poll(job_id)
+                except Exception as e:
+                    print(f"progress hub: {job_id}: {e}")
+            time.sleep(self.interval)
+
+
+_hub: Optional[ProgressHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_progress_hub() -> ProgressHub:
+    """ ProgressHub dùng chung cho cả process Flask. """
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = ProgressHub()
+        return _hub
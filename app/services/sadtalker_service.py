@@ -7,6 +7,7 @@ from typing import Optional
 
 from app.config import get_config
 from src.gradio_demo import SadTalker  # dùng wrapper hiện tại của bạn
+from src.utils.model_registry import get_model_registry
 
 
 @dataclass
@@ -24,18 +25,29 @@ class SadTalkerService:
     """
     Wrapper an toàn cho Flask/Worker:
     - copy input vào temp_dir rồi gọi SadTalker.test() (vì test() sẽ move)
+    - model dùng chung qua registry toàn process, không load lại mỗi slide
     """
 
     def __init__(self):
         cfg = get_config()
         self.cfg = cfg
+        budget_mb = cfg.SADTALKER_MODEL_CACHE_MB
+        self.registry = get_model_registry(
+            checkpoint_path=cfg.SADTALKER_CHECKPOINT_DIR,
+            config_path=cfg.SADTALKER_CONFIG_DIR,
+            max_bytes=budget_mb * 1024 * 1024 if budget_mb > 0 else None,
+        )
         self._sad = SadTalker(
             checkpoint_path=cfg.SADTALKER_CHECKPOINT_DIR,
             config_path=cfg.SADTALKER_CONFIG_DIR,
-            lazy_load=True
+            lazy_load=True,
+            model_registry=self.registry,
+            preprocess_cache_dir=cfg.SADTALKER_PREPROCESS_CACHE_DIR,
         )
 
-    def generate(self, job_id: str, source_image_path: str, audio_path: str, params: SadTalkerParams) -> str:
+    def generate(self, job_id: str, source_image_path: str, audio_path: str, params: SadTalkerParams,
+                 audio_wav=None) -> str:
+        """ audio_wav: mẫu 16 kHz mono float32 của audio_path nếu caller đã decode sẵn """
         tmp_dir = os.path.join(self.cfg.TMP_DIR, "sadtalker_inputs", job_id, str(uuid.uuid4()))
         os.makedirs(tmp_dir, exist_ok=True)
 
@@ -60,4 +72,5 @@ class SadTalkerService:
             pose_style=params.pose_style,
             exp_scale=params.exp_scale,
             result_dir=out_dir,
+            driven_wav=audio_wav,
         )
@@ -0,0 +1,105 @@
+# app/services/staged_pipeline.py
+import contextvars
+import queue
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+_DONE = object()
+
+
+class StagedPipeline:
+    """
+    Chạy các stage nối tiếp nhau, mỗi stage một thread, giữa hai stage là queue có giới hạn:
+    trong lúc stage giữa xử lý item N thì stage trước đã làm item N+1, stage sau làm item N-1.
+
+    - stage: callable(index, value) -> value mới, hoặc None để bỏ item (các stage sau bỏ qua)
+    - on_skip: callable(stage_name, index), gọi trong thread của stage khi nó bỏ qua item đã bị bỏ ở
+      stage trước (vd để progress vẫn đếm đủ item); exception ở đây cũng dừng pipeline như stage
+    - thứ tự output giữ đúng thứ tự input
+    - exception trong stage sẽ dừng cả pipeline và được raise lại ở run()
+    """
+
+    def __init__(self, stages: list[tuple[str, Callable[[int, Any], Any]]], maxsize: int = 1,
+                 on_skip: Optional[Callable[[str, int], None]] = None):
+        if not stages:
+            raise ValueError("StagedPipeline cần ít nhất một stage")
+        self.stages = stages
+        self.maxsize = max(1, int(maxsize))
+        self.on_skip = on_skip
+
+    def run(self, items: Iterable[Any]) -> list[Optional[Any]]:
+        items = list(items)
+        results: list[Optional[Any]] = [None] * len(items)
+
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in range(len(self.stages) + 1)]
+        abort = threading.Event()
+        errors: list[BaseException] = []
+
+        def _put(q: queue.Queue, value) -> bool:
+            # put có timeout để không kẹt mãi khi stage sau đã dừng vì lỗi
+            while not abort.is_set():
+                try:
+                    q.put(value, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _get(q: queue.Queue):
+            while not abort.is_set():
+                try:
+                    return q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def _feeder():
+            for idx, item in enumerate(items):
+                if not _put(queues[0], (idx, item)):
+                    return
+            _put(queues[0], _DONE)
+
+        def _worker(stage_idx: int, name: str, fn):
+            q_in, q_out = queues[stage_idx], queues[stage_idx + 1]
+            while True:
+                msg = _get(q_in)
+                if msg is _DONE:
+                    _put(q_out, _DONE)
+                    return
+                idx, value = msg
+                try:
+                    if value is not None:
+                        value = fn(idx, value)
+                    elif self.on_skip is not None:
+                        self.on_skip(name, idx)
+                except BaseException as e:
+                    print(f"❌ stage '{name}' failed at item {idx}: {e}")
+                    errors.append(e)
+                    abort.set()
+                    return
+                if not _put(q_out, (idx, value)):
+                    return
+
+        # mỗi thread chạy trong bản copy context của thread gọi run() (cancel token, ...)
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(_feeder,), daemon=True)]
+        for stage_idx, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(target=contextvars.copy_context().run,
+                                            args=(_worker, stage_idx, name, fn), daemon=True,
+                                            name=f"pipeline-{name}"))
+        for t in threads:
+            t.start()
+
+        # thread gọi run() gom kết quả từ queue cuối
+        while True:
+            msg = _get(queues[-1])
+            if msg is _DONE:
+                break
+            idx, value = msg
+            results[idx] = value
+
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+        return results
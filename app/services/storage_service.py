@@ -1,6 +1,8 @@
 # app/services/storage_service.py
 import os
 import json
+import pickle
+import threading
 import uuid
 from dataclasses import asdict
 from typing import Any, Optional
@@ -9,6 +11,7 @@ from contextlib import suppress
 from werkzeug.datastructures import FileStorage
 
 from app.config import get_config
+from app.services.job_manifest import JobManifest
 
 
 def _ensure_dir(path: str) -> None:
@@ -145,6 +148,28 @@ class StorageService:
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    # ---- Fan-out plan ----
+    def save_fanout(self, job_id: str, run_id: str, plan: Any, slides_data: list[dict]) -> str:
+        """
+        LecturePlan + slides_data của lần fan-out hiện tại (pickle, ghi 1 lần): subtask RQ chỉ mang job_id /
+        run_id / index rồi tự đọc ở đây, Redis không phải giữ N bản plan. run_id mới đè run cũ.
+        """
+        path = self.result_path(job_id, "fanout.pkl")
+        _ensure_dir(os.path.dirname(path))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"run_id": run_id, "plan": plan, "slides": slides_data}, f)
+        os.replace(tmp, path)
+        return path
+
+    def load_fanout(self, job_id: str) -> Optional[dict]:
+        """ {"run_id", "plan", "slides"} của lần fan-out mới nhất, None nếu job chưa fan-out. """
+        path = self.result_path(job_id, "fanout.pkl")
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
     # ---- Progress ----
     def _job_dir(self, job_id: str) -> str:
     # thư mục job nằm trong results/<job_id>
@@ -156,7 +181,8 @@ class StorageService:
     
     def write_progress(self, job_id: str, data: dict):
         path = self._progress_path(job_id)          # file progress.json
-        tmp  = path + ".tmp"
+        # tmp riêng cho mỗi writer: fan-out có nhiều process worker + thread flush StageProgress cùng ghi
+        tmp  = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
 
         # 1) ghi tmp
         with open(tmp, "w", encoding="utf-8") as f:
@@ -173,6 +199,8 @@ class StorageService:
                 time.sleep(0.1)
 
         # nếu vẫn fail thì raise để log rõ
+        with suppress(OSError):
+            os.remove(tmp)
         raise last_err
     
     def read_progress(self, job_id: str) -> dict:
@@ -190,4 +218,34 @@ class StorageService:
                 time.sleep(0.05)
 
         # fallback an toàn
-        return {"state": "unknown", "message": f"progress read error: {last_err}"}
\ No newline at end of file
+        return {"state": "unknown", "message": f"progress read error: {last_err}"}
+
+    def progress_version(self, job_id: str) -> Optional[tuple[int, int, int]]:
+        """ (inode, mtime_ns, size) của progress.json, None nếu chưa có: giá trị đổi = progress vừa được ghi lại. """
+        try:
+            st = os.stat(self._progress_path(job_id))
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    # ---- Cancel ----
+    def _cancel_path(self, job_id: str) -> str:
+        return os.path.join(self._job_dir(job_id), "cancel.flag")
+
+    def request_cancel(self, job_id: str) -> None:
+        """ Đặt cờ huỷ; job (ở thread Flask hay worker RQ nào cũng được) tự dừng khi thấy cờ. """
+        _ensure_dir(self._job_dir(job_id))
+        with open(self._cancel_path(job_id), "w", encoding="utf-8") as f:
+            f.write(str(int(time.time())))
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        return os.path.isfile(self._cancel_path(job_id))
+
+    def clear_cancel(self, job_id: str) -> None:
+        with suppress(OSError):
+            os.remove(self._cancel_path(job_id))
+
+    # ---- Per-slide checkpoints ----
+    def job_manifest(self, job_id: str) -> JobManifest:
+        """ checkpoint từng slide: results/<job_id>/slides/slide_NNN.json """
+        return JobManifest(self._job_dir(job_id))
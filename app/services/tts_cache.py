@@ -0,0 +1,173 @@
+# app/services/tts_cache.py
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import unicodedata
+from contextlib import suppress
+from typing import Optional
+
+
+def normalize_text(text: str) -> str:
+    """ Chuẩn hoá text trước khi hash: NFC + gộp khoảng trắng, để sửa xuống dòng/space không làm miss cache. """
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TTSCache:
+    """
+    Cache audio TTS trên đĩa, key theo nội dung:
+    (text đã chuẩn hoá, language, voice / id voice clone, rate, engine).
+
+    - mỗi entry là 1 file <key><ext> trong root (ext thuộc EXTENSIONS), ghi ra tmp rồi os.replace vào chỗ
+    - không có index riêng: get() tra thẳng đường dẫn theo key, thứ tự LRU là st_mtime (get() chạm mtime)
+      -> nhiều process worker dùng chung thư mục vẫn đúng
+    - put() cộng dồn dung lượng vào tổng chạy, chỉ scan thư mục khi tổng vượt max_bytes (rồi xoá file dùng
+      lâu nhất) hoặc mỗi RESYNC_EVERY lần put để tính cả file process khác vừa ghi
+    - get() trả về một bản copy, caller xoá thoải mái như audio synth bình thường
+    """
+
+    TMP_SUFFIX = ".tmp"
+    # edge-tts / gTTS ra mp3, XTTS ra wav
+    EXTENSIONS = (".mp3", ".wav")
+    RESYNC_EVERY = 64
+
+    def __init__(self, root: str, max_bytes: int, tmp_dir: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes or 0)
+        self.tmp_dir = tmp_dir or os.path.dirname(self.root)
+        # chỉ để các thread trong process không evict chồng nhau; giữa các process thì scan lại khi evict
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None     # tổng dung lượng theo lần scan gần nhất + các put sau đó
+        self._puts_since_scan = 0
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, language: str, voice: str, rate: float, engine: str) -> str:
+        payload = json.dumps(
+            [normalize_text(text), (language or "").lower(), voice or "", f"{float(rate):.3f}", engine],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ---- scan (chỉ dùng khi evict / resync) ----
+    def _entries(self) -> list[os.DirEntry]:
+        """ các file audio đã cache (bỏ qua file tmp đang ghi dở / index.json của bản cũ) """
+        try:
+            with os.scandir(self.root) as it:
+                return [e for e in it if e.is_file() and len(e.name.split(".", 1)[0]) == 64
+                        and not e.name.endswith(self.TMP_SUFFIX)]
+        except OSError:
+            return []
+
+    def _find(self, key: str) -> Optional[str]:
+        for ext in self.EXTENSIONS:
+            path = os.path.join(self.root, f"{key}{ext}")
+            if os.path.isfile(path):
+                return path
+        return None
+
+    # ---- public ----
+    def get(self, key: str) -> Optional[str]:
+        cached = self._find(key)
+        if cached is None:
+            return None
+
+        ext = os.path.splitext(cached)[1]
+        out_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}{ext}")
+        try:
+            shutil.copyfile(cached, out_path)
+        except OSError as e:
+            # file vừa bị process khác evict -> coi như miss
+            print("[TTSCache] read failed:", repr(e))
+            with suppress(OSError):
+                os.remove(out_path)
+            return None
+
+        # LRU: mtime = lần dùng gần nhất
+        with suppress(OSError):
+            os.utime(cached, None)
+        return out_path
+
+    def put(self, key: str, audio_path: str) -> None:
+        if not audio_path or not os.path.isfile(audio_path):
+            return
+        ext = (os.path.splitext(audio_path)[1] or ".mp3").lower()
+        if ext not in self.EXTENSIONS:
+            return
+        final_path = os.path.join(self.root, f"{key}{ext}")
+        tmp_path = final_path + f".{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+
+        old_size = 0
+        with suppress(OSError):
+            old_size = os.path.getsize(final_path)
+        try:
+            shutil.copyfile(audio_path, tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, final_path)
+        except OSError as e:
+            print("[TTSCache] write failed:", repr(e))
+            with suppress(OSError):
+                os.remove(tmp_path)
+            return
+
+        if not self.max_bytes:
+            return
+        with self._lock:
+            self._puts_since_scan += 1
+            if self._total is None or self._puts_since_scan >= self.RESYNC_EVERY:
+                self._total = self.total_bytes()
+                self._puts_since_scan = 0
+            else:
+                self._total += size - old_size
+            if self._total > self.max_bytes:
+                self._evict_locked(keep=final_path)
+
+    def total_bytes(self) -> int:
+        total = 0
+        for e in self._entries():
+            with suppress(OSError):
+                total += e.stat().st_size
+        return total
+
+    def _evict_locked(self, keep: str) -> None:
+        """ Scan thư mục, xoá file LRU tới khi <= max_bytes; cập nhật lại tổng chạy theo kết quả scan. """
+        files = []
+        for e in self._entries():
+            with suppress(OSError):
+                st = e.stat()
+                files.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass   # process khác đã xoá
+            except OSError:
+                continue
+            total -= size
+        self._total = total
+        self._puts_since_scan = 0
+
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache(root: str, max_bytes: int, tmp_dir: Optional[str] = None) -> TTSCache:
+    """ Một TTSCache cho cả process, để các TTSService cùng chia sẻ lock evict. """
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.root != os.path.abspath(root):
+            _cache = TTSCache(root, max_bytes, tmp_dir=tmp_dir)
+        else:
+            _cache.max_bytes = int(max_bytes or 0)
+        return _cache
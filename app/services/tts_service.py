@@ -2,6 +2,9 @@
 import os
 import asyncio
 import tempfile
+import threading
+from concurrent.futures import Future
+from contextlib import suppress
 from dataclasses import dataclass
 from typing import Optional
 
@@ -13,6 +16,7 @@ except Exception:
     edge_tts = None
 
 from app.config import get_config
+from app.services.tts_cache import get_tts_cache
 from src.utils.xtts_clone import create_cloned_voice, list_supported_languages, XTTSInference
 
 
@@ -49,6 +53,23 @@ def _ensure_dir(p: str) -> None:
     os.makedirs(p, exist_ok=True)
 
 
+def _remove_quiet(path: str) -> None:
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def _cloned_voice_id(ref_wav: str) -> str:
+    # đổi file reference (tạo lại voice cùng tên) thì key cache cũng đổi
+    try:
+        st = os.stat(ref_wav)
+        return f"xtts:{os.path.abspath(ref_wav)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return f"xtts:{os.path.abspath(ref_wav)}"
+
+
 def _tmp_audio_path(suffix: str) -> str:
     cfg = get_config()
     tmpdir = cfg.TTS_TMP_DIR
@@ -59,6 +80,61 @@ def _tmp_audio_path(suffix: str) -> str:
     return path
 
 
+class _LoopThread:
+    """
+    Một event loop sống suốt process trên một daemon thread.
+    Mọi lời gọi edge-tts đi qua loop này thay vì asyncio.run() mỗi slide.
+    `limiter` giới hạn số request TTS chạy cùng lúc cho cả process (mọi job, mọi batch),
+    để nhiều job song song không cộng dồn request lên edge-tts.
+    """
+
+    def __init__(self, concurrency: int):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="tts-loop", daemon=True)
+        self.thread.start()
+
+        async def _make_limiter():
+            return asyncio.Semaphore(max(1, int(concurrency)))
+
+        # semaphore phải được tạo trong loop sẽ dùng nó
+        self.limiter = self.submit(_make_limiter()).result()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_loop_thread: Optional[_LoopThread] = None
+_loop_thread_lock = threading.Lock()
+
+
+def _get_loop_thread() -> _LoopThread:
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = _LoopThread(get_config().TTS_CONCURRENCY)
+        return _loop_thread
+
+
+async def _run_blocking(loop, fn, *args) -> Optional[str]:
+    """
+    run_in_executor cho hàm trả về path audio. Thread executor không dừng được giữa chừng:
+    nếu request bị cancel thì file mà fn vẫn tạo ra sau đó sẽ được xoá khi fn xong.
+    """
+    fut = loop.run_in_executor(None, fn, *args)
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        def _cleanup(f):
+            if not f.cancelled() and f.exception() is None:
+                _remove_quiet(f.result())
+        fut.add_done_callback(_cleanup)
+        raise
+
+
 @dataclass
 class TTSRequest:
     text: str
@@ -79,8 +155,18 @@ class TTSService:
     - clone: XTTS-v2 (wav) -> fallback builtin
     """
 
-    def __init__(self):
+    def __init__(self, communicate_cls=None):
         self.cfg = get_config()
+        # mặc định edge_tts.Communicate; truyền class khác (cùng interface save()) để chạy offline / test
+        self.communicate_cls = communicate_cls or (edge_tts.Communicate if edge_tts is not None else None)
+        # XTTS chạy trên GPU, không cho nhiều request clone chạy song song
+        self._clone_lock = threading.Lock()
+        # cache audio theo nội dung, TTS_CACHE_MAX_MB=0 để tắt
+        self.cache = None
+        if self.cfg.TTS_CACHE_MAX_MB > 0:
+            self.cache = get_tts_cache(self.cfg.TTS_CACHE_DIR,
+                                       self.cfg.TTS_CACHE_MAX_MB * 1024 * 1024,
+                                       tmp_dir=self.cfg.TTS_TMP_DIR)
     def list_builtin_voices(self, lang: str, gender_label: str) -> list[dict]:
         """
         List Edge-TTS voices by language + gender.
@@ -215,78 +301,151 @@ class TTSService:
         - builtin: .mp3
         - clone: .wav
         """
+        return self.synthesize_many([req], concurrency=1)[0].result()
+
+    def synthesize_many(self, requests: list[TTSRequest], concurrency: Optional[int] = None) -> list[Future]:
+        """
+        Synth nhiều request cùng lúc trên event loop dùng chung, tối đa `concurrency` request song song
+        trong batch này và tối đa TTS_CONCURRENCY cho cả process.
+        Trả về list Future theo đúng thứ tự requests (result() -> path audio hoặc None),
+        nên caller có thể dùng audio slide 1 ngay khi nó xong mà không chờ cả batch.
+        Future.cancel() dừng request đang chờ / đang chạy, file tạm của nó được xoá.
+        """
+        if concurrency is None:
+            concurrency = self.cfg.TTS_CONCURRENCY
+        loop_thread = _get_loop_thread()
+
+        async def _make_sem():
+            return asyncio.Semaphore(max(1, int(concurrency)))
+
+        batch_sem = loop_thread.submit(_make_sem()).result()
+
+        async def _one(req: TTSRequest) -> Optional[str]:
+            async with batch_sem, loop_thread.limiter:
+                return await self._synthesize_async(req)
+
+        return [loop_thread.submit(_one(req)) for req in requests]
+
+    @staticmethod
+    def discard(futures: list[Future]) -> None:
+        """ Huỷ các request chưa xong và xoá audio của các request đã xong mà caller không dùng tới. """
+        for f in futures:
+            if f.cancel():
+                continue
+            with suppress(Exception):
+                _remove_quiet(f.result(timeout=0))
+
+    async def _synthesize_async(self, req: TTSRequest) -> Optional[str]:
         text = (req.text or "").strip()
         if not text:
             return None
 
         language = (req.language or "vi").strip()
         gender = (req.gender or "Nữ").strip()
+        loop = asyncio.get_running_loop()
 
         if req.voice_mode == "clone" and req.cloned_voice_name:
-            # XTTS synth
             ref_wav = self.find_reference_wav_by_display_name(req.cloned_voice_name)
             if ref_wav:
-                try:
-                    xtts = XTTSInference()
-                    lang_code = (req.cloned_lang or language).strip()
-                    # XTTS trả ra wav
-                    return xtts.synthesize(text, lang_code, ref_wav)
-                except Exception as e:
-                    import traceback
-                    print("[XTTS] synth failed:")
-                    traceback.print_exc()
+                lang_code = (req.cloned_lang or language).strip()
+                key = self._cache_key(text, lang_code, _cloned_voice_id(ref_wav), 1.0, "xtts")
+                hit = await self._cache_get(key)
+                if hit:
+                    return hit
+                # XTTS là blocking -> chạy trong executor để không chặn các request edge-tts khác
+                out = await _run_blocking(loop, self._clone_tts_to_wav, text, lang_code, ref_wav)
+                if out:
+                    await self._cache_put(key, out)
+                    return out
 
         # builtin path
-        return self._builtin_tts_to_mp3(
-            text=text,
-            language=language,
-            gender=gender,
-            preferred_voice=req.preferred_voice,
-            speech_rate=req.speech_rate,
-        )
-
-    def _builtin_tts_to_mp3(
-            self,
-            text: str,
-            language: str,
-            gender: str,
-            preferred_voice: Optional[str],
-            speech_rate: float = 1.0
-        ) -> Optional[str]:
-        out_path = _tmp_audio_path(".mp3")
-        voice = preferred_voice or get_edge_voice(language, gender)
-
-        if edge_tts is not None and voice:
+        voice = req.preferred_voice or get_edge_voice(language, gender)
+        if self.communicate_cls is not None and voice:
+            key = self._cache_key(text, language, voice, req.speech_rate, "edge")
+            hit = await self._cache_get(key)
+            if hit:
+                return hit
+
+            out_path = _tmp_audio_path(".mp3")
             try:
-                async def _save():
-                    communicate = edge_tts.Communicate(
-                        text=text,
-                        voice=voice,
-                        rate=_edge_rate_from_float(speech_rate),
-                        volume="+0%"
-                    )
-                    await communicate.save(out_path)
-
-                # asyncio.run sẽ lỗi nếu đang chạy trong event loop.
-                # Flask thường không có loop sẵn, nhưng để an toàn:
-                try:
-                    asyncio.run(_save())
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    try:
-                        loop.run_until_complete(_save())
-                    finally:
-                        loop.close()
-
+                communicate = self.communicate_cls(
+                    text=text,
+                    voice=voice,
+                    rate=_edge_rate_from_float(req.speech_rate),
+                    volume="+0%"
+                )
+                await communicate.save(out_path)
+                await self._cache_put(key, out_path)
                 return out_path
+            except asyncio.CancelledError:
+                _remove_quiet(out_path)
+                raise
             except Exception as e:
                 print("[EdgeTTS] failed:", repr(e))
+                _remove_quiet(out_path)
+
+        # fallback gTTS (blocking, cần mạng)
+        key = self._cache_key(text, language, "", 1.0, "gtts")
+        hit = await self._cache_get(key)
+        if hit:
+            return hit
+        out = await _run_blocking(loop, self._gtts_to_mp3, text, language)
+        if out:
+            await self._cache_put(key, out)
+        return out
+
+    # ---------- Cache ----------
+    def _cache_key(self, text: str, language: str, voice: str, rate: float, engine: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.make_key(text, language, voice, rate, engine)
+
+    # copy file + scan thư mục chạy trong executor, không chặn các request edge-tts khác trên loop
+    async def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        return await _run_blocking(asyncio.get_running_loop(), self.cache.get, key)
 
-        # fallback gTTS
+    async def _cache_put(self, key: Optional[str], audio_path: str) -> None:
+        if key is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.cache.put, key, audio_path)
+
+    def _clone_tts_to_wav(self, text: str, lang_code: str, ref_wav: str) -> Optional[str]:
+        try:
+            with self._clone_lock:
+                xtts = XTTSInference()
+                # XTTS trả ra wav
+                return xtts.synthesize(text, lang_code, ref_wav)
+        except Exception:
+            import traceback
+            print("[XTTS] synth failed:")
+            traceback.print_exc()
+            return None
+
+    def _gtts_to_mp3(self, text: str, language: str) -> Optional[str]:
+        out_path = _tmp_audio_path(".mp3")
         try:
             tts = gTTS(text=text, lang=language, slow=False)
             tts.save(out_path)
             return out_path
         except Exception as e:
             print("[gTTS] failed:", repr(e))
+            _remove_quiet(out_path)
             return None
+
+    def _builtin_tts_to_mp3(
+            self,
+            text: str,
+            language: str,
+            gender: str,
+            preferred_voice: Optional[str],
+            speech_rate: float = 1.0
+        ) -> Optional[str]:
+        return self.synthesize(TTSRequest(
+            text=text,
+            language=language,
+            gender=gender,
+            preferred_voice=preferred_voice,
+            speech_rate=speech_rate,
+        ))
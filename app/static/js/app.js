@@ -28,6 +28,75 @@ async function api(url, opts = {}) {
   function loadJobId() {
     return localStorage.getItem("lecture_job_id");
   }
+
+  // ---------- JOB PROGRESS ----------
+  const TERMINAL_STATES = ["done", "failed", "cancelled"];
+  const STAGE_LABELS = {
+    tts: "TTS",
+    coeff: "Coeff",
+    render: "Render",
+    composite: "Ghép PiP",
+    concat: "Ghép video",
+  };
+
+  // message chung + các stage đang chạy, vd: "Processing slide 2/5 — Slide 2 Render 40% · Slide 3 TTS"
+  function formatProgress(st) {
+    const base = st.message || `Processing ${st.current || 0}/${st.total || 0}`;
+    const stages = (st.stages || []).map(s => {
+      const slide = s.slide ? `Slide ${s.slide} ` : "";
+      const pct = (s.pct !== undefined && s.pct !== null) ? ` ${Math.round(s.pct)}%` : "";
+      return `${slide}${STAGE_LABELS[s.stage] || s.stage}${pct}`;
+    });
+    return stages.length ? `${base} — ${stages.join(" · ")}` : base;
+  }
+
+  // Theo dõi progress của job: SSE (/events) khi trình duyệt hỗ trợ, không được thì polling /status.
+  // onUpdate(st) chạy mỗi lần có progress mới; dừng sau trạng thái cuối (done / failed / cancelled).
+  function watchJob(jobId, onUpdate, onError) {
+    const isFinal = (st) => TERMINAL_STATES.includes(st.state);
+
+    const poll = async () => {
+      try {
+        const st = await api(`/api/jobs/${jobId}/status`);
+        onUpdate(st);
+        if (isFinal(st)) return;
+        setTimeout(poll, 1500);
+      } catch (e) {
+        if (onError) onError(e);
+      }
+    };
+
+    if (!window.EventSource) {
+      poll();
+      return;
+    }
+
+    const es = new EventSource(`/api/jobs/${jobId}/events`);
+    let finished = false;
+    let received = false;
+    let errors = 0;
+
+    es.onmessage = (ev) => {
+      received = true;
+      errors = 0;
+      const st = JSON.parse(ev.data);
+      onUpdate(st);
+      if (isFinal(st)) {
+        finished = true;
+        es.close();   // server đóng stream, không để EventSource tự kết nối lại
+      }
+    };
+    es.onerror = () => {
+      if (finished) return;
+      errors += 1;
+      // EventSource tự kết nối lại; chưa nhận được gì, bị đóng hẳn hoặc lỗi liên tục thì chuyển sang polling
+      if (!received || errors >= 3 || es.readyState === EventSource.CLOSED) {
+        finished = true;
+        es.close();
+        poll();
+      }
+    };
+  }
   
   // ---------- INDEX PAGE ----------
   async function initIndexPage() {
@@ -304,9 +373,8 @@ async function api(url, opts = {}) {
           const out = await api(`/api/jobs/${jobId}/generate`, { method: "POST" });
           setText(status, `✅ Đã chạy job (${out.job_id || jobId}). Đang xử lý...`);
   
-          // poll status
-          const poll = async () => {
-            const st = await api(`/api/jobs/${jobId}/status`);
+          // theo dõi progress (SSE, fallback polling)
+          watchJob(jobId, (st) => {
             if (st.state === "done") {
               setText(status, "✅ Hoàn thành! Đang chuyển sang trang kết quả...");
               window.location.href = `/result?job=${encodeURIComponent(jobId)}`;
@@ -316,11 +384,12 @@ async function api(url, opts = {}) {
               setText(status, `❌ Thất bại: ${st.message || ""}`);
               return;
             }
-            const msg = st.message || `Processing ${st.current || 0}/${st.total || 0}`;
-            setText(status, msg);
-            setTimeout(poll, 1500);
-          };
-          poll();
+            if (st.state === "cancelled") {
+              setText(status, "⏹ Đã huỷ job");
+              return;
+            }
+            setText(status, formatProgress(st));
+          }, e => setText(status, `❌ ${e.message}`));
         } catch (e) {
           setText(status, `❌ ${e.message}`);
         }
@@ -343,9 +412,8 @@ async function api(url, opts = {}) {
       return;
     }
   
-    // poll status đến khi done
-    const poll = async () => {
-      const st = await api(`/api/jobs/${jobId}/status`);
+    // theo dõi status đến khi done (SSE, fallback polling)
+    watchJob(jobId, (st) => {
       if (st.state === "done") {
         setText(status, st.message || "✅ Done");
         const viewUrl = `/media/jobs/${jobId}/video`;       // xem trực tiếp
@@ -364,10 +432,12 @@ async function api(url, opts = {}) {
         setText(status, `❌ ${st.message || "failed"}`);
         return;
       }
-      setText(status, st.message || "Đang xử lý...");
-      setTimeout(poll, 1500);
-    };
-    poll().catch(e => setText(status, `❌ ${e.message}`));
+      if (st.state === "cancelled") {
+        setText(status, "⏹ Đã huỷ job");
+        return;
+      }
+      setText(status, st.stages?.length ? formatProgress(st) : (st.message || "Đang xử lý..."));
+    }, e => setText(status, `❌ ${e.message}`));
   }
   
   document.addEventListener("DOMContentLoaded", () => {
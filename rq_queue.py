@@ -1,10 +1,6 @@
 # queue.py
-import os
-from redis import Redis
-from rq import Queue
+# giữ tên cũ cho script ngoài; connection + queue thật nằm ở app/extenstions.py
+from app.extenstions import get_redis, get_queue
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "video_jobs")
-
-redis_conn = Redis.from_url(REDIS_URL)
-queue = Queue(name=QUEUE_NAME, connection=redis_conn)
+redis_conn = get_redis()
+queue = get_queue()
@@ -1,9 +1,13 @@
-from tqdm import tqdm
 import torch
 from torch import nn
 
+from src.generate_batch import iter_mel_windows, mel_window_tensor
+
 
 class Audio2Exp(nn.Module):
+    # frames per netG forward: the whole clip for typical slides, bounded so very long audio stays in memory
+    frames_per_pass = 512
+
     def __init__(self, netG, cfg, device, prepare_training_loss=False):
         super(Audio2Exp, self).__init__()
         self.cfg = cfg
@@ -12,21 +16,24 @@ class Audio2Exp(nn.Module):
 
     def test(self, batch):
 
-        mel_input = batch['indiv_mels']                         # bs T 1 80 16
-        bs = mel_input.shape[0]
-        T = mel_input.shape[1]
+        T = int(batch['num_frames'])
+        step = max(1, int(self.frames_per_pass))
+        device = batch['ref'].device
 
         exp_coeff_pred = []
 
-        for i in tqdm(range(0, T, 10),'audio2exp:'): # every 10 frames
-            
-            current_mel_input = mel_input[:,i:i+10]
+        # netG works frame by frame (no temporal context), so one pass over T frames
+        # gives the same coefficients as the old 10-frame slices; the mel windows of
+        # each block are gathered only when it runs
+        for i, windows in iter_mel_windows(batch['orig_mel'], T, block_size=step):
+
+            current_mel_input = mel_window_tensor(windows, device)             # bs n 1 80 16
 
             #ref = batch['ref'][:, :, :64].repeat((1,current_mel_input.shape[1],1))           #bs T 64
-            ref = batch['ref'][:, :, :64][:, i:i+10]
-            ratio = batch['ratio_gt'][:, i:i+10]                               #bs T
+            ref = batch['ref'][:, :, :64][:, i:i+step]
+            ratio = batch['ratio_gt'][:, i:i+step]                               #bs T
 
-            audiox = current_mel_input.view(-1, 1, 80, 16)                  # bs*T 1 80 16
+            audiox = current_mel_input.reshape(-1, 1, 80, 16)                  # bs*T 1 80 16
 
             curr_exp_coeff_pred  = self.netG(audiox, ref, ratio)         # bs T 64 
 
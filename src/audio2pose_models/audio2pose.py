@@ -3,8 +3,12 @@ from torch import nn
 from src.audio2pose_models.cvae import CVAE
 from src.audio2pose_models.discriminator import PoseSequenceDiscriminator
 from src.audio2pose_models.audio_encoder import AudioEncoder
+from src.generate_batch import mel_window_range, mel_window_tensor
 
 class Audio2Pose(nn.Module):
+    # seq_len windows per audio encoder / CVAE decoder pass (bounds memory on long clips)
+    windows_per_pass = 16
+
     def __init__(self, cfg, wav2lip_checkpoint, device='cuda'):
         super().__init__()
         self.cfg = cfg
@@ -53,38 +57,55 @@ class Audio2Pose(nn.Module):
         batch['class'] = x['class']  
         bs = ref.shape[0]
         
-        indiv_mels= x['indiv_mels']               # bs T 1 80 16
-        indiv_mels_use = indiv_mels[:, 1:]        # we regard the ref as the first frame
-        num_frames = x['num_frames']
-        num_frames = int(num_frames) - 1
+        orig_mel = x['orig_mel']                  # n_mel 80, windows gathered per chunk
+        total_frames = int(x['num_frames'])
+        num_frames = total_frames - 1             # we regard the ref as the first frame
 
         #  
         div = num_frames//self.seq_len
         re = num_frames%self.seq_len
-        audio_emb_list = []
         pose_motion_pred_list = [torch.zeros(batch['ref'].unsqueeze(1).shape, dtype=batch['ref'].dtype, 
                                                 device=batch['ref'].device)]
 
-        for i in range(div):
-            z = torch.randn(bs, self.latent_dim).to(ref.device)
-            batch['z'] = z
-            audio_emb = self.audio_encoder(indiv_mels_use[:, i*self.seq_len:(i+1)*self.seq_len,:,:,:]) #bs seq_len 512
-            batch['audio_emb'] = audio_emb
-            batch = self.netG.test(batch)
-            pose_motion_pred_list.append(batch['pose_motion_pred'])  #list of bs seq_len 6
-        
+        # all windows as frame ranges: div full ones, then the last seq_len frames for the remainder
+        windows = [(1 + i*self.seq_len, 1 + (i+1)*self.seq_len) for i in range(div)]
         if re != 0:
-            z = torch.randn(bs, self.latent_dim).to(ref.device)
-            batch['z'] = z
-            audio_emb = self.audio_encoder(indiv_mels_use[:, -1*self.seq_len:,:,:,:]) #bs seq_len  512
-            if audio_emb.shape[1] != self.seq_len:
+            windows.append((max(1, total_frames - self.seq_len), total_frames))
+
+        # one z per window drawn up front, in window order -> same random stream as the per-window loop
+        zs = [torch.randn(bs, self.latent_dim).to(ref.device) for _ in windows]
+
+        preds = []
+        step = max(1, int(self.windows_per_pass))
+        for s in range(0, len(windows), step):
+            chunk = [mel_window_tensor(mel_window_range(orig_mel, a, b), ref.device) for a, b in windows[s:s+step]]
+            n = len(chunk)
+
+            audio_embs = []
+            full = [w for w in chunk if w.shape[1] == self.seq_len]
+            if full:
+                audio_embs += list(self.audio_encoder(torch.cat(full, 0)).split(bs, 0))   #n*bs seq_len 512
+            if len(full) != n:
+                # clip shorter than seq_len: pad the front with the first frame embedding
+                audio_emb = self.audio_encoder(chunk[-1])
                 pad_dim = self.seq_len-audio_emb.shape[1]
                 pad_audio_emb = audio_emb[:, :1].repeat(1, pad_dim, 1) 
-                audio_emb = torch.cat([pad_audio_emb, audio_emb], 1) 
-            batch['audio_emb'] = audio_emb
+                audio_embs.append(torch.cat([pad_audio_emb, audio_emb], 1))
+
+            # windows are independent for the decoder: stack them on the batch axis
+            batch['z'] = torch.cat(zs[s:s+n], 0)
+            batch['audio_emb'] = torch.cat(audio_embs, 0)
+            batch['ref'] = x['ref'][:,0,-6:].repeat(n, 1)
+            batch['class'] = x['class'].repeat(n)
             batch = self.netG.test(batch)
-            pose_motion_pred_list.append(batch['pose_motion_pred'][:,-1*re:,:])   
-        
+            preds += list(batch['pose_motion_pred'].split(bs, 0))      #list of bs seq_len 6
+
+        pose_motion_pred_list += preds[:div]
+        if re != 0:
+            pose_motion_pred_list.append(preds[-1][:,-1*re:,:])   
+
+        batch['ref'] = x['ref'][:,0,-6:]
+        batch['class'] = x['class']
         pose_motion_pred = torch.cat(pose_motion_pred_list, dim = 1)
         batch['pose_motion_pred'] = pose_motion_pred
 
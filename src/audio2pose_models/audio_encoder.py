@@ -1,4 +1,3 @@
-import torch
 from torch import nn
 from torch.nn import functional as F
 
@@ -55,10 +54,11 @@ class AudioEncoder(nn.Module):
         # audio_sequences = (B, T, 1, 80, 16)
         B = audio_sequences.size(0)
 
-        audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
+        # time-major (T*B, 1, 80, 16) in one reshape, same order as concatenating audio_sequences[:, i]
+        audio_sequences = audio_sequences.transpose(0, 1).reshape(-1, *audio_sequences.shape[2:])
 
         audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
         dim = audio_embedding.shape[1]
-        audio_embedding = audio_embedding.reshape((B, -1, dim, 1, 1))
+        audio_embedding = audio_embedding.reshape((-1, B, dim, 1, 1)).transpose(0, 1)
 
         return audio_embedding.squeeze(-1).squeeze(-1) #B seq_len+1 512 
@@ -1,5 +1,4 @@
 import os
-import cv2
 import yaml
 import numpy as np
 import warnings
@@ -9,7 +8,6 @@ import safetensors.torch
 warnings.filterwarnings('ignore')
 
 
-import imageio
 import torch
 import torchvision
 
@@ -17,12 +15,11 @@ import torchvision
 from src.facerender.modules.keypoint_detector import HEEstimator, KPDetector
 from src.facerender.modules.mapping import MappingNet
 from src.facerender.modules.generator import OcclusionAwareGenerator, OcclusionAwareSPADEGenerator
-from src.facerender.modules.make_animation import make_animation 
+from src.facerender.modules.make_animation import make_animation, make_animation_chunks, estimate_render_chunk_size
 
 from pydub import AudioSegment 
-from src.utils.face_enhancer import enhancer_generator_with_len, enhancer_list
-from src.utils.paste_pic import paste_pic
-from src.utils.videoio import save_video_with_watermark
+from src.utils.frame_pipeline import FramePipeline, ResizeStage, PasteBackStage, EnhanceStage
+from src.utils.audio_stage import write_wav
 
 try:
     import webui  # in webui
@@ -154,7 +151,13 @@ class AnimateFromCoeff():
 
         return checkpoint['epoch']
 
-    def generate(self, x, video_save_dir, pic_path, crop_info, enhancer=None, background_enhancer=None, preprocess='crop', img_size=256):
+    def generate(self, x, video_save_dir, pic_path, crop_info, enhancer=None, background_enhancer=None, preprocess='crop', img_size=256,
+                 render_batch_size=None):
+        """
+        render_batch_size: None keeps the legacy (batch_size, T/batch_size) loop of make_animation.
+        Otherwise frames are rendered on one flattened time axis in micro-batches whose size is
+        chosen from free memory, with render_batch_size only used as a hint.
+        """
 
         source_image=x['source_image'].type(torch.FloatTensor)
         source_semantics=x['source_semantics'].type(torch.FloatTensor)
@@ -180,79 +183,70 @@ class AnimateFromCoeff():
 
         frame_num = x['frame_num']
 
-        predictions_video = make_animation(source_image, source_semantics, target_semantics,
-                                        self.generator, self.kp_extractor, self.he_estimator, self.mapping, 
-                                        yaw_c_seq, pitch_c_seq, roll_c_seq, use_exp = True)
+        if render_batch_size is None:
+            predictions_video = make_animation(source_image, source_semantics, target_semantics,
+                                            self.generator, self.kp_extractor, self.he_estimator, self.mapping, 
+                                            yaw_c_seq, pitch_c_seq, roll_c_seq, use_exp = True)
 
-        predictions_video = predictions_video.reshape((-1,)+predictions_video.shape[2:])
-        predictions_video = predictions_video[:frame_num]
-
-        video = []
-        for idx in range(predictions_video.shape[0]):
-            image = predictions_video[idx]
-            image = np.transpose(image.data.cpu().numpy(), [1, 2, 0]).astype(np.float32)
-            video.append(image)
-        result = img_as_ubyte(video)
+            predictions_video = predictions_video.reshape((-1,)+predictions_video.shape[2:])
+            prediction_chunks = [predictions_video[:frame_num]]
+        else:
+            chunk_size = estimate_render_chunk_size(img_size, self.device, hint=render_batch_size)
+            # on cuda the first frame is rendered alone to measure the real per-frame footprint
+            prediction_chunks = make_animation_chunks(source_image, source_semantics, target_semantics,
+                                            self.generator, self.kp_extractor, self.mapping,
+                                            yaw_c_seq, pitch_c_seq, roll_c_seq,
+                                            chunk_size=chunk_size, frame_num=frame_num,
+                                            probe_device=self.device,
+                                            chunk_size_kwargs={'hint': render_batch_size})
 
         ### the generated video is 256x256, so we keep the aspect ratio, 
         original_size = crop_info[0]
         if original_size:
-            result = [ cv2.resize(result_i,(img_size, int(img_size * original_size[1]/original_size[0]) )) for result_i in result ]
-        
-        # Tạo file tạm cho video chỉ có mặt
-        video_name = x['video_name']  + '.mp4'
-        path = os.path.join(video_save_dir, 'temp_'+video_name)
-        
-        imageio.mimsave(path, result,  fps=float(25))
+            frame_size = (img_size, int(img_size * original_size[1]/original_size[0]))
+        else:
+            frame_size = (img_size, img_size)
 
         # Xử lý audio
         audio_path =  x['audio_path'] 
         audio_name = os.path.splitext(os.path.split(audio_path)[-1])[0]
         new_audio_path = os.path.join(video_save_dir, audio_name+'.wav')
-        start_time = 0
-        # cog will not keep the .mp3 filename
-        sound = AudioSegment.from_file(audio_path)
-        frames = frame_num 
-        end_time = start_time + frames*1/25*1000
-        word1=sound.set_frame_rate(16000)
-        word = word1[start_time:end_time]
-        word.export(new_audio_path, format="wav")
-
-        if 'full' in preprocess.lower():
-            # Chỉ tạo file full, không tạo file chỉ có mặt
-            video_name_full = x['video_name']  + '.mp4'  # Đổi tên thành .mp4 thay vì _full.mp4
-            full_video_path = os.path.join(video_save_dir, video_name_full)
-            return_path = full_video_path
-            paste_pic(path, pic_path, crop_info, new_audio_path, full_video_path, extended_crop= True if 'ext' in preprocess.lower() else False)
-            print(f'The generated video is named {video_save_dir}/{video_name_full}') 
+        if x.get('audio_wav') is not None:
+            # already 16 kHz mono in memory: slice to the rendered length, no decode / resample
+            write_wav(new_audio_path, x['audio_wav'][:int(frame_num * 16000 / 25)], 16000)
         else:
-            # Cho các preprocess khác, tạo file chỉ có mặt như bình thường
-            av_path = os.path.join(video_save_dir, video_name)
-            return_path = av_path
-            save_video_with_watermark(path, new_audio_path, av_path, watermark= False)
-            print(f'The generated video is named {video_save_dir}/{video_name}') 
-            full_video_path = av_path 
-
-        #### paste back then enhancers
+            start_time = 0
+            # cog will not keep the .mp3 filename
+            sound = AudioSegment.from_file(audio_path)
+            frames = frame_num 
+            end_time = start_time + frames*1/25*1000
+            word1=sound.set_frame_rate(16000)
+            word = word1[start_time:end_time]
+            word.export(new_audio_path, format="wav")
+
+        # render -> (resize | paste back) -> enhance -> mux, encoded exactly once
+        stages = []
+        if 'full' in preprocess.lower():
+            # paste back resizes the face to its box in the original picture itself
+            stages.append(PasteBackStage(pic_path, crop_info, extended_crop= True if 'ext' in preprocess.lower() else False))
+        elif original_size:
+            stages.append(ResizeStage(frame_size))
         if enhancer:
-            video_name_enhancer = x['video_name']  + '_enhanced.mp4'
-            enhanced_path = os.path.join(video_save_dir, 'temp_'+video_name_enhancer)
-            av_path_enhancer = os.path.join(video_save_dir, video_name_enhancer) 
-            return_path = av_path_enhancer
+            stages.append(EnhanceStage(method=enhancer, bg_upsampler=background_enhancer))
+
+        if enhancer:
+            video_name = x['video_name']  + '_enhanced.mp4'
+        else:
+            video_name = x['video_name']  + '.mp4'
+        return_path = os.path.join(video_save_dir, video_name)
+
+        def _frame_chunks():
+            for predictions in prediction_chunks:
+                yield img_as_ubyte(np.transpose(predictions.data.cpu().numpy(), [0, 2, 3, 1]).astype(np.float32))
+
+        FramePipeline(stages, fps=25).run(_frame_chunks(), return_path, audio_path=new_audio_path)
+        print(f'The generated video is named {video_save_dir}/{video_name}') 
 
-            try:
-                enhanced_images_gen_with_len = enhancer_generator_with_len(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
-                imageio.mimsave(enhanced_path, enhanced_images_gen_with_len, fps=float(25))
-            except:
-                enhanced_images_gen_with_len = enhancer_list(full_video_path, method=enhancer, bg_upsampler=background_enhancer)
-                imageio.mimsave(enhanced_path, enhanced_images_gen_with_len, fps=float(25))
-            
-            save_video_with_watermark(enhanced_path, new_audio_path, av_path_enhancer, watermark= False)
-            print(f'The generated video is named {video_save_dir}/{video_name_enhancer}')
-            os.remove(enhanced_path)
-
-        os.remove(path)
         os.remove(new_audio_path)
 
         return return_path
-
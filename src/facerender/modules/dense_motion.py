@@ -77,12 +77,22 @@ class DenseMotionNetwork(nn.Module):
         heatmap = heatmap.unsqueeze(2)         # (bs, num_kp+1, 1, d, h, w)
         return heatmap
 
-    def forward(self, feature, kp_driving, kp_source):
-        bs, _, d, h, w = feature.shape
-
+    def compress_feature(self, feature):
+        """
+        Only depends on the source feature volume, so callers rendering many frames
+        from one source image can compute it once and pass it as compressed_feature.
+        """
         feature = self.compress(feature)
         feature = self.norm(feature)
         feature = F.relu(feature)
+        return feature
+
+    def forward(self, feature, kp_driving, kp_source, compressed_feature=None):
+        bs, _, d, h, w = feature.shape
+
+        if compressed_feature is None:
+            compressed_feature = self.compress_feature(feature)
+        feature = compressed_feature
 
         out_dict = dict()
         sparse_motion = self.create_sparse_motions(feature, kp_driving, kp_source)
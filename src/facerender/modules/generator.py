@@ -67,7 +67,11 @@ class OcclusionAwareGenerator(nn.Module):
             deformation = deformation.permute(0, 2, 3, 4, 1)
         return F.grid_sample(inp, deformation)
 
-    def forward(self, source_image, kp_driving, kp_source):
+    def encode_source(self, source_image):
+        """
+        Source-only part of forward(). The result can be cached and passed to decode()
+        for every driving frame of the same source image.
+        """
         # Encoding (downsampling) part
         out = self.first(source_image)
         for i in range(len(self.down_blocks)):
@@ -78,11 +82,23 @@ class OcclusionAwareGenerator(nn.Module):
         feature_3d = out.view(bs, self.reshape_channel, self.reshape_depth, h ,w) 
         feature_3d = self.resblocks_3d(feature_3d)
 
+        source_features = {'feature_3d': feature_3d}
+        if self.dense_motion_network is not None:
+            source_features['compressed'] = self.dense_motion_network.compress_feature(feature_3d)
+        return source_features
+
+    def forward(self, source_image, kp_driving, kp_source):
+        return self.decode(self.encode_source(source_image), kp_driving=kp_driving, kp_source=kp_source)
+
+    def decode(self, source_features, kp_driving, kp_source):
+        feature_3d = source_features['feature_3d']
+
         # Transforming feature representation according to deformation and occlusion
         output_dict = {}
         if self.dense_motion_network is not None:
             dense_motion = self.dense_motion_network(feature=feature_3d, kp_driving=kp_driving,
-                                                     kp_source=kp_source)
+                                                     kp_source=kp_source,
+                                                     compressed_feature=source_features.get('compressed'))
             output_dict['mask'] = dense_motion['mask']
 
             if 'occlusion_map' in dense_motion:
@@ -207,7 +223,11 @@ class OcclusionAwareSPADEGenerator(nn.Module):
             deformation = deformation.permute(0, 2, 3, 4, 1)
         return F.grid_sample(inp, deformation)
 
-    def forward(self, source_image, kp_driving, kp_source):
+    def encode_source(self, source_image):
+        """
+        Source-only part of forward(). The result can be cached and passed to decode()
+        for every driving frame of the same source image.
+        """
         # Encoding (downsampling) part
         out = self.first(source_image)
         for i in range(len(self.down_blocks)):
@@ -218,11 +238,23 @@ class OcclusionAwareSPADEGenerator(nn.Module):
         feature_3d = out.view(bs, self.reshape_channel, self.reshape_depth, h ,w) 
         feature_3d = self.resblocks_3d(feature_3d)
 
+        source_features = {'feature_3d': feature_3d}
+        if self.dense_motion_network is not None:
+            source_features['compressed'] = self.dense_motion_network.compress_feature(feature_3d)
+        return source_features
+
+    def forward(self, source_image, kp_driving, kp_source):
+        return self.decode(self.encode_source(source_image), kp_driving=kp_driving, kp_source=kp_source)
+
+    def decode(self, source_features, kp_driving, kp_source):
+        feature_3d = source_features['feature_3d']
+
         # Transforming feature representation according to deformation and occlusion
         output_dict = {}
         if self.dense_motion_network is not None:
             dense_motion = self.dense_motion_network(feature=feature_3d, kp_driving=kp_driving,
-                                                     kp_source=kp_source)
+                                                     kp_source=kp_source,
+                                                     compressed_feature=source_features.get('compressed'))
             output_dict['mask'] = dense_motion['mask']
 
             # import pdb; pdb.set_trace()
@@ -4,6 +4,9 @@ import torch.nn.functional as F
 import numpy as np
 from tqdm import tqdm 
 
+from src.utils.cancellation import check_cancelled
+from src.utils.stage_progress import report_stage
+
 def normalize_kp(kp_source, kp_driving, kp_driving_initial, adapt_movement_scale=False,
                  use_relative_movement=False, use_relative_jacobian=False):
     if adapt_movement_scale:
@@ -26,11 +29,19 @@ def normalize_kp(kp_source, kp_driving, kp_driving_initial, adapt_movement_scale
 
     return kp_new
 
+_bin_cache = {}
+
+
+def _degree_bins(pred):
+    # the 66 bin indices, built once per device/dtype instead of once per frame and angle
+    key = (pred.device, pred.dtype)
+    if key not in _bin_cache:
+        _bin_cache[key] = torch.arange(66, dtype=torch.float32).type_as(pred).to(pred.device)
+    return _bin_cache[key]
+
 def headpose_pred_to_degree(pred):
-    device = pred.device
-    idx_tensor = [idx for idx in range(66)]
-    idx_tensor = torch.FloatTensor(idx_tensor).type_as(pred).to(device)
-    pred = F.softmax(pred)
+    idx_tensor = _degree_bins(pred)
+    pred = F.softmax(pred, dim=1)   # same as the implicit dim for (bs, 66), without the per-call warning
     degree = torch.sum(pred*idx_tensor, 1) * 3 - 99
     return degree
 
@@ -109,8 +120,13 @@ def make_animation(source_image, source_semantics, target_semantics,
         kp_canonical = kp_detector(source_image)
         he_source = mapping(source_semantics)
         kp_source = keypoint_transformation(kp_canonical, he_source)
+
+        # the source image is the same for every frame: encode it once
+        source_features = generator.encode_source(source_image)
     
         for frame_idx in tqdm(range(target_semantics.shape[1]), 'Face Renderer:'):
+            check_cancelled()
+            report_stage('render', frame_idx, target_semantics.shape[1])
             # still check the dimension
             # print(target_semantics.shape, source_semantics.shape)
             target_semantics_frame = target_semantics[:, frame_idx]
@@ -125,7 +141,7 @@ def make_animation(source_image, source_semantics, target_semantics,
             kp_driving = keypoint_transformation(kp_canonical, he_driving)
                 
             kp_norm = kp_driving
-            out = generator(source_image, kp_source=kp_source, kp_driving=kp_norm)
+            out = generator.decode(source_features, kp_source=kp_source, kp_driving=kp_norm)
             '''
             source_image_new = out['prediction'].squeeze(1)
             kp_canonical_new =  kp_detector(source_image_new)
@@ -138,6 +154,112 @@ def make_animation(source_image, source_semantics, target_semantics,
         predictions_ts = torch.stack(predictions, dim=1)
     return predictions_ts
 
+# Fallback working set of one 256px frame through mapping + generator.decode, used when it
+# cannot be measured (cpu, or before the first chunk). Deliberately pessimistic: on cuda the
+# renderer replaces it with the peak allocation of rendering the first frame on its own
+# (see make_animation_chunks(probe_device=...)).
+RENDER_BYTES_PER_FRAME_256 = 160 * 1024 * 1024
+
+
+def estimate_render_chunk_size(img_size=256, device='cpu', hint=None, max_chunk=None, memory_fraction=0.5,
+                               per_frame=None):
+    """
+    Pick how many frames the renderer pushes through the generator at once,
+    from the free VRAM (cuda) or available RAM (cpu). hint (LectureParams.batch_size)
+    caps the chunk (never above max_chunk); the result is always clamped to what fits.
+    per_frame: measured bytes per frame, defaults to RENDER_BYTES_PER_FRAME_256 scaled to img_size.
+    """
+    if per_frame is None:
+        per_frame = RENDER_BYTES_PER_FRAME_256 * (float(img_size) / 256) ** 2
+    if max_chunk is None:
+        max_chunk = 32 if str(device).startswith('cuda') else 8
+
+    available = None
+    try:
+        if str(device).startswith('cuda') and torch.cuda.is_available():
+            available, _ = torch.cuda.mem_get_info()
+        else:
+            import psutil
+            available = psutil.virtual_memory().available
+    except Exception:
+        pass
+
+    preferred = min(int(hint), max_chunk) if hint else max_chunk
+    if available is None:
+        return max(1, int(hint or 1))
+
+    fits = int(available * memory_fraction // max(1, per_frame))
+    return max(1, min(preferred, fits))
+
+
+def make_animation_chunks(source_image, source_semantics, target_semantics,
+                            generator, kp_detector, mapping,
+                            yaw_c_seq=None, pitch_c_seq=None, roll_c_seq=None,
+                            chunk_size=8, frame_num=None, probe_device=None, chunk_size_kwargs=None):
+    """
+    Flattened variant of make_animation: every frame of every batch row is put on one
+    time axis and mapping / keypoint_transformation / generator run on micro-batches
+    of chunk_size frames. Yields predictions of shape (n, 3, H, W) in frame order.
+
+    probe_device (cuda): render the first frame alone, measure its peak allocation and
+    re-pick chunk_size with estimate_render_chunk_size(per_frame=..., **chunk_size_kwargs).
+    """
+    def _flat(seq):
+        if seq is None:
+            return None
+        return seq.reshape((-1,) + tuple(seq.shape[2:]))
+
+    with torch.no_grad():
+        # the source is the same for every row of the legacy (batch_size, T/batch_size) layout
+        source_image = source_image[:1]
+        source_semantics = source_semantics[:1]
+
+        target_semantics = _flat(target_semantics)
+        yaw_c_seq, pitch_c_seq, roll_c_seq = _flat(yaw_c_seq), _flat(pitch_c_seq), _flat(roll_c_seq)
+        total = target_semantics.shape[0] if frame_num is None else min(int(frame_num), target_semantics.shape[0])
+
+        kp_canonical = kp_detector(source_image)
+        he_source = mapping(source_semantics)
+        kp_source = keypoint_transformation(kp_canonical, he_source)
+        source_features = generator.encode_source(source_image)
+
+        def _render(start, end):
+            n = end - start
+            he_driving = mapping(target_semantics[start:end])
+            if yaw_c_seq is not None:
+                he_driving['yaw_in'] = yaw_c_seq[start:end]
+            if pitch_c_seq is not None:
+                he_driving['pitch_in'] = pitch_c_seq[start:end]
+            if roll_c_seq is not None:
+                he_driving['roll_in'] = roll_c_seq[start:end]
+
+            kp_canonical_n = {'value': kp_canonical['value'].expand(n, -1, -1)}
+            kp_driving = keypoint_transformation(kp_canonical_n, he_driving)
+            kp_source_n = {'value': kp_source['value'].expand(n, -1, -1)}
+            source_features_n = {k: v.expand((n,) + tuple(v.shape[1:])) for k, v in source_features.items()}
+
+            return generator.decode(source_features_n, kp_source=kp_source_n, kp_driving=kp_driving)['prediction']
+
+        start = 0
+        if probe_device is not None and str(probe_device).startswith('cuda') and total > 0:
+            check_cancelled()
+            report_stage('render', 0, total)
+            torch.cuda.synchronize(probe_device)
+            torch.cuda.reset_peak_memory_stats(probe_device)
+            base = torch.cuda.memory_allocated(probe_device)
+            prediction = _render(0, 1)
+            per_frame = torch.cuda.max_memory_allocated(probe_device) - base
+            chunk_size = estimate_render_chunk_size(device=probe_device, per_frame=per_frame,
+                                                    **(chunk_size_kwargs or {}))
+            yield prediction
+            start = 1
+
+        for start in tqdm(range(start, total, chunk_size), 'Face Renderer:'):
+            check_cancelled()
+            report_stage('render', start, total)
+            yield _render(start, min(start + chunk_size, total))
+
+
 class AnimateModel(torch.nn.Module):
     """
     Merge all generator related updates into single model for better multi-gpu usage
@@ -1,6 +1,5 @@
 import os
 
-from tqdm import tqdm
 import torch
 import numpy as np
 import random
@@ -22,6 +21,36 @@ def parse_audio_length(audio_length, sr, fps):
 
     return audio_length, num_frames
 
+def _mel_window_index(start_frame, end_frame, n_mel, fps=25, step_size=16):
+    # same float math and truncation as int(80. * ((i-2) / float(fps))), then clamp to the spectrogram
+    frame_ids = np.arange(start_frame, end_frame)
+    start_idx = np.trunc(80. * ((frame_ids - 2) / float(fps))).astype(np.int64)
+    index = start_idx[:, None] + np.arange(step_size)[None, :]
+    return np.clip(index, 0, n_mel - 1)
+
+
+def mel_window_range(orig_mel, start_frame, end_frame, fps=25, step_size=16):
+    """ (end_frame - start_frame, 80, step_size) mel windows of video frames [start_frame, end_frame). """
+    index = _mel_window_index(start_frame, end_frame, orig_mel.shape[0], fps, step_size)
+    return np.ascontiguousarray(orig_mel[index].transpose(0, 2, 1))
+
+
+def mel_windows(orig_mel, num_frames, fps=25, step_size=16):
+    """ (num_frames, 80, step_size) mel window of every video frame, gathered in one indexing op. """
+    return mel_window_range(orig_mel, 0, num_frames, fps, step_size)
+
+
+def iter_mel_windows(orig_mel, num_frames, block_size=1024, fps=25, step_size=16):
+    """ Same windows as mel_windows, yielded as (start_frame, (n, 80, step_size)) blocks for very long audio. """
+    for start in range(0, num_frames, block_size):
+        yield start, mel_window_range(orig_mel, start, min(start + block_size, num_frames), fps, step_size)
+
+
+def mel_window_tensor(windows, device):
+    """ numpy (n, 80, 16) windows -> (1, n, 1, 80, 16) float tensor on device, the old indiv_mels layout. """
+    return torch.from_numpy(np.asarray(windows, dtype=np.float32)).unsqueeze(1).unsqueeze(0).to(device)
+
+
 def generate_blink_seq(num_frames):
     ratio = np.zeros((num_frames,1))
     frame_id = 0
@@ -48,7 +77,14 @@ def generate_blink_seq_randomly(num_frames):
             break
     return ratio
 
-def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, still=False, idlemode=False, length_of_audio=False, use_blink=True):
+def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, still=False, idlemode=False, length_of_audio=False, use_blink=True, wav=None):
+    """
+    wav: optional 16 kHz mono float32 samples of audio_path already in memory (skips reloading the file).
+
+    The batch carries the mel spectrogram ('orig_mel', (n_mel, 80) on the cpu) instead of every
+    frame's (80, 16) window: Audio2Exp / Audio2Pose gather windows per chunk, so a whole-lecture
+    track never holds all T windows at once.
+    """
 
     syncnet_mel_step_size = 16
     fps = 25
@@ -59,24 +95,14 @@ def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, stil
     
     if idlemode:
         num_frames = int(length_of_audio * 25)
-        indiv_mels = np.zeros((num_frames, 80, 16))
+        # every window clamps to this single silent row
+        orig_mel = np.zeros((1, 80), dtype=np.float32)
     else:
-        wav = audio.load_wav(audio_path, 16000) 
+        if wav is None:
+            wav = audio.load_wav(audio_path, 16000)
         wav_length, num_frames = parse_audio_length(len(wav), 16000, 25)
         wav = crop_pad_audio(wav, wav_length)
-        orig_mel = audio.melspectrogram(wav).T
-        spec = orig_mel.copy()         # nframes 80
-        indiv_mels = []
-
-        for i in tqdm(range(num_frames), 'mel:'):
-            start_frame_num = i-2
-            start_idx = int(80. * (start_frame_num / float(fps)))
-            end_idx = start_idx + syncnet_mel_step_size
-            seq = list(range(start_idx, end_idx))
-            seq = [ min(max(item, 0), orig_mel.shape[0]-1) for item in seq ]
-            m = spec[seq, :]
-            indiv_mels.append(m.T)
-        indiv_mels = np.asarray(indiv_mels)         # T 80 16
+        orig_mel = np.ascontiguousarray(audio.melspectrogram(wav).T, dtype=np.float32)     # n_mel 80
 
     ratio = generate_blink_seq_randomly(num_frames)      # T
     source_semantics_path = first_coeff_path
@@ -99,8 +125,6 @@ def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, stil
 
         ref_coeff[:, :64] = refeyeblink_coeff[:num_frames, :64] 
     
-    indiv_mels = torch.FloatTensor(indiv_mels).unsqueeze(1).unsqueeze(0) # bs T 1 80 16
-
     if use_blink:
         ratio = torch.FloatTensor(ratio).unsqueeze(0)                       # bs T
     else:
@@ -108,11 +132,10 @@ def get_data(first_coeff_path, audio_path, device, ref_eyeblink_coeff_path, stil
                                # bs T
     ref_coeff = torch.FloatTensor(ref_coeff).unsqueeze(0)                # bs 1 70
 
-    indiv_mels = indiv_mels.to(device)
     ratio = ratio.to(device)
     ref_coeff = ref_coeff.to(device)
 
-    return {'indiv_mels': indiv_mels,  
+    return {'orig_mel': orig_mel,
             'ref': ref_coeff, 
             'num_frames': num_frames, 
             'ratio_gt': ratio,
@@ -7,7 +7,9 @@ import scipy.io as scio
 
 def get_facerender_data(coeff_path, pic_path, first_coeff_path, audio_path, 
                         batch_size, input_yaw_list=None, input_pitch_list=None, input_roll_list=None, 
-                        expression_scale=1.0, still_mode = False, preprocess='crop', size = 256):
+                        expression_scale=1.0, still_mode = False, preprocess='crop', size = 256,
+                        save_coeff_txt=False):
+    # save_coeff_txt: also dump the target coefficients as <coeff_path>.txt (debugging only)
 
     semantic_radius = 13
     video_name = os.path.splitext(os.path.split(coeff_path)[-1])[0]
@@ -49,25 +51,17 @@ def get_facerender_data(coeff_path, pic_path, first_coeff_path, audio_path,
     if still_mode:
         generated_3dmm[:, 64:] = np.repeat(source_semantics[:, 64:], generated_3dmm.shape[0], axis=0)
 
-    with open(txt_path+'.txt', 'w') as f:
-        for coeff in generated_3dmm:
-            for i in coeff:
-                f.write(str(i)[:7]   + '  '+'\t')
-            f.write('\n')
+    if save_coeff_txt:
+        with open(txt_path+'.txt', 'w') as f:
+            for coeff in generated_3dmm:
+                f.write(''.join(str(i)[:7] + '  '+'\t' for i in coeff))
+                f.write('\n')
 
-    target_semantics_list = [] 
     frame_num = generated_3dmm.shape[0]
     data['frame_num'] = frame_num
-    for frame_idx in range(frame_num):
-        target_semantics = transform_semantic_target(generated_3dmm, frame_idx, semantic_radius)
-        target_semantics_list.append(target_semantics)
-
-    remainder = frame_num%batch_size
-    if remainder!=0:
-        for _ in range(batch_size-remainder):
-            target_semantics_list.append(target_semantics)
-
-    target_semantics_np = np.array(target_semantics_list)             #frame_num 70 semantic_radius*2+1
+    # the last frame is repeated so the frames split evenly into batch_size rows
+    padded_num = frame_num + (-frame_num) % batch_size
+    target_semantics_np = transform_semantic_targets(generated_3dmm, semantic_radius, padded_num)  #frame_num 70 semantic_radius*2+1
     target_semantics_np = target_semantics_np.reshape(batch_size, -1, target_semantics_np.shape[-2], target_semantics_np.shape[-1])
     data['target_semantics_list'] = torch.FloatTensor(target_semantics_np)
     data['video_name'] = video_name
@@ -97,40 +91,31 @@ def transform_semantic_target(coeff_3dmm, frame_index, semantic_radius):
     coeff_3dmm_g = coeff_3dmm[index, :]
     return coeff_3dmm_g.transpose(1,0)
 
+def transform_semantic_targets(coeff_3dmm, semantic_radius, out_frames=None):
+    """ transform_semantic_target for every frame at once: (out_frames, C, semantic_radius*2+1).
+    Frames past the end (out_frames > num_frames) repeat the last frame's window. """
+    num_frames = coeff_3dmm.shape[0]
+    out_frames = num_frames if out_frames is None else out_frames
+    centers = np.minimum(np.arange(out_frames), num_frames-1)
+    index = np.clip(centers[:, None] + np.arange(-semantic_radius, semantic_radius+1)[None, :], 0, num_frames-1)
+    return coeff_3dmm[index].transpose(0, 2, 1)
+
 def gen_camera_pose(camera_degree_list, frame_num, batch_size):
 
-    new_degree_list = [] 
+    padded_num = frame_num + (-frame_num) % batch_size
     if len(camera_degree_list) == 1:
-        for _ in range(frame_num):
-            new_degree_list.append(camera_degree_list[0]) 
-        remainder = frame_num%batch_size
-        if remainder!=0:
-            for _ in range(batch_size-remainder):
-                new_degree_list.append(new_degree_list[-1])
-        new_degree_np = np.array(new_degree_list).reshape(batch_size, -1) 
-        return new_degree_np
-
-    degree_sum = 0.
-    for i, degree in enumerate(camera_degree_list[1:]):
-        degree_sum += abs(degree-camera_degree_list[i])
+        return np.full((padded_num,), camera_degree_list[0]).reshape(batch_size, -1)
+
+    degrees = np.asarray(camera_degree_list, dtype=np.float64)
+    degree_sum = np.abs(np.diff(degrees)).sum()
     
     degree_per_frame = degree_sum/(frame_num-1)
-    for i, degree in enumerate(camera_degree_list[1:]):
-        degree_last = camera_degree_list[i]
+    segments = []
+    for degree_last, degree in zip(camera_degree_list[:-1], camera_degree_list[1:]):
         degree_step = degree_per_frame * abs(degree-degree_last)/(degree-degree_last)
-        new_degree_list =  new_degree_list + list(np.arange(degree_last, degree, degree_step))
-    if len(new_degree_list) > frame_num:
-        new_degree_list = new_degree_list[:frame_num]
-    elif len(new_degree_list) < frame_num:
-        for _ in range(frame_num-len(new_degree_list)):
-            new_degree_list.append(new_degree_list[-1])
-    print(len(new_degree_list))
-    print(frame_num)
-
-    remainder = frame_num%batch_size
-    if remainder!=0:
-        for _ in range(batch_size-remainder):
-            new_degree_list.append(new_degree_list[-1])
-    new_degree_np = np.array(new_degree_list).reshape(batch_size, -1) 
-    return new_degree_np
-    
+        segments.append(np.arange(degree_last, degree, degree_step))
+    new_degree_np = np.concatenate(segments)[:frame_num]
+
+    # hold the last angle for missing frames and the batch padding
+    new_degree_np = np.pad(new_degree_np, (0, padded_num-len(new_degree_np)), mode='edge')
+    return new_degree_np.reshape(batch_size, -1)
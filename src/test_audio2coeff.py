@@ -71,26 +71,31 @@ class Audio2Coeff():
  
         self.device = device
 
-    def generate(self, batch, coeff_save_dir, pose_style, ref_pose_coeff_path=None):
+    def generate(self, batch, coeff_save_dir, pose_style, ref_pose_coeff_path=None, still_mode=False):
 
         with torch.no_grad():
             #test
             results_dict_exp= self.audio2exp_model.test(batch)
             exp_pred = results_dict_exp['exp_coeff_pred']                         #bs T 64
 
-            #for class_id in  range(1):
-            #class_id = 0#(i+10)%45
-            #class_id = random.randint(0,46)                                   #46 styles can be selected 
-            batch['class'] = torch.LongTensor([pose_style]).to(self.device)
-            results_dict_pose = self.audio2pose_model.test(batch) 
-            pose_pred = results_dict_pose['pose_pred']                        #bs T 6
-
-            pose_len = pose_pred.shape[1]
-            if pose_len<13: 
-                pose_len = int((pose_len-1)/2)*2+1
-                pose_pred = torch.Tensor(savgol_filter(np.array(pose_pred.cpu()), pose_len, 2, axis=1)).to(self.device)
+            if still_mode:
+                # still mode renders with the source pose (get_facerender_data overwrites 64:),
+                # so the CVAE pose prediction and its smoothing would be thrown away
+                pose_pred = batch['ref'][:, :, 64:70]                             #bs T 6
             else:
-                pose_pred = torch.Tensor(savgol_filter(np.array(pose_pred.cpu()), 13, 2, axis=1)).to(self.device) 
+                #for class_id in  range(1):
+                #class_id = 0#(i+10)%45
+                #class_id = random.randint(0,46)                                   #46 styles can be selected 
+                batch['class'] = torch.LongTensor([pose_style]).to(self.device)
+                results_dict_pose = self.audio2pose_model.test(batch) 
+                pose_pred = results_dict_pose['pose_pred']                        #bs T 6
+
+                pose_len = pose_pred.shape[1]
+                if pose_len<13: 
+                    pose_len = int((pose_len-1)/2)*2+1
+                    pose_pred = torch.Tensor(savgol_filter(np.array(pose_pred.cpu()), pose_len, 2, axis=1)).to(self.device)
+                else:
+                    pose_pred = torch.Tensor(savgol_filter(np.array(pose_pred.cpu()), 13, 2, axis=1)).to(self.device) 
             
             coeffs_pred = torch.cat((exp_pred, pose_pred), dim=-1)            #bs T 70
 
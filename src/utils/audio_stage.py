@@ -0,0 +1,69 @@
+import os
+import subprocess
+
+import numpy as np
+from scipy.io import wavfile
+
+from src.utils.cancellation import run as cancellable_run
+
+
+def _atempo_chain(rate):
+    # atempo only accepts 0.5..2.0 per filter, chain it for larger factors
+    r = float(rate)
+    filters = []
+    while r > 2.0 + 1e-9:
+        filters.append('atempo=2.0')
+        r /= 2.0
+    while r < 0.5 - 1e-9:
+        filters.append('atempo=0.5')
+        r /= 0.5
+    filters.append('atempo=%.3f' % r)
+    return ','.join(filters)
+
+
+def write_wav(path, wav, sr=16000):
+    """ float32 [-1, 1] mono -> 16-bit PCM wav, returns the int16 samples written. """
+    # x32768 + round so samples read back from a 16-bit wav (pcm / 32768) round-trip exactly
+    pcm = np.clip(np.round(np.asarray(wav, dtype=np.float64) * 32768.0), -32768, 32767).astype(np.int16)
+    wavfile.write(path, sr, pcm)
+    return pcm
+
+
+class NormalizedAudio():
+    """ Driving audio decoded once: 16 kHz mono float32 in memory plus the same samples as one wav on disk. """
+
+    def __init__(self, wav, sr, path):
+        self.wav = wav
+        self.sr = sr
+        self.path = path
+
+    @property
+    def duration(self):
+        return len(self.wav) / float(self.sr)
+
+
+def normalize_audio(in_path, out_path, rate=1.0, sr=16000, ffmpeg='ffmpeg'):
+    """
+    Decode (mp3/wav/...), time-stretch with atempo and resample to sr mono float32 in a single
+    ffmpeg pass piped straight into memory, then write one PCM wav for the stages that need a file.
+    Replaces the atempo re-encode, the MoviePy duration probe, the mp3->wav conversion in
+    SadTalker.test and the librosa reload in get_data.
+    """
+    filters = []
+    if abs(float(rate) - 1.0) >= 1e-3:
+        filters.append(_atempo_chain(rate))
+
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', in_path, '-vn']
+    if filters:
+        cmd += ['-filter:a', ','.join(filters)]
+    cmd += ['-ac', '1', '-ar', str(sr), '-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+    p = cancellable_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        raise RuntimeError('audio normalization failed: %s' % p.stderr.decode('utf-8', errors='ignore'))
+
+    wav = np.frombuffer(p.stdout, dtype=np.float32)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    pcm = write_wav(out_path, wav, sr)
+    # keep the in-memory copy identical to what librosa would read back from the wav
+    return NormalizedAudio(pcm.astype(np.float32) / 32768.0, sr, out_path)
@@ -0,0 +1,139 @@
+import contextvars
+import subprocess
+import threading
+from contextlib import contextmanager
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job once its CancelToken is cancelled. Derives from BaseException (like
+    KeyboardInterrupt) so the many `except Exception` fallbacks along the render path let it through.
+    """
+
+
+class CancelToken():
+    """
+    Cooperative cancellation for one job.
+
+    Long loops call raise_if_cancelled() between units of work (render chunks, enhancer frames,
+    slides). cancel() also kills every subprocess registered with track(), so a running ffmpeg /
+    LibreOffice does not have to finish first. `poll` (callable -> bool) lets another process ask
+    for cancellation, e.g. through a flag file; watch() checks it from a background thread.
+    """
+
+    def __init__(self, poll=None, poll_interval=1.0):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._poll = poll
+        self._poll_interval = poll_interval
+        self._watcher = None
+        self._closed = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            procs = list(self._procs)
+        for p in procs:
+            try:
+                p.kill()
+            except Exception:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def track(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+        if self._event.is_set():
+            self.cancel()
+
+    def untrack(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def watch(self):
+        """ Start polling `poll` in a daemon thread; stops once cancelled or close() is called. """
+        if self._poll is None or self._watcher is not None:
+            return self
+
+        def _loop():
+            while not self._event.is_set() and not self._closed.wait(self._poll_interval):
+                try:
+                    if self._poll():
+                        self.cancel()
+                except Exception:
+                    pass
+
+        self._watcher = threading.Thread(target=_loop, name='cancel-watch', daemon=True)
+        self._watcher.start()
+        return self
+
+    def close(self):
+        if self._watcher is not None:
+            self._closed.set()
+            self._watcher = None
+
+
+_current = contextvars.ContextVar('cancel_token', default=None)
+
+
+def current_token():
+    return _current.get()
+
+
+@contextmanager
+def use_token(token):
+    """ Make `token` the ambient token of this context (threads started through copy_context inherit it). """
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled():
+    """ Raise JobCancelled if the ambient job was cancelled; no-op outside a job. """
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def track_process(proc):
+    token = _current.get()
+    if token is not None:
+        token.track(proc)
+    return token
+
+
+def run(cmd, check=False, timeout=None, **kwargs):
+    """
+    subprocess.run() that the ambient CancelToken can kill. Raises JobCancelled instead of
+    returning when the process was killed by a cancel.
+    """
+    token = _current.get()
+    if token is None:
+        return subprocess.run(cmd, check=check, timeout=timeout, **kwargs)
+
+    token.raise_if_cancelled()
+    with subprocess.Popen(cmd, **kwargs) as proc:
+        token.track(proc)
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            token.untrack(proc)
+    token.raise_if_cancelled()
+
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
@@ -0,0 +1,147 @@
+import os
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+
+
+_probe_lock = threading.Lock()
+_probe_cache = {}
+
+
+def probe_encoders(ffmpeg='ffmpeg'):
+    """
+    Which h264 encoders actually work with this ffmpeg, probed once per process.
+    h264_nvenc is only reported when a 1-frame test encode succeeds, so CPU-only boxes
+    never pay a failed nvenc spawn per slide.
+    """
+    with _probe_lock:
+        if ffmpeg in _probe_cache:
+            return _probe_cache[ffmpeg]
+
+        found = {'h264_nvenc': False, 'libx264': False}
+        if shutil.which(ffmpeg) is not None:
+            try:
+                listed = subprocess.run([ffmpeg, '-hide_banner', '-encoders'],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=20)
+                names = listed.stdout.decode('utf-8', errors='ignore')
+            except Exception:
+                names = ''
+            for name in found:
+                if name not in names:
+                    continue
+                test = [ffmpeg, '-hide_banner', '-loglevel', 'error',
+                        '-f', 'lavfi', '-i', 'color=c=black:s=256x256:r=25', '-frames:v', '1',
+                        '-c:v', name, '-f', 'null', '-']
+                try:
+                    found[name] = subprocess.run(test, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                                 timeout=30).returncode == 0
+                except Exception:
+                    found[name] = False
+
+        print('[encoding] available h264 encoders: %s' % ', '.join(k for k, v in found.items() if v))
+        _probe_cache[ffmpeg] = found
+        return found
+
+
+class _ThreadBudget():
+    """
+    Splits a fixed x264 thread budget between the encodes running at the same time in this
+    process (overlay of one job, frame writer of another, ...), instead of every ffmpeg
+    spawning one thread per core and thrashing.
+
+    A slot gets total // active threads, capped by what is still unclaimed, so the threads
+    handed out never add up to more than total. The only excess is the 1-thread floor of an
+    encode that starts while the budget is fully claimed; shares are not rebalanced when
+    other encodes finish.
+    """
+
+    def __init__(self, total):
+        self.total = max(1, int(total))
+        self.active = 0
+        self.claimed = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self.active += 1
+            threads = max(1, min(self.total // self.active, self.total - self.claimed))
+            self.claimed += threads
+        try:
+            yield threads
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.claimed -= threads
+
+
+THREAD_BUDGET = _ThreadBudget(int(os.getenv('FFMPEG_THREAD_BUDGET', '0') or 0) or (os.cpu_count() or 4))
+
+
+@dataclass(frozen=True)
+class EncodingProfile():
+    """ Video encoder settings for one kind of output; video_args() turns them into ffmpeg arguments. """
+    kind: str = 'generic'
+    vcodec: str = 'libx264'
+    preset: str = 'veryfast'
+    crf: int = 23
+    tune: str = None
+    pix_fmt: str = 'yuv420p'
+    gop: int = None                  # fixed keyframe interval (frames), keeps copy-concat segments aligned
+    extra: tuple = field(default_factory=tuple)
+
+    def video_args(self, threads=None):
+        args = ['-c:v', self.vcodec, '-preset', self.preset]
+        if self.vcodec == 'h264_nvenc':
+            args += ['-rc', 'vbr', '-cq', str(self.crf), '-b:v', '0']
+        else:
+            args += ['-crf', str(self.crf)]
+            if self.tune:
+                args += ['-tune', self.tune]
+            if threads:
+                args += ['-threads', str(threads)]
+        if self.gop:
+            args += ['-g', str(self.gop), '-keyint_min', str(self.gop), '-sc_threshold', '0']
+        args += ['-pix_fmt', self.pix_fmt]
+        return args + list(self.extra)
+
+
+# x264 settings per kind of output; nvenc variants are derived in get_encoding_profile
+_X264_PROFILES = {
+    # slide + small talking-head overlay: mostly static picture
+    'slide': EncodingProfile(kind='slide', preset='ultrafast', crf=23, tune='stillimage'),
+    # rendered face frames (SadTalker output, re-encoded again by the overlay)
+    'face': EncodingProfile(kind='face', preset='veryfast', crf=18),
+    # one-pass re-encode of a whole lecture when copy-concat is not possible
+    'concat': EncodingProfile(kind='concat', preset='veryfast', crf=20),
+    # watermark / misc one-off encodes
+    'generic': EncodingProfile(kind='generic', preset='veryfast', crf=20),
+}
+
+_NVENC_PRESETS = {'slide': 'p5', 'face': 'p4', 'concat': 'p5', 'generic': 'p4'}
+
+
+def get_encoding_profile(kind='generic', ffmpeg='ffmpeg', crf=None, fps=None, prefer_gpu=True):
+    """
+    Encoding profile for one kind of output ('slide', 'face', 'concat', 'generic').
+    Uses h264_nvenc only when the probe found a working one; fps sets a 2 s GOP.
+    """
+    base = _X264_PROFILES.get(kind, _X264_PROFILES['generic'])
+    changes = {}
+    if prefer_gpu and probe_encoders(ffmpeg).get('h264_nvenc'):
+        changes.update(vcodec='h264_nvenc', preset=_NVENC_PRESETS.get(kind, 'p4'), tune=None)
+    if crf is not None:
+        changes['crf'] = int(crf)
+    if fps:
+        changes['gop'] = int(fps) * 2
+    return replace(base, **changes) if changes else base
+
+
+def cpu_fallback(profile):
+    """ Same profile on libx264, for when a GPU encode fails mid-run. """
+    if profile.vcodec == 'libx264':
+        return profile
+    base = _X264_PROFILES.get(profile.kind, _X264_PROFILES['generic'])
+    return replace(base, crf=profile.crf, gop=profile.gop, extra=profile.extra)
@@ -5,6 +5,7 @@ from gfpgan import GFPGANer
 
 from tqdm import tqdm
 
+from src.utils.cancellation import check_cancelled
 from src.utils.videoio import load_video_to_cv2
 
 import cv2
@@ -48,6 +49,29 @@ def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan'
     if not isinstance(images, list) and os.path.isfile(images): # handle video to images
         images = load_video_to_cv2(images)
 
+    restorer = build_restorer(method=method, bg_upsampler=bg_upsampler)
+
+    # ------------------------ restore ------------------------
+    for idx in tqdm(range(len(images)), 'Face Enhancer:'):
+        check_cancelled()
+        yield enhance_frame(restorer, images[idx])
+
+
+def enhance_frame(restorer, image):
+    """ Restore one RGB frame with a restorer from build_restorer(), returns RGB. """
+    img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    # restore faces and background if necessary
+    cropped_faces, restored_faces, r_img = restorer.enhance(
+        img,
+        has_aligned=False,
+        only_center_face=False,
+        paste_back=True)
+
+    return cv2.cvtColor(r_img, cv2.COLOR_BGR2RGB)
+
+
+def build_restorer(method='gfpgan', bg_upsampler='realesrgan'):
     # ------------------------ set up GFPGAN restorer ------------------------
     if  method == 'gfpgan':
         arch = 'clean'
@@ -106,18 +130,5 @@ def enhancer_generator_no_len(images, method='gfpgan', bg_upsampler='realesrgan'
         arch=arch,
         channel_multiplier=channel_multiplier,
         bg_upsampler=bg_upsampler)
+    return restorer
 
-    # ------------------------ restore ------------------------
-    for idx in tqdm(range(len(images)), 'Face Enhancer:'):
-        
-        img = cv2.cvtColor(images[idx], cv2.COLOR_RGB2BGR)
-        
-        # restore faces and background if necessary
-        cropped_faces, restored_faces, r_img = restorer.enhance(
-            img,
-            has_aligned=False,
-            only_center_face=False,
-            paste_back=True)
-        
-        r_img = cv2.cvtColor(r_img, cv2.COLOR_BGR2RGB)
-        yield r_img
@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from src.utils.cancellation import check_cancelled
+from src.utils.videoio import FFmpegFrameWriter
+from src.utils.paste_pic import paste_back_box, paste_back_frame
+
+
+class ResizeStage():
+    def __init__(self, size):
+        self.size = (int(size[0]), int(size[1]))
+
+    def __call__(self, frame):
+        return cv2.resize(frame, self.size)
+
+
+class PasteBackStage():
+    """ Paste the rendered face back into the original picture (preprocess='full'). """
+
+    def __init__(self, pic_path, crop_info, extended_crop=False):
+        full_img = cv2.imread(pic_path)
+        if full_img is None:
+            # video source: take its first frame like paste_pic does
+            video_stream = cv2.VideoCapture(pic_path)
+            _, full_img = video_stream.read()
+            video_stream.release()
+        if full_img is None:
+            raise ValueError('pic_path must be a valid path to video/image file')
+
+        # frames travel through the pipeline as RGB
+        self.full_img = cv2.cvtColor(full_img, cv2.COLOR_BGR2RGB)
+        self.box = paste_back_box(crop_info, extended_crop)
+        if self.box is None:
+            raise ValueError("you didn't crop the image")
+
+    def __call__(self, frame):
+        return paste_back_frame(frame, self.full_img, self.box)
+
+
+class EnhanceStage():
+    """ GFPGAN (or another restorer) on every frame; the restorer is built once per pipeline. """
+
+    def __init__(self, method='gfpgan', bg_upsampler=None):
+        # gfpgan is heavy, only import it when the enhancer is actually requested
+        from src.utils.face_enhancer import build_restorer, enhance_frame
+        self.restorer = build_restorer(method=method, bg_upsampler=bg_upsampler)
+        self._enhance_frame = enhance_frame
+
+    def __call__(self, frame):
+        return self._enhance_frame(self.restorer, frame)
+
+
+class FramePipeline():
+    """
+    Chains frame stages (resize, paste-back, enhance, ...) on in-memory RGB uint8 frames
+    and encodes the result exactly once, muxed with the audio track. This replaces the
+    temp mp4 -> paste_pic -> mux -> enhancer -> mux round trips.
+    """
+
+    def __init__(self, stages=None, fps=25):
+        self.stages = [s for s in (stages or []) if s is not None]
+        self.fps = fps
+
+    def process(self, frame):
+        for stage in self.stages:
+            frame = stage(frame)
+        return frame
+
+    def run(self, frame_chunks, save_path, audio_path=None, desc='Frame pipeline:'):
+        """
+        frame_chunks: iterable of frame batches (lists or (n, H, W, 3) arrays).
+        The writer is opened lazily because the output size is only known after the stages.
+        """
+        writer = None
+        bar = tqdm(desc=desc, unit='frame')
+        try:
+            for chunk in frame_chunks:
+                for frame in chunk:
+                    check_cancelled()
+                    out = np.ascontiguousarray(self.process(frame))
+                    if writer is None:
+                        writer = FFmpegFrameWriter(save_path, (out.shape[1], out.shape[0]),
+                                                   fps=self.fps, audio_path=audio_path)
+                    writer.write(out)
+                    bar.update(1)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            bar.close()
+
+        if writer is None:
+            raise RuntimeError('FramePipeline got no frames to encode')
+        return writer.close()
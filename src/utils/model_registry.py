@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from src.utils.init_path import init_path
+
+
+def _module_nbytes(obj, seen=None, depth=0):
+    """ Rough resident size of every nn.Module reachable from obj (params + buffers). """
+    if seen is None:
+        seen = set()
+    if obj is None or id(obj) in seen or depth > 3:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        total = 0
+        for t in list(obj.parameters()) + list(obj.buffers()):
+            total += t.numel() * t.element_size()
+        return total
+
+    total = 0
+    for v in getattr(obj, '__dict__', {}).values():
+        if isinstance(v, torch.nn.Module) or hasattr(v, '__dict__'):
+            total += _module_nbytes(v, seen, depth + 1)
+    return total
+
+
+class SadTalkerModels():
+    """ One warm variant: the three networks SadTalker.test() needs for a (size, preprocess, device). """
+
+    def __init__(self, sadtalker_paths, device):
+        # imported here so that importing the registry stays cheap
+        from src.utils.preprocess import CropAndExtract
+        from src.test_audio2coeff import Audio2Coeff
+        from src.facerender.animate import AnimateFromCoeff
+
+        self.sadtalker_paths = sadtalker_paths
+        self.device = device
+        self.audio_to_coeff = Audio2Coeff(sadtalker_paths, device)
+        self.preprocess_model = CropAndExtract(sadtalker_paths, device)
+        self.animate_from_coeff = AnimateFromCoeff(sadtalker_paths, device)
+
+        self.nbytes = _module_nbytes(self)
+        self.last_used = time.time()
+        # callers between ModelRegistry.get() and release(); only idle variants are evicted
+        self.in_use = 0
+
+
+class ModelRegistry():
+    """
+    Process-wide cache of SadTalker networks keyed by (size, preprocess, device).
+
+    Each variant is loaded once and shared by every caller in the process
+    (Flask threads, SadTalkerService instances, the RQ worker). When the total
+    resident size goes over max_bytes, the least recently used idle variants
+    are evicted. get() marks the variant in use until release() (or use `with
+    registry.use(...)`), so a model is never dropped under a running render.
+    """
+
+    def __init__(self, checkpoint_path='checkpoints', config_path='src/config', max_bytes=None):
+        self.checkpoint_path = checkpoint_path
+        self.config_path = config_path
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._models = OrderedDict()
+
+    @staticmethod
+    def make_key(size, preprocess, device):
+        return (int(size), str(preprocess), str(device))
+
+    def get(self, size, preprocess, device):
+        """ Warm variant for (size, preprocess, device), marked in use: pair with release(). """
+        key = self.make_key(size, preprocess, device)
+
+        with self._lock:
+            models = self._models.get(key)
+            if models is not None:
+                self._models.move_to_end(key)
+                models.last_used = time.time()
+                models.in_use += 1
+                return models
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # load outside the registry lock so other variants stay usable meanwhile
+        with load_lock:
+            with self._lock:
+                models = self._models.get(key)
+            if models is None:
+                print(f'[ModelRegistry] loading SadTalker models {key}')
+                paths = init_path(self.checkpoint_path, self.config_path, size, False, preprocess)
+                models = SadTalkerModels(paths, device)
+
+            with self._lock:
+                self._models[key] = models
+                self._models.move_to_end(key)
+                models.last_used = time.time()
+                models.in_use += 1
+                evicted = self._evict_locked()
+            if evicted:
+                self._release_memory()
+            return models
+
+    def release(self, models):
+        """ Caller is done with a variant from get(); it becomes evictable again once idle. """
+        with self._lock:
+            models.in_use = max(0, models.in_use - 1)
+            models.last_used = time.time()
+            # a variant that was kept over budget because it was busy can go now
+            evicted = self._evict_locked()
+        if evicted:
+            self._release_memory()
+
+    @contextmanager
+    def use(self, size, preprocess, device):
+        models = self.get(size, preprocess, device)
+        try:
+            yield models
+        finally:
+            self.release(models)
+
+    def evict(self, key=None):
+        """ Drop one idle variant (or every idle variant when key is None). """
+        with self._lock:
+            keys = list(self._models.keys()) if key is None else [key]
+            for k in keys:
+                models = self._models.get(k)
+                if models is not None and models.in_use == 0:
+                    del self._models[k]
+        self._release_memory()
+
+    def loaded_keys(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(m.nbytes for m in self._models.values())
+
+    def _evict_locked(self):
+        """ Drop LRU idle variants until under budget; returns True if any were dropped. """
+        if not self.max_bytes:
+            return False
+        evicted = False
+        total = sum(m.nbytes for m in self._models.values())
+        for key, models in list(self._models.items()):
+            if total <= self.max_bytes:
+                break
+            if models.in_use > 0:
+                continue
+            total -= self._models.pop(key).nbytes
+            print(f'[ModelRegistry] evicted idle SadTalker models {key}')
+            evicted = True
+        return evicted
+
+    @staticmethod
+    def _release_memory():
+        # called without the registry lock held: gc / empty_cache must not stall other get() calls
+        import gc
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+_registries = {}
+_registry_lock = threading.Lock()
+
+
+def get_model_registry(checkpoint_path='checkpoints', config_path='src/config', max_bytes=None):
+    """ Return the process-wide registry for these checkpoint / config dirs, creating it on first use. """
+    key = (os.path.abspath(checkpoint_path), os.path.abspath(config_path))
+    with _registry_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = ModelRegistry(checkpoint_path, config_path, max_bytes)
+        elif max_bytes is not None:
+            registry.max_bytes = max_bytes
+        return registry
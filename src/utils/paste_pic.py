@@ -1,9 +1,35 @@
 import cv2, os
 import numpy as np
 from tqdm import tqdm
-import uuid
 
-from src.utils.videoio import save_video_with_watermark 
+from src.utils.videoio import FFmpegFrameWriter
+
+
+def paste_back_box(crop_info, extended_crop=False):
+    """ (ox1, oy1, ox2, oy2) of the rendered face inside the original picture, None if the picture was not cropped. """
+    if len(crop_info) != 3:
+        return None
+    r_w, r_h = crop_info[0]
+    clx, cly, crx, cry = crop_info[1]
+    lx, ly, rx, ry = crop_info[2]
+    lx, ly, rx, ry = int(lx), int(ly), int(rx), int(ry)
+
+    if extended_crop:
+        oy1, oy2, ox1, ox2 = cly, cry, clx, crx
+    else:
+        oy1, oy2, ox1, ox2 = cly+ly, cly+ry, clx+lx, clx+rx
+    return ox1, oy1, ox2, oy2
+
+
+def paste_back_frame(crop_frame, full_img, box):
+    """ Seamless-clone one rendered face frame back into the full picture (same channel order for both). """
+    ox1, oy1, ox2, oy2 = box
+    p = cv2.resize(crop_frame.astype(np.uint8), (ox2-ox1, oy2 - oy1)) 
+
+    mask = 255*np.ones(p.shape, p.dtype)
+    location = ((ox1+ox2) // 2, (oy1+oy2) // 2)
+    return cv2.seamlessClone(p, full_img, mask, location, cv2.NORMAL_CLONE)
+
 
 def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path, extended_crop=False):
 
@@ -37,33 +63,13 @@ def paste_pic(video_path, pic_path, crop_info, new_audio_path, full_video_path,
             break
         crop_frames.append(frame)
     
-    if len(crop_info) != 3:
+    box = paste_back_box(crop_info, extended_crop)
+    if box is None:
         print("you didn't crop the image")
         return
-    else:
-        r_w, r_h = crop_info[0]
-        clx, cly, crx, cry = crop_info[1]
-        lx, ly, rx, ry = crop_info[2]
-        lx, ly, rx, ry = int(lx), int(ly), int(rx), int(ry)
-        # oy1, oy2, ox1, ox2 = cly+ly, cly+ry, clx+lx, clx+rx
-        # oy1, oy2, ox1, ox2 = cly+ly, cly+ry, clx+lx, clx+rx
-
-        if extended_crop:
-            oy1, oy2, ox1, ox2 = cly, cry, clx, crx
-        else:
-            oy1, oy2, ox1, ox2 = cly+ly, cly+ry, clx+lx, clx+rx
-
-    tmp_path = str(uuid.uuid4())+'.mp4'
-    out_tmp = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'MP4V'), fps, (frame_w, frame_h))
-    for crop_frame in tqdm(crop_frames, 'seamlessClone:'):
-        p = cv2.resize(crop_frame.astype(np.uint8), (ox2-ox1, oy2 - oy1)) 
-
-        mask = 255*np.ones(p.shape, p.dtype)
-        location = ((ox1+ox2) // 2, (oy1+oy2) // 2)
-        gen_img = cv2.seamlessClone(p, full_img, mask, location, cv2.NORMAL_CLONE)
-        out_tmp.write(gen_img)
-
-    out_tmp.release()
 
-    save_video_with_watermark(tmp_path, new_audio_path, full_video_path, watermark=False)
-    os.remove(tmp_path)
+    # encode once with the shared h264 profile and mux the audio in the same pass
+    with FFmpegFrameWriter(full_video_path, (frame_w, frame_h), fps=fps, audio_path=new_audio_path) as writer:
+        for crop_frame in tqdm(crop_frames, 'seamlessClone:'):
+            gen_img = paste_back_frame(crop_frame, full_img, box)
+            writer.write(cv2.cvtColor(gen_img, cv2.COLOR_BGR2RGB))
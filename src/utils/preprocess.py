@@ -60,7 +60,11 @@ class CropAndExtract():
         self.lm3d_std = load_lm3d(sadtalker_path['dir_of_BFM_fitting'])
         self.device = device
     
-    def generate(self, input_path, save_dir, crop_or_resize='crop', source_image_flag=False, pic_size=256):
+    def generate(self, input_path, save_dir, crop_or_resize='crop', source_image_flag=False, pic_size=256, cache=None):
+        """
+        cache: optional PreprocessCache; source images already seen (same bytes, mode and size)
+        skip face detection, landmarks and 3DMM extraction entirely.
+        """
 
         pic_name = os.path.splitext(os.path.split(input_path)[-1])[0]  
 
@@ -68,6 +72,15 @@ class CropAndExtract():
         coeff_path =  os.path.join(save_dir, pic_name+'.mat')  
         png_path =  os.path.join(save_dir, pic_name+'.png')  
 
+        cache_key = None
+        if cache is not None and source_image_flag and os.path.isfile(input_path) \
+                and input_path.split('.')[-1] in ['jpg', 'png', 'jpeg']:
+            cache_key = cache.make_key(input_path, crop_or_resize, pic_size)
+            cached = cache.load(cache_key, save_dir, pic_name)
+            if cached is not None:
+                print(' Using cached source preprocessing.')
+                return cached
+
         #load input
         if not os.path.isfile(input_path):
             raise ValueError('input_path must be a valid path to video/image file')
@@ -167,4 +180,7 @@ class CropAndExtract():
 
             savemat(coeff_path, {'coeff_3dmm': semantic_npy, 'full_3dmm': np.array(full_coeffs)[0]})
 
+        if cache_key is not None:
+            cache.store(cache_key, coeff_path, png_path, landmarks_path, crop_info)
+
         return coeff_path, png_path, crop_info
@@ -0,0 +1,90 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+
+import numpy as np
+
+
+def _jsonable(value):
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _crop_info_from_json(data):
+    size, crop, quad = data
+    return (tuple(size) if size is not None else None,
+            tuple(crop) if crop is not None else None,
+            list(quad) if quad is not None else None)
+
+
+class PreprocessCache():
+    """
+    Content-addressed cache for CropAndExtract.generate on a source image.
+
+    Entries are keyed by (sha256 of the image bytes, preprocess mode, size) and keep the
+    cropped png, the landmarks, crop_info and the first-frame 3DMM coefficients, so the
+    same teacher photo is only run through RetinaFace/FAN/net_recon once, across slides
+    and across jobs.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(input_path, crop_or_resize, pic_size):
+        h = hashlib.sha256()
+        with open(input_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return '%s_%s_%d' % (h.hexdigest(), crop_or_resize.lower(), int(pic_size))
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key, save_dir, pic_name):
+        """ Copy a cached entry into save_dir under pic_name; returns (coeff_path, png_path, crop_info) or None. """
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+            coeff_path = os.path.join(save_dir, pic_name + '.mat')
+            png_path = os.path.join(save_dir, pic_name + '.png')
+            landmarks_path = os.path.join(save_dir, pic_name + '_landmarks.txt')
+            shutil.copyfile(os.path.join(entry, 'coeff.mat'), coeff_path)
+            shutil.copyfile(os.path.join(entry, 'crop.png'), png_path)
+            if os.path.isfile(os.path.join(entry, 'landmarks.txt')):
+                shutil.copyfile(os.path.join(entry, 'landmarks.txt'), landmarks_path)
+            return coeff_path, png_path, _crop_info_from_json(meta['crop_info'])
+        except Exception as e:
+            print('[PreprocessCache] ignoring broken entry %s: %s' % (key, e))
+            return None
+
+    def store(self, key, coeff_path, png_path, landmarks_path, crop_info):
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+
+        # build the entry next to its final place and rename it in, readers never see half an entry
+        tmp_dir = os.path.join(self.root, '.tmp_' + str(uuid.uuid4()))
+        os.makedirs(tmp_dir)
+        try:
+            shutil.copyfile(coeff_path, os.path.join(tmp_dir, 'coeff.mat'))
+            shutil.copyfile(png_path, os.path.join(tmp_dir, 'crop.png'))
+            if landmarks_path and os.path.isfile(landmarks_path):
+                shutil.copyfile(landmarks_path, os.path.join(tmp_dir, 'landmarks.txt'))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'crop_info': _jsonable(crop_info)}, f)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # another worker stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,100 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageProgress():
+    """
+    Stage-level progress of one job (tts, coeff, render %, composite, ...).
+
+    Entries are keyed by (stage, slide) and dropped when the stage finishes, so snapshot()
+    lists what is running right now; stages of different slides overlap in the pipeline.
+    emit(snapshot) is called on every start / finish and at most every `min_interval`
+    seconds for frame-level updates.
+    """
+
+    def __init__(self, emit=None, min_interval=0.5):
+        self._emit = emit
+        self._min_interval = min_interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._last_emit = 0.0
+
+    def start(self, stage, slide=None):
+        with self._lock:
+            self._active[(stage, slide)] = {'stage': stage, 'slide': slide, 'started_at': int(time.time())}
+        self._flush(force=True)
+
+    def update(self, stage, slide=None, done=0, total=0):
+        with self._lock:
+            entry = self._active.setdefault((stage, slide),
+                                            {'stage': stage, 'slide': slide, 'started_at': int(time.time())})
+            entry['done'], entry['total'] = int(done), int(total)
+            entry['pct'] = round(100.0 * done / total, 1) if total else None
+        self._flush()
+
+    def finish(self, stage, slide=None):
+        with self._lock:
+            self._active.pop((stage, slide), None)
+        self._flush(force=True)
+
+    def snapshot(self):
+        with self._lock:
+            entries = [dict(e) for e in self._active.values()]
+        return sorted(entries, key=lambda e: (e['slide'] or 0, e['started_at']))
+
+    def _flush(self, force=False):
+        if self._emit is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < self._min_interval:
+                return
+            self._last_emit = now
+        try:
+            self._emit(self.snapshot())
+        except Exception as e:
+            print('stage progress emit failed:', e)
+
+
+# (StageProgress of the running job, slide bound by the enclosing track_stage)
+_current = contextvars.ContextVar('stage_progress', default=(None, None))
+
+
+@contextmanager
+def use_progress(progress):
+    """ Make `progress` the ambient StageProgress of this context. """
+    reset = _current.set((progress, None))
+    try:
+        yield progress
+    finally:
+        _current.reset(reset)
+
+
+@contextmanager
+def track_stage(stage, slide=None):
+    """
+    Mark `stage` as running for the duration of the block. slide defaults to the one of the
+    enclosing track_stage, so SadTalker internals (coeff, render) land on the slide being rendered.
+    No-op outside a job.
+    """
+    progress, bound = _current.get()
+    if progress is None:
+        yield
+        return
+    slide = bound if slide is None else slide
+    reset = _current.set((progress, slide))
+    progress.start(stage, slide)
+    try:
+        yield
+    finally:
+        progress.finish(stage, slide)
+        _current.reset(reset)
+
+
+def report_stage(stage, done, total):
+    """ done/total of `stage` for the current slide (e.g. rendered frames); throttled by StageProgress. """
+    progress, slide = _current.get()
+    if progress is not None:
+        progress.update(stage, slide, done, total)
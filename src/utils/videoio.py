@@ -1,9 +1,14 @@
 import shutil
 import uuid
+import subprocess
 
 import os
 
 import cv2
+import numpy as np
+
+from src.utils.cancellation import check_cancelled, track_process
+from src.utils.encoding import THREAD_BUDGET, cpu_fallback, get_encoding_profile
 
 def load_video_to_cv2(input_path):
     video_stream = cv2.VideoCapture(input_path)
@@ -17,6 +22,145 @@ def load_video_to_cv2(input_path):
         full_frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
     return full_frames
 
+class FFmpegFrameWriter():
+    """
+    Streams uint8 RGB frames into an ffmpeg subprocess through stdin, so a video can be
+    written chunk by chunk instead of materializing every frame first. When audio_path
+    is given it is muxed in the same pass.
+
+    With a GPU profile the first `replay_frames` frames are kept: if nvenc dies while opening
+    the session (the usual failure) the encode restarts on libx264 and replays them.
+    """
+
+    def __init__(self, save_path, size, fps=25, ffmpeg='ffmpeg', crf=None, audio_path=None, profile=None,
+                 replay_frames=50):
+        width, height = int(size[0]), int(size[1])
+        self.save_path = save_path
+        self.size = (width, height)
+        self.fps = fps
+        self.ffmpeg = ffmpeg
+        self.audio_path = audio_path
+        self.frame_count = 0
+        if profile is None:
+            profile = get_encoding_profile('face', ffmpeg=ffmpeg, crf=crf)
+        self._replay = [] if profile.vcodec != 'libx264' else None
+        self._replay_frames = replay_frames
+        # hold a share of the x264 thread budget for as long as the encoder runs
+        self._slot = THREAD_BUDGET.slot()
+        self._threads = self._slot.__enter__()
+        self._token = None
+        try:
+            self._spawn(profile)
+        except BaseException:
+            # Popen failed (bad ffmpeg path, ...): give the threads back
+            self._slot.__exit__(None, None, None)
+            self._slot = None
+            raise
+
+    def _spawn(self, profile):
+        width, height = self.size
+        self.profile = profile
+        cmd = [self.ffmpeg, '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(self.fps),
+               '-i', '-']
+        if self.audio_path is not None:
+            cmd += ['-i', self.audio_path, '-map', '0:v', '-map', '1:a']
+        # yuv420p needs even dimensions
+        cmd += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2'] + profile.video_args(threads=self._threads)
+        if self.audio_path is not None:
+            cmd += ['-c:a', 'aac', '-shortest']
+        cmd += [self.save_path]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        # a cancelled job kills the encoder straight away
+        self._token = track_process(self.proc)
+
+    def _fall_back(self, err=''):
+        """ Restart on libx264 and replay the buffered frames; False once the buffer is gone. """
+        if self._replay is None:
+            return False
+        check_cancelled()
+        frames, self._replay = self._replay, None
+        err = self._kill() or err
+        print('[FFmpegFrameWriter] %s failed (%s), retrying with libx264' % (self.profile.vcodec, err.strip()))
+        self._spawn(cpu_fallback(self.profile))
+        for frame in frames:
+            self.proc.stdin.write(frame.tobytes())
+        return True
+
+    def _kill(self):
+        try:
+            self.proc.kill()
+        finally:
+            self.proc.wait()
+        err = self.proc.stderr.read().decode('utf-8', errors='ignore') if self.proc.stderr else ''
+        if self._token is not None:
+            self._token.untrack(self.proc)
+            self._token = None
+        return err
+
+    def write(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+            frame = cv2.resize(frame, self.size)
+        try:
+            self.proc.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            check_cancelled()
+            if not self._fall_back():
+                raise
+            self.proc.stdin.write(frame.tobytes())
+        if self._replay is not None:
+            self._replay.append(frame)
+            if len(self._replay) > self._replay_frames:
+                # the GPU encoder is running fine, stop keeping frames
+                self._replay = None
+        self.frame_count += 1
+
+    def write_frames(self, frames):
+        for frame in frames:
+            self.write(frame)
+
+    def close(self):
+        if self.proc.stdin and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        err = self.proc.stderr.read().decode('utf-8', errors='ignore')
+        self.proc.wait()
+        if self.proc.returncode != 0 and self._replay is not None:
+            # short clip: nvenc failed but every frame is still buffered
+            check_cancelled()
+            self._fall_back(err)
+            return self.close()
+        self._release_slot()
+        if self.proc.returncode != 0:
+            raise RuntimeError('ffmpeg frame writer failed: %s' % err)
+        return self.save_path
+
+    def abort(self):
+        try:
+            self.proc.kill()
+        finally:
+            self.proc.wait()
+            self._release_slot()
+
+    def _release_slot(self):
+        if self._token is not None:
+            self._token.untrack(self.proc)
+            self._token = None
+        if self._slot is not None:
+            self._slot.__exit__(None, None, None)
+            self._slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+            return False
+        self.close()
+        return False
+
+
 def save_video_with_watermark(video, audio, save_path, watermark=False):
     temp_file = str(uuid.uuid4())+'.mp4'
     cmd = r'ffmpeg -y -hide_banner -loglevel error -i "%s" -i "%s" -vcodec copy "%s"' % (video, audio, temp_file)
@@ -36,6 +180,10 @@ def save_video_with_watermark(video, audio, save_path, watermark=False):
             dir_path = os.path.dirname(os.path.realpath(__file__))
             watarmark_path = dir_path+"/../../docs/sadtalker_logo.png"
 
-        cmd = r'ffmpeg -y -hide_banner -loglevel error -i "%s" -i "%s" -filter_complex "[1]scale=100:-1[wm];[0][wm]overlay=(main_w-overlay_w)-10:10" "%s"' % (temp_file, watarmark_path, save_path)
-        os.system(cmd)
+        enc = get_encoding_profile('generic')
+        with THREAD_BUDGET.slot() as threads:
+            cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', temp_file, '-i', watarmark_path,
+                   '-filter_complex', '[1]scale=100:-1[wm];[0][wm]overlay=(main_w-overlay_w)-10:10']
+            cmd += enc.video_args(threads=threads) + ['-c:a', 'copy', save_path]
+            subprocess.run(cmd)
         os.remove(temp_file)
\ No newline at end of file
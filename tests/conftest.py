@@ -0,0 +1,20 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# AppConfig đọc env lúc import: trỏ mọi thư mục ghi ra vào 1 thư mục tạm, Redis giả trong process
+_TMP = tempfile.mkdtemp(prefix="lecture-tests-")
+os.environ.update({
+    "TMP_DIR": os.path.join(_TMP, "tmp"),
+    "UPLOAD_DIR": os.path.join(_TMP, "uploads"),
+    "RESULTS_DIR": os.path.join(_TMP, "results"),
+    "TTS_TMP_DIR": os.path.join(_TMP, "tmp", "tts"),
+    "TTS_CACHE_MAX_MB": "0",
+    "TTS_CONCURRENCY": "2",
+    "REDIS_URL": "fakeredis://",
+})
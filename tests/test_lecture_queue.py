@@ -0,0 +1,160 @@
+# tests/test_lecture_queue.py
+import os
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+lecture_job = pytest.importorskip("app.jobs.lecture_job")
+
+import worker
+from app.extenstions import init_extensions
+from app.services.storage_service import StorageService
+
+
+@pytest.fixture
+def queue():
+    conn = fakeredis.FakeRedis()
+    return init_extensions(connection=conn)
+
+
+def _drain(queue):
+    # burst: chạy hết job trong queue rồi trả về, ngay trong process test
+    w = worker.build_worker(connection=queue.connection, queue_names=[queue.name])
+    w.work(burst=True, with_scheduler=False)
+
+
+def test_enqueued_job_runs_on_burst_worker(queue, monkeypatch):
+    store = StorageService()
+    job_id = store.create_job()
+    ran = []
+
+    def fake_run(store, job_id):
+        ran.append(job_id)
+        store.write_progress(job_id, {"state": "done", "message": "ok", "updated_at": int(time.time())})
+        return {"ok": True}
+
+    monkeypatch.setattr(lecture_job, "_run_lecture_job", fake_run)
+
+    job = lecture_job.enqueue_lecture_job(job_id)
+    assert job.id == lecture_job.rq_job_id(job_id)
+    assert queue.count == 1
+
+    _drain(queue)
+
+    assert ran == [job_id]
+    assert job.get_status(refresh=True) == "finished"
+    assert job.return_value() == {"ok": True}
+    assert store.read_progress(job_id)["state"] == "done"
+
+
+def test_crashed_job_is_marked_failed(queue, monkeypatch):
+    store = StorageService()
+    job_id = store.create_job()
+
+    def crash(store, job_id):
+        raise RuntimeError("worker blew up")
+
+    monkeypatch.setattr(lecture_job, "_run_lecture_job", crash)
+
+    job = lecture_job.enqueue_lecture_job(job_id)
+    _drain(queue)
+
+    assert job.get_status(refresh=True) == "failed"
+    prog = store.read_progress(job_id)
+    assert prog["state"] == "failed"
+    assert "worker blew up" in prog["message"]
+
+
+def test_fan_out_ships_ids_only_and_supersedes_previous_run(queue, monkeypatch):
+    from rq.job import Job
+
+    store = StorageService()
+    job_id = store.create_job()
+    out_dir = store.job_result_dir(job_id)
+    slides = [{"text": f"slide {i}"} for i in range(3)]
+    plan = lecture_job.LecturePlan(
+        job_id=job_id, output_dir=out_dir, source_image="teacher.png", params=lecture_job.LectureParams(),
+        canvas=(640, 360), keys=[f"k{i}" for i in range(3)], reused={}, old_manifest={},
+    )
+    rendered, reduced, runs = [], [], []
+
+    class FakeRenderer:
+        def __init__(self, plan, sad_service, tts_service, progress_cb=None):
+            pass
+
+        def run_one(self, index, slide_data):
+            rendered.append((index, slide_data["text"]))
+            return {"slide_mp4": plan.segment_path(index), "audio_duration": 1.0}
+
+    def fake_finish(plan, results):
+        reduced.append(plan.total)
+        return None, "no video"
+
+    def fan_out_twice(store, job_id):
+        # job bị chạy lại trong khi subtask của lần đầu vẫn còn trong queue
+        for _ in range(2):
+            lecture_job._fan_out(store, job_id, None, "teacher.png", plan.params, "")
+            runs.append(store.load_fanout(job_id)["run_id"])
+        return {"ok": True}
+
+    monkeypatch.setattr(lecture_job, "resolve_slides", lambda *a: (slides, ""))
+    monkeypatch.setattr(lecture_job, "plan_lecture", lambda *a: (plan, ""))
+    monkeypatch.setattr(lecture_job, "SlideRenderer", FakeRenderer)
+    monkeypatch.setattr(lecture_job, "SadTalkerService", lambda: None)
+    monkeypatch.setattr(lecture_job, "TTSService", lambda: None)
+    monkeypatch.setattr(lecture_job, "finish_lecture", fake_finish)
+    monkeypatch.setattr(lecture_job, "_run_lecture_job", fan_out_twice)
+
+    lecture_job.enqueue_lecture_job(job_id)
+    _drain(queue)
+
+    assert runs[0] != runs[1]
+    # subtask chỉ mang (job_id, run_id, index), plan đọc từ storage
+    task = Job.fetch(lecture_job._slide_job_id(job_id, runs[1], 0), connection=queue.connection)
+    assert task.args == (job_id, runs[1], 0)
+    # lần fan-out đầu bị cancel, mỗi slide chỉ render 1 lần, reduce chạy 1 lần
+    old = Job.fetch(lecture_job._slide_job_id(job_id, runs[0], 0), connection=queue.connection)
+    assert old.get_status() == "canceled"
+    assert sorted(rendered) == [(i, f"slide {i}") for i in range(3)]
+    assert reduced == [3]
+
+
+def test_superseded_slide_task_does_nothing(queue):
+    store = StorageService()
+    job_id = store.create_job()
+    store.save_fanout(job_id, "newrun", object(), [])
+    assert lecture_job.run_slide_task(job_id, "oldrun", 0)["status"] == "superseded"
+    assert lecture_job.finish_lecture_task(job_id, "oldrun")["status"] == "superseded"
+
+
+def test_concurrent_progress_writes_do_not_collide():
+    from concurrent.futures import ThreadPoolExecutor
+
+    store = StorageService()
+    job_id = store.create_job()
+
+    def write(n):
+        for k in range(20):
+            store.write_progress(job_id, {"state": "running", "current": n, "k": k})
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(write, range(8)))
+
+    assert store.read_progress(job_id)["state"] == "running"
+    assert not [f for f in os.listdir(store.job_result_dir(job_id)) if f.endswith(".tmp")]
+
+
+def test_fanout_progress_failure_is_only_logged(monkeypatch):
+    store = StorageService()
+    job_id = store.create_job()
+    plan = lecture_job.LecturePlan(
+        job_id=job_id, output_dir=store.job_result_dir(job_id), source_image="teacher.png",
+        params=lecture_job.LectureParams(), canvas=(640, 360), keys=["k0"], reused={}, old_manifest={},
+    )
+
+    def broken(*a, **kw):
+        raise FileNotFoundError("progress.json.tmp")
+
+    monkeypatch.setattr(store, "write_progress", broken)
+    lecture_job._report_fanout_progress(store, job_id, plan)
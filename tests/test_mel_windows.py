@@ -0,0 +1,49 @@
+# tests/test_mel_windows.py
+import numpy as np
+import pytest
+import torch
+
+generate_batch = pytest.importorskip("src.generate_batch")
+from src.audio2exp_models.audio2exp import Audio2Exp
+
+
+@pytest.mark.parametrize("num_frames,block_size", [(1, 4), (37, 8), (250, 64), (250, 1024)])
+def test_iter_mel_windows_matches_mel_windows(num_frames, block_size):
+    rng = np.random.default_rng(0)
+    # melspectrogram ra ~3.2 hàng / frame video ở 25 fps
+    orig_mel = rng.standard_normal((int(num_frames * 3.2) + 1, 80)).astype(np.float32)
+
+    blocks = list(generate_batch.iter_mel_windows(orig_mel, num_frames, block_size=block_size))
+
+    assert [start for start, _ in blocks] == list(range(0, num_frames, block_size))
+    np.testing.assert_array_equal(np.concatenate([b for _, b in blocks]),
+                                  generate_batch.mel_windows(orig_mel, num_frames))
+
+
+class _FrameNet(torch.nn.Module):
+    # như SimpleWrapperV2: mỗi frame độc lập, ra bs T 64
+    def forward(self, audiox, ref, ratio):
+        bs, T = ref.shape[0], ref.shape[1]
+        feat = audiox.reshape(bs, T, -1)[:, :, :64]
+        return feat + ref[:, :, :64] + ratio.reshape(bs, T, 1)
+
+
+def test_audio2exp_streams_same_coefficients_as_full_windows():
+    rng = np.random.default_rng(1)
+    T = 300
+    orig_mel = rng.standard_normal((int(T * 3.2) + 1, 80)).astype(np.float32)
+    batch = {
+        'orig_mel': orig_mel,
+        'num_frames': T,
+        'ref': torch.randn(1, T, 70),
+        'ratio_gt': torch.randn(1, T, 1),
+    }
+    model = Audio2Exp(_FrameNet(), cfg=None, device='cpu')
+    model.frames_per_pass = 64
+
+    got = model.test(batch)['exp_coeff_pred']
+
+    full = generate_batch.mel_window_tensor(generate_batch.mel_windows(orig_mel, T), 'cpu')
+    expected = _FrameNet()(full.reshape(-1, 1, 80, 16), batch['ref'][:, :, :64], batch['ratio_gt'])
+    assert got.shape == (1, T, 64)
+    torch.testing.assert_close(got, expected)
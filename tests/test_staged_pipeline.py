@@ -0,0 +1,34 @@
+# tests/test_staged_pipeline.py
+import pytest
+
+from app.services.staged_pipeline import StagedPipeline
+
+
+def test_dropped_item_still_reaches_on_skip_in_order():
+    seen = []
+
+    def prepare(i, v):
+        return None if i == 1 else v
+
+    def render(i, v):
+        seen.append(("render", i))
+        return v * 10
+
+    pipeline = StagedPipeline([("prepare", prepare), ("render", render)],
+                              on_skip=lambda stage, i: seen.append((f"skip-{stage}", i)))
+
+    assert pipeline.run([1, 2, 3]) == [10, None, 30]
+    # progress kiểu current/total: item bị bỏ vẫn đi qua stage sau, đúng thứ tự
+    assert seen == [("render", 0), ("skip-render", 1), ("render", 2)]
+
+
+def test_on_skip_error_stops_pipeline():
+    class Stop(Exception):
+        pass
+
+    def on_skip(stage, i):
+        raise Stop()
+
+    pipeline = StagedPipeline([("prepare", lambda i, v: None), ("render", lambda i, v: v)], on_skip=on_skip)
+    with pytest.raises(Stop):
+        pipeline.run([1, 2])
@@ -0,0 +1,52 @@
+# tests/test_tts_cache.py
+import os
+import time
+
+import pytest
+
+from app.services.tts_cache import TTSCache
+
+
+def _audio(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TTSCache(str(tmp_path / "cache"), max_bytes=1000, tmp_dir=str(tmp_path / "tmp"))
+
+
+def _key(i):
+    return TTSCache.make_key(f"slide {i}", "vi", "voice", 1.0, "edge")
+
+
+def test_get_and_put_under_limit_do_not_scan(cache, tmp_path, monkeypatch):
+    cache.put(_key(0), _audio(tmp_path, "a.mp3", 100))   # lần đầu: scan 1 lần lấy tổng
+
+    def no_scan():
+        raise AssertionError("directory scanned")
+
+    monkeypatch.setattr(cache, "_entries", no_scan)
+    cache.put(_key(1), _audio(tmp_path, "b.wav", 100))
+    hit = cache.get(_key(1))
+
+    assert hit.endswith(".wav") and os.path.getsize(hit) == 100
+    assert cache.get(_key(2)) is None
+    assert cache._total == 200
+
+
+def test_put_over_limit_evicts_least_recently_used(cache, tmp_path):
+    cache.max_bytes = 1300   # vừa 3 file, file thứ 4 phải đẩy 1 file ra
+    for i in range(3):
+        cache.put(_key(i), _audio(tmp_path, f"{i}.mp3", 400))
+        # mtime phân biệt được thứ tự LRU
+        os.utime(cache._find(_key(i)), (time.time() - 100 + i, time.time() - 100 + i))
+
+    assert cache.get(_key(0)) is not None   # chạm slide 0 -> slide 1 là cũ nhất
+    cache.put(_key(3), _audio(tmp_path, "3.mp3", 400))
+
+    assert cache._find(_key(1)) is None
+    assert cache._find(_key(0)) is not None and cache._find(_key(3)) is not None
+    assert cache._total == cache.total_bytes() <= cache.max_bytes
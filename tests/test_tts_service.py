@@ -0,0 +1,76 @@
+# tests/test_tts_service.py
+import asyncio
+import os
+import time
+
+import pytest
+
+tts_service = pytest.importorskip("app.services.tts_service")
+TTSRequest = tts_service.TTSRequest
+
+
+class StubCommunicate:
+    """ Thay edge_tts.Communicate: ghi text ra file, đếm số request chạy cùng lúc. """
+    active = 0
+    peak = 0
+    delay = 0.05
+
+    def __init__(self, text, voice, rate, volume):
+        self.text = text
+
+    async def save(self, path):
+        cls = type(self)
+        cls.active += 1
+        cls.peak = max(cls.peak, cls.active)
+        try:
+            await asyncio.sleep(cls.delay)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.text)
+        finally:
+            cls.active -= 1
+
+
+@pytest.fixture
+def stub():
+    StubCommunicate.active = StubCommunicate.peak = 0
+    StubCommunicate.delay = 0.05
+    return StubCommunicate
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_synthesize_many_keeps_request_order(stub):
+    svc = tts_service.TTSService(communicate_cls=stub)
+    futures = svc.synthesize_many([TTSRequest(text=f"slide {i}") for i in range(5)])
+
+    paths = [f.result(timeout=10) for f in futures]
+    assert [_read(p) for p in paths] == [f"slide {i}" for i in range(5)]
+    for p in paths:
+        os.remove(p)
+
+
+def test_concurrency_limit_is_shared_across_batches(stub):
+    # TTS_CONCURRENCY=2 (conftest): 2 batch song song vẫn chỉ 2 request edge-tts cùng lúc
+    svc = tts_service.TTSService(communicate_cls=stub)
+    a = svc.synthesize_many([TTSRequest(text=f"a{i}") for i in range(4)], concurrency=2)
+    b = svc.synthesize_many([TTSRequest(text=f"b{i}") for i in range(4)], concurrency=2)
+
+    for f in a + b:
+        os.remove(f.result(timeout=10))
+    assert stub.peak == 2
+
+
+def test_discard_cancels_pending_and_removes_outputs(stub):
+    stub.delay = 0.5
+    svc = tts_service.TTSService(communicate_cls=stub)
+    futures = svc.synthesize_many([TTSRequest(text=f"x{i}") for i in range(4)])
+
+    time.sleep(0.1)   # 2 request đầu đang chạy, 2 request sau đang chờ limiter
+    tts_service.TTSService.discard(futures)
+
+    assert all(f.cancelled() for f in futures)
+    time.sleep(0.6)
+    assert not [n for n in os.listdir(svc.cfg.TTS_TMP_DIR) if n.endswith(".mp3")]
@@ -0,0 +1,17 @@
+# tests/test_videoio.py
+import pytest
+
+videoio = pytest.importorskip("src.utils.videoio")
+from src.utils.encoding import THREAD_BUDGET, EncodingProfile
+
+
+def test_frame_writer_returns_thread_slot_when_ffmpeg_cannot_start(tmp_path):
+    before = (THREAD_BUDGET.active, THREAD_BUDGET.claimed)
+
+    # excinfo giữ traceback (và writer dở dang) sống như caller log lỗi: slot phải trả ngay, không đợi GC
+    with pytest.raises(OSError) as excinfo:
+        videoio.FFmpegFrameWriter(str(tmp_path / "out.mp4"), (64, 64), ffmpeg=str(tmp_path / "no-ffmpeg"),
+                                  profile=EncodingProfile(kind="face"))
+
+    assert excinfo.value is not None
+    assert (THREAD_BUDGET.active, THREAD_BUDGET.claimed) == before
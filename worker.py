@@ -1,23 +1,181 @@
 # worker.py
+"""
+Supervisor cho RQ worker:
+
+    python worker.py                 # WORKER_COUNT process, mỗi process WORKER_THREADS thread
+    python worker.py -n 3 -t 4       # 3 worker, 4 thread torch/BLAS mỗi worker
+    python worker.py --burst         # chạy hết queue rồi thoát
+
+Mỗi worker là 1 process riêng (spawn) chạy LectureWorker (SimpleWorker): job chạy ngay trong process đó
+nên model SadTalker trong registry giữ warm giữa các job. Số thread torch/BLAS/ffmpeg được
+giới hạn và process được pin vào một nhóm core riêng để các job chạy song song không tranh core.
+"""
+import argparse
+import multiprocessing as mp
 import os
-from redis import Redis
+import signal
+import socket
+import time
+
 from rq import Queue
 from rq.worker import SimpleWorker
-from rq.timeouts import NoDeathPenalty
+from rq.timeouts import TimerDeathPenalty
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "video_jobs")
+from app.config import get_config
 
-listen = [QUEUE_NAME]
-conn = Redis.from_url(REDIS_URL)
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+
+def _available_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_groups(n_workers: int, cpus: list[int] | None = None) -> list[list[int]]:
+    """ Chia core thành n_workers nhóm liền nhau; nhiều worker hơn core thì các worker dùng chung core. """
+    cpus = cpus or _available_cpus()
+    n_workers = max(1, int(n_workers))
+    if n_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(n_workers)]
+    size, extra = divmod(len(cpus), n_workers)
+    groups, start = [], 0
+    for i in range(n_workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+
+def _pin_process(cpus: list[int]):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        else:
+            import psutil  # Windows / macOS
+            psutil.Process().cpu_affinity(cpus)
+    except Exception as e:
+        print(f"[worker] cannot pin to cpus {cpus}: {e}")
+
+
+def _limit_threads(threads: int):
+    # phải chạy trước khi import torch / numpy trong process con
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    os.environ["FFMPEG_THREAD_BUDGET"] = str(threads)
+
+
+class LectureWorker(SimpleWorker):
+    """ Chạy job ngay trong process worker (không fork mỗi job) để model giữ warm. """
+    death_penalty_class = TimerDeathPenalty   # ✅ Windows: timeout bằng timer thread, không dùng SIGALRM
+
+
+def build_worker(connection=None, queue_names: list[str] | None = None, name: str | None = None):
+    """ LectureWorker trên queue của app; connection truyền vào (vd FakeRedis) để test với burst=True. """
+    from app.extenstions import get_redis
+
+    conn = connection if connection is not None else get_redis()
+    queue_names = queue_names or [get_config().RQ_QUEUE_NAME]
+    queues = [Queue(q, connection=conn) for q in queue_names]
+
+    return LectureWorker(queues, connection=conn, name=name)
 
-if __name__ == "__main__":
-    queues = [Queue(name, connection=conn) for name in listen]
 
-    worker = SimpleWorker(
-        queues,
-        connection=conn,
-        death_penalty_class=NoDeathPenalty,   # ✅ Windows: không dùng SIGALRM
-    )
+def _warm_models():
+    # load sẵn model SadTalker mặc định (256 / crop) để job đầu tiên không phải chờ
+    from app.services.sadtalker_service import SadTalkerService
+    svc = SadTalkerService()
+    with svc.registry.use(256, "crop", svc._sad.device):
+        pass
+
+
+def _worker_main(index: int, cpus: list[int], threads: int, queue_names: list[str], burst: bool, preload: bool):
+    _limit_threads(threads)
+    _pin_process(cpus)
+
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    print(f"[worker {index}] pid={os.getpid()} cpus={cpus} threads={threads}")
+    if preload:
+        _warm_models()
+
+    name = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    worker = build_worker(queue_names=queue_names, name=name)
+    worker.work(burst=burst, with_scheduler=False)
+
+
+class WorkerSupervisor:
+    """ Giữ n_workers process worker sống: process nào chết (OOM, crash) thì start lại cái mới. """
+
+    def __init__(self, n_workers: int, threads: int = 0, queue_names: list[str] | None = None,
+                 burst: bool = False, preload: bool = False):
+        self.groups = cpu_groups(n_workers)
+        self.threads = threads
+        self.queue_names = queue_names or [get_config().RQ_QUEUE_NAME]
+        self.burst = burst
+        self.preload = preload
+        self._ctx = mp.get_context("spawn")   # process con sạch, không fork state torch của cha
+        self._procs: list[mp.Process | None] = [None] * len(self.groups)
+        self._stopping = False
+
+    def _start(self, index: int):
+        cpus = self.groups[index]
+        threads = self.threads or len(cpus)
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(index, cpus, threads, self.queue_names, self.burst, self.preload),
+            name=f"lecture-worker-{index}",
+        )
+        p.start()
+        self._procs[index] = p
+
+    def stop(self, *_):
+        self._stopping = True
+        for p in self._procs:
+            if p is not None and p.is_alive():
+                p.terminate()   # SIGTERM -> RQ warm shutdown: làm xong job đang chạy rồi thoát
+
+    def run(self, poll_interval: float = 2.0):
+        for i in range(len(self.groups)):
+            self._start(i)
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        while True:
+            alive = 0
+            for i, p in enumerate(self._procs):
+                if p.is_alive():
+                    alive += 1
+                    continue
+                if self._stopping or (self.burst and p.exitcode == 0):
+                    continue
+                print(f"[worker] worker {i} exited with {p.exitcode}, restarting")
+                self._start(i)
+                alive += 1
+            if alive == 0:
+                break
+            time.sleep(poll_interval)
+
+        for p in self._procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    cfg = get_config()
+    parser = argparse.ArgumentParser(description="Start lecture RQ workers")
+    parser.add_argument("-n", "--workers", type=int, default=cfg.WORKER_COUNT)
+    parser.add_argument("-t", "--threads", type=int, default=cfg.WORKER_THREADS,
+                        help="torch/BLAS threads per worker (0 = cores of its group)")
+    parser.add_argument("-q", "--queue", action="append", help="queue name (default RQ_QUEUE_NAME)")
+    parser.add_argument("--burst", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--preload", action="store_true", help="load SadTalker models before taking jobs")
+    args = parser.parse_args()
 
-    worker.work(with_scheduler=False)
\ No newline at end of file
+    WorkerSupervisor(args.workers, args.threads, args.queue, burst=args.burst, preload=args.preload).run()